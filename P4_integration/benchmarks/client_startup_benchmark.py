@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Client Startup Benchmark
+
+Measures the wall-clock time of short bookstore_client/client.py commands,
+each run in a fresh interpreter as a cron job would: importing the client,
+--help, and `get` and `list` against the API started with a small catalog.
+For reference it also times a bare interpreter and importing the
+dependencies the client used to load on startup.
+
+Usage:
+    python benchmarks/client_startup_benchmark.py --runs 20
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from load_benchmark import free_port, start_server
+from memory_benchmark import synthetic_catalog
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bookstore_client')
+
+
+def time_command(args, runs, env):
+    """Return the run times in seconds of a command, after one unrecorded warm-up run."""
+    times = []
+    for i in range(runs + 1):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=CLIENT_DIR, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if i:
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help="runs of each command (default: 10)")
+    parser.add_argument('--books', type=int, default=100, help="books in the catalog listed (default: 100)")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    server = None
+    try:
+        data_file = os.path.join(tmp_dir, 'books.json')
+        text = synthetic_catalog(args.books)
+        with open(data_file, 'w') as f:
+            f.write(text)
+        book_id = json.loads(text)[0]['id']
+        server, url = start_server(data_file, free_port(), {})
+
+        env = dict(os.environ, BOOKSTORE_API_URL=f"{url}/api")
+        python = sys.executable
+        commands = [
+            ('python (no imports)', [python, '-c', 'pass']),
+            ('import requests, colorama', [python, '-c', 'import requests, colorama']),
+            ('import client', [python, '-c', 'import client']),
+            ('client.py --help', [python, 'client.py', '--help']),
+            ('client.py get', [python, 'client.py', 'get', book_id]),
+            ('client.py list', [python, 'client.py', 'list']),
+        ]
+
+        print(f"{'Command':<28}{'Min (ms)':>10}{'Median (ms)':>13}{'Max (ms)':>10}")
+        for name, command in commands:
+            times = time_command(command, args.runs, env)
+            print(f"{name:<28}{min(times) * 1000:>10.1f}{statistics.median(times) * 1000:>13.1f}"
+                  f"{max(times) * 1000:>10.1f}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
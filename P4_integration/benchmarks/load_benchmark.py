@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Bookstore API Load Benchmark
+
+Starts the API (bookstore_api/app.py) in a subprocess with latency injection
+disabled and a synthetic catalog, drives a mixed read/write/search workload
+at a fixed concurrency and reports the latency percentiles and throughput of
+every route. Results can be written as JSON and compared with an earlier run.
+
+Usage:
+    python benchmarks/load_benchmark.py --books 100000 --concurrency 16 --duration 30 \\
+        --output results.json --baseline previous.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from memory_benchmark import synthetic_catalog
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bookstore_api')
+
+# Operations of the workload, named after the Flask endpoints they exercise
+OPERATIONS = ('get_books', 'get_book', 'search_books', 'add_book', 'update_book', 'delete_book')
+
+# Default share of each operation (relative weights)
+DEFAULT_MIX = 'get_books=30,get_book=35,search_books=20,add_book=5,update_book=7,delete_book=3'
+
+# Words the synthetic titles and authors are made of
+SEARCH_TERMS = ('title 1', 'book', 'of', 'the', 'author 12', 'and book', 'title 99')
+
+# Seconds to wait for the server to start
+STARTUP_TIMEOUT = 120
+
+
+def parse_mix(text):
+    """Parse "operation=weight,..." into a dict of weights."""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("At least one operation needs a positive weight")
+    return mix
+
+
+def free_port():
+    """Return a TCP port that is free on localhost."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(data_file, port, env_overrides):
+    """Start the API in a subprocess and wait until it answers."""
+    env = dict(os.environ)
+    env.update({
+        'BOOKSTORE_DATA_FILE': data_file,
+        'BOOKSTORE_SQLITE_FILE': os.path.join(os.path.dirname(data_file), 'books.db'),
+        'BOOKSTORE_LATENCY_PROFILE': 'zero',
+    })
+    env.update(env_overrides)
+    code = f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"
+    server = subprocess.Popen(
+        [sys.executable, '-c', code], cwd=API_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with status {server.returncode}")
+        try:
+            requests.get(f"{url}/api/books", params={'limit': 1}, timeout=1)
+            return server, url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("Server did not start in time")
+
+
+class Worker(threading.Thread):
+    """Sends requests in a loop and records the latency of each one."""
+
+    def __init__(self, url, mix, book_ids, deadline, seed):
+        super().__init__(daemon=True)
+        self.url = url
+        self.operations = list(mix)
+        self.weights = list(mix.values())
+        self.book_ids = book_ids
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.added = []  # IDs of books this worker added and may delete
+        self.samples = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            name = self.rng.choices(self.operations, self.weights)[0]
+            if name == 'delete_book' and not self.added:
+                name = 'add_book'
+            method, path, kwargs = getattr(self, name)()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, self.url + path, **kwargs)
+                ok = response.ok
+            except requests.exceptions.RequestException:
+                response, ok = None, False
+            self.samples[name].append(time.perf_counter() - start)
+            if not ok:
+                self.errors[name] += 1
+            elif name == 'add_book':
+                self.added.append(response.json()['id'])
+
+    def random_book(self):
+        return self.rng.choice(self.book_ids)
+
+    def get_books(self):
+        return 'GET', '/api/books', {'params': {'limit': 50}}
+
+    def get_book(self):
+        return 'GET', f"/api/books/{self.random_book()}", {}
+
+    def search_books(self):
+        return 'GET', '/api/books/search', {'params': {'query': self.rng.choice(SEARCH_TERMS), 'limit': 20}}
+
+    def add_book(self):
+        book = {
+            'title': f"Load Test {self.rng.randrange(10 ** 6)}",
+            'author': 'Load Tester',
+            'price': round(self.rng.uniform(1, 100), 2),
+            'in_stock': True
+        }
+        return 'POST', '/api/books', {'json': book}
+
+    def update_book(self):
+        return 'PUT', f"/api/books/{self.random_book()}", {'json': {'price': round(self.rng.uniform(1, 100), 2)}}
+
+    def delete_book(self):
+        return 'DELETE', f"/api/books/{self.added.pop()}", {}
+
+
+def percentile(sorted_samples, fraction):
+    """Return the nearest-rank percentile of sorted samples."""
+    if not sorted_samples:
+        return None
+    index = max(0, min(len(sorted_samples) - 1, round(fraction * len(sorted_samples) + 0.5) - 1))
+    return sorted_samples[index]
+
+
+def summarize(samples, errors, elapsed):
+    """Return the statistics of one route (latencies in milliseconds)."""
+    samples = sorted(samples)
+    stats = {
+        'requests': len(samples),
+        'errors': errors,
+        'requests_per_sec': round(len(samples) / elapsed, 2),
+    }
+    for label, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+        value = percentile(samples, fraction)
+        stats[label] = round(value * 1000, 3) if value is not None else None
+    stats['max_ms'] = round(samples[-1] * 1000, 3) if samples else None
+    return stats
+
+
+def run_load(url, mix, book_ids, concurrency, duration, seed):
+    """Run the workload and return the per-route and overall statistics."""
+    deadline = time.monotonic() + duration
+    workers = [Worker(url, mix, book_ids, deadline, seed + i) for i in range(concurrency)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for name in OPERATIONS:
+        samples = [s for worker in workers for s in worker.samples[name]]
+        if samples:
+            routes[name] = summarize(samples, sum(w.errors[name] for w in workers), elapsed)
+    every_sample = [s for worker in workers for name in OPERATIONS for s in worker.samples[name]]
+    every_error = sum(sum(worker.errors.values()) for worker in workers)
+    return routes, summarize(every_sample, every_error, elapsed), elapsed
+
+
+def print_table(routes, overall, baseline=None):
+    """Print the statistics, with the change against a baseline run if given."""
+    print(f"{'Route':<14}{'Requests':>10}{'Errors':>8}{'Req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = list(routes.items()) + [('overall', overall)]
+    for name, stats in rows:
+        print(f"{name:<14}{stats['requests']:>10}{stats['errors']:>8}{stats['requests_per_sec']:>10.1f}"
+              f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+        if baseline is None:
+            continue
+        before = baseline['overall'] if name == 'overall' else baseline['routes'].get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('requests_per_sec', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if before.get(key):
+                changes.append(f"{key} {(stats[key] - before[key]) / before[key]:+.1%}")
+        print(f"{'':<14}vs baseline: {', '.join(changes)}")
+
+
+def main():
+    """Run the benchmark and print (and optionally save) the results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=10000, help="books in the synthetic catalog (default: 10000)")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent clients (default: 8)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to run the workload (default: 10)")
+    parser.add_argument('--warmup', type=float, default=2, help="seconds of unrecorded warm-up (default: 2)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"relative weight of each operation (default: {DEFAULT_MIX})")
+    parser.add_argument('--storage', choices=('json', 'sqlite'), default='json', help="storage backend (default: json)")
+    parser.add_argument('--persist-policy', default='write-through', help="persistence policy of the json backend")
+    parser.add_argument('--no-cache', action='store_true', help="disable the server's query cache")
+    parser.add_argument('--seed', type=int, default=1, help="random seed of the workload (default: 1)")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    tmp_dir = tempfile.mkdtemp()
+    server = None
+    try:
+        data_file = os.path.join(tmp_dir, 'books.json')
+        print(f"Seeding {args.books:,} books...")
+        text = synthetic_catalog(args.books)
+        with open(data_file, 'w') as f:
+            f.write(text)
+        book_ids = [book['id'] for book in json.loads(text)]
+        del text
+
+        env_overrides = {'BOOKSTORE_STORAGE': args.storage, 'BOOKSTORE_PERSIST_POLICY': args.persist_policy}
+        if args.no_cache:
+            env_overrides['BOOKSTORE_QUERY_CACHE_SIZE'] = '0'
+        server, url = start_server(data_file, free_port(), env_overrides)
+
+        if args.warmup > 0:
+            run_load(url, args.mix, book_ids, args.concurrency, args.warmup, args.seed + 10 ** 6)
+        print(f"Running {args.concurrency} clients for {args.duration:g}s against {url}...")
+        routes, overall, elapsed = run_load(url, args.mix, book_ids, args.concurrency, args.duration, args.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print_table(routes, overall, baseline)
+    if args.output:
+        results = {
+            'config': {
+                'books': args.books,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'mix': args.mix,
+                'storage': args.storage,
+                'persist_policy': args.persist_policy,
+                'query_cache': not args.no_cache,
+                'seed': args.seed,
+                'python': sys.version.split()[0],
+            },
+            'elapsed': round(elapsed, 3),
+            'routes': routes,
+            'overall': overall,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Catalog Memory Benchmark
+
+Compares the memory needed to hold a synthetic catalog as one dict per book
+(keyed by ID, as books.json is parsed) with the columnar representation used
+by BookCatalog (see bookstore_api/columns.py), and measures a whole loaded
+BookCatalog: the columns plus its order and price indexes and the search
+index (lowercased text and trigram postings), which takes most of the
+server's memory.
+
+Usage:
+    python benchmarks/memory_benchmark.py --books 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bookstore_api'))
+
+from catalog import BookCatalog  # noqa: E402
+from columns import BookColumns  # noqa: E402
+
+
+def synthetic_catalog(count, authors=50000, seed=42):
+    """Return the books.json text of a synthetic catalog."""
+    rng = random.Random(seed)
+    books = [
+        {
+            'id': f"{i:08x}",
+            'title': f"Title {i} {rng.choice(('of', 'and', 'the'))} Book",
+            'author': f"Author {rng.randrange(authors)}",
+            'price': round(rng.uniform(1, 100), 2),
+            'in_stock': rng.random() < 0.8
+        }
+        for i in range(count)
+    ]
+    return json.dumps(books)
+
+
+def measure(build, source):
+    """Return (bytes retained, seconds) to build a representation from the JSON text (or file)."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    catalog = build(source)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if hasattr(catalog, 'close'):
+        catalog.close()
+    del catalog
+    return retained, elapsed
+
+
+def build_dicts(text):
+    """One dict per book, keyed by ID (the previous in-memory catalog)."""
+    return {book['id']: book for book in json.loads(text)}
+
+
+def build_columns(text):
+    """Columns plus the ID to row map, as held by BookCatalog."""
+    columns = BookColumns()
+    rows = {book['id']: columns.append(book) for book in json.loads(text)}
+    return columns, rows
+
+
+def build_catalog(path):
+    """A BookCatalog loaded from books.json, once its search index is complete."""
+    catalog = BookCatalog(path)
+    catalog.wait_until_indexed()
+    return catalog
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=1000000, help="number of books (default: 1000000)")
+    parser.add_argument('--authors', type=int, default=50000, help="number of distinct authors (default: 50000)")
+    args = parser.parse_args()
+
+    print(f"Generating {args.books:,} books by {args.authors:,} authors...")
+    text = synthetic_catalog(args.books, authors=args.authors)
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'books.json')
+        with open(path, 'w') as f:
+            f.write(text)
+        results = [
+            ('dict per book', *measure(build_dicts, text)),
+            ('columns', *measure(build_columns, text)),
+            ('BookCatalog', *measure(build_catalog, path)),
+        ]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"{'Representation':<16}{'Memory (MiB)':>14}{'Bytes/book':>12}{'Build (s)':>11}")
+    for name, retained, elapsed in results:
+        print(f"{name:<16}{retained / 2 ** 20:>14.1f}{retained / args.books:>12.0f}{elapsed:>11.2f}")
+    dicts, columns, catalog = (retained for _, retained, _ in results)
+    print(f"Columns use {columns / dicts:.0%} of the memory of one dict per book.")
+    print(f"A loaded BookCatalog uses {catalog / dicts:.1f}x that memory; its indexes "
+          f"(mostly the search index) account for {(catalog - columns) / catalog:.0%} of it.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Catalog Startup Benchmark
+
+Measures how long BookCatalog takes to load synthetic catalogs of several
+sizes from books.json alone and from its binary snapshot, and how long it
+takes until searches are served from the index rather than by scanning.
+
+Usage:
+    python benchmarks/startup_benchmark.py --books 10000 100000 1000000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bookstore_api'))
+
+from catalog import BookCatalog  # noqa: E402
+from memory_benchmark import synthetic_catalog  # noqa: E402
+
+
+def measure(path, binary_snapshot):
+    """Return (seconds to load, seconds until indexed) for a cold start."""
+    start = time.perf_counter()
+    catalog = BookCatalog(path, binary_snapshot=binary_snapshot)
+    loaded = time.perf_counter() - start
+    catalog.wait_until_indexed()
+    indexed = time.perf_counter() - start
+    catalog.close()
+    return loaded, indexed
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="catalog sizes to load (default: 10000 100000 1000000)")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'Books':>10}{'Source':>10}{'Size (MiB)':>12}{'Load (s)':>10}{'Indexed (s)':>13}")
+        for count in args.books:
+            path = os.path.join(tmp_dir, 'books.json')
+            with open(path, 'w') as f:
+                f.write(synthetic_catalog(count))
+            snapshot_path = f"{path}.snapshot"
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+
+            json_times = measure(path, binary_snapshot=False)
+            # The first start with binary_snapshot writes the snapshot; the second reads it
+            measure(path, binary_snapshot=True)
+            snapshot_times = measure(path, binary_snapshot=True)
+
+            for source, size, (loaded, indexed) in (
+                ('json', os.path.getsize(path), json_times),
+                ('snapshot', os.path.getsize(snapshot_path), snapshot_times),
+            ):
+                print(f"{count:>10,}{source:>10}{size / 2 ** 20:>12.1f}{loaded:>10.2f}{indexed:>13.2f}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
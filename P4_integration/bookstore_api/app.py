@@ -4,18 +4,76 @@ Bookstore API
 
 A RESTful Flask application that provides endpoints to manage books.
 """
-from flask import Flask, jsonify, request, abort
+from flask import Flask, Response, g, jsonify, request, abort
 from flask_cors import CORS
-import json
+from werkzeug.exceptions import HTTPException
+import atexit
+import base64
+import binascii
+from collections import defaultdict
+import cProfile
+from datetime import datetime, timezone
+import math
 import os
+import random
 import time
 import uuid
 
+from catalog import WRITE_THROUGH, DEFAULT_COMPACT_THRESHOLD
+from change_feed import ChangeFeed, DEFAULT_CAPACITY
+from latency import FIXED, LatencyProfile
+from metrics import (
+    COMPUTE, DELAY, LOAD, PERSIST, SERIALIZE,
+    MetricsRegistry, ProfileSampler, phase
+)
+from query_cache import QueryCache
+from storage import JSON_STORAGE, PreconditionFailed, open_storage
+from search_index import MATCH_MODES, SUBSTRING
+from serialization import (
+    CONTENT_CODINGS, FORMAT_TAGS, JSON_MIMETYPE, MSGPACK_MIMETYPES,
+    available_mimetypes, compress, decode, dumps_json, encode
+)
+
 app = Flask(__name__)
-CORS(app)  # Enable Cross-Origin Resource Sharing
+CORS(app, expose_headers=['ETag', 'X-Next-Cursor'])  # Enable Cross-Origin Resource Sharing
 
 # Data file to persist books
-DATA_FILE = os.path.join(os.path.dirname(__file__), 'books.json')
+DATA_FILE = os.environ.get('BOOKSTORE_DATA_FILE', os.path.join(os.path.dirname(__file__), 'books.json'))
+
+# Fields every book has, in the order they are listed in the docs
+BOOK_FIELDS = ('id', 'title', 'author', 'price', 'in_stock')
+
+# Media type for newline-delimited JSON streams
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Number of books serialized per chunk of a streamed export
+EXPORT_PAGE_SIZE = 1000
+
+# Media type for Server-Sent Events
+SSE_MIMETYPE = 'text/event-stream'
+# Maximum number of changes per /api/books/changes response
+CHANGES_PAGE_SIZE = 1000
+# Longest long-poll wait (seconds) a client may ask for
+MAX_CHANGES_WAIT = 30
+# Seconds between keep-alive comments on an idle event stream
+SSE_HEARTBEAT = 15
+
+# Fields that can be changed with PUT
+UPDATABLE_FIELDS = ('title', 'author', 'price', 'in_stock')
+# Maximum number of operations accepted by POST /api/books/batch
+MAX_BATCH_SIZE = 10000
+
+# Nominal simulated network delay of each route, in seconds
+ROUTE_DELAYS = {
+    'get_books': 0.2,
+    'export_books': 0.2,
+    'get_book': 0.2,
+    'add_book': 0.5,
+    'update_book': 0.5,
+    'delete_book': 0.5,
+    'batch_books': 0.5,
+    'search_books': 0.3,
+    'book_changes': 0.2
+}
 
 # Initialize with some sample books if the file doesn't exist
 SAMPLE_BOOKS = [
@@ -43,143 +101,822 @@ SAMPLE_BOOKS = [
 ]
 
 
+# Storage backend: "json" (in-memory catalog persisted to DATA_FILE) or "sqlite"
+STORAGE_BACKEND = os.environ.get('BOOKSTORE_STORAGE', JSON_STORAGE)
+# SQLite database used by the "sqlite" backend (seeded from DATA_FILE when created)
+SQLITE_FILE = os.environ.get('BOOKSTORE_SQLITE_FILE', os.path.join(os.path.dirname(__file__), 'books.db'))
+
+# Persistence policy for writes with the json backend: "write-through", "write-behind" or "journal"
+PERSIST_POLICY = os.environ.get('BOOKSTORE_PERSIST_POLICY', WRITE_THROUGH)
+# Seconds between background flushes (write-behind) or compaction checks (journal)
+FLUSH_INTERVAL = float(os.environ.get('BOOKSTORE_FLUSH_INTERVAL', '1.0'))
+# Journal size in bytes that triggers folding it into a fresh books.json snapshot
+COMPACT_THRESHOLD = int(os.environ.get('BOOKSTORE_COMPACT_THRESHOLD', DEFAULT_COMPACT_THRESHOLD))
+# Keep a binary copy of the data file (books.json.snapshot) that loads much faster than JSON
+BINARY_SNAPSHOT = os.environ.get('BOOKSTORE_BINARY_SNAPSHOT', 'false').lower() in ('1', 'true', 'yes')
+
+# Book storage. With the json backend the data file is parsed once and reads come from memory.
+if STORAGE_BACKEND == JSON_STORAGE:
+    storage_options = {
+        'policy': PERSIST_POLICY,
+        'flush_interval': FLUSH_INTERVAL,
+        'compact_threshold': COMPACT_THRESHOLD,
+        'binary_snapshot': BINARY_SNAPSHOT
+    }
+else:
+    storage_options = {}
+catalog = open_storage(
+    STORAGE_BACKEND,
+    data_file=DATA_FILE,
+    sqlite_file=SQLITE_FILE,
+    default_books=SAMPLE_BOOKS,
+    **storage_options
+)
+atexit.register(lambda: catalog.close())
+
+# Cache of serialized list and search responses (size 0 disables it)
+QUERY_CACHE_SIZE = int(os.environ.get('BOOKSTORE_QUERY_CACHE_SIZE', '1024'))
+# Seconds a cached response may be served for
+QUERY_CACHE_TTL = float(os.environ.get('BOOKSTORE_QUERY_CACHE_TTL', '30'))
+
+query_cache = QueryCache(max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+# Number of recent changes kept for /api/books/changes
+CHANGE_FEED_SIZE = int(os.environ.get('BOOKSTORE_CHANGE_FEED_SIZE', DEFAULT_CAPACITY))
+
+change_feed = ChangeFeed(CHANGE_FEED_SIZE, epoch=catalog.epoch, version=catalog.version)
+catalog.add_listener(change_feed.publish)
+
+# Requests slower than this many milliseconds are logged with their phase breakdown (0 disables)
+SLOW_REQUEST_MS = float(os.environ.get('BOOKSTORE_SLOW_REQUEST_MS', '0'))
+# Fraction of requests run under cProfile (0 disables); the slowest profiles are kept
+PROFILE_SAMPLE_RATE = float(os.environ.get('BOOKSTORE_PROFILE_SAMPLE_RATE', '0'))
+
+request_metrics = MetricsRegistry()
+profile_sampler = ProfileSampler()
+
+# How the simulated network delay is applied: "fixed", "zero", "uniform" or "exponential"
+LATENCY_PROFILE = os.environ.get('BOOKSTORE_LATENCY_PROFILE', FIXED)
+# Factor applied to every route's nominal delay
+LATENCY_SCALE = float(os.environ.get('BOOKSTORE_LATENCY_SCALE', '1.0'))
+
+latency_profile = LatencyProfile(LATENCY_PROFILE, scale=LATENCY_SCALE)
+
+# Responses at least this many bytes long are gzip/deflate compressed if the client accepts it (0 disables)
+COMPRESS_MIN_SIZE = int(os.environ.get('BOOKSTORE_COMPRESS_MIN_SIZE', '1024'))
+
+
 def load_books():
-    """Load books from the data file."""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    else:
-        # Initialize with sample books if file doesn't exist
-        save_books(SAMPLE_BOOKS)
-        return SAMPLE_BOOKS
+    """Return all books from the configured storage."""
+    return catalog.all()
 
 
 def save_books(books):
-    """Save books to the data file."""
-    with open(DATA_FILE, 'w') as f:
-        json.dump(books, f, indent=2)
+    """Replace the catalog with the given books and persist them."""
+    catalog.replace_all(books)
+
+
+def get_positive_int_arg(name):
+    """Return a positive integer query parameter, or None if it is absent."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit() or int(value) < 1:
+        abort(400, description=f"{name} must be a positive integer")
+    return int(value)
+
+
+def get_int_arg(name):
+    """Return a non-negative integer query parameter, or None if it is absent."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit():
+        abort(400, description=f"{name} must be a non-negative integer")
+    return int(value)
+
+
+def get_float_arg(name):
+    """Return a finite float query parameter, or None if it is absent."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        number = math.nan
+    # NaN compares false both ways, so it would silently disable a filter or a timeout
+    if not math.isfinite(number):
+        abort(400, description=f"{name} must be a number")
+    return number
+
+
+def get_bool_arg(name):
+    """Return a true/false query parameter, or None if it is absent."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if value.lower() not in ('true', 'false', '1', '0', 'yes', 'no'):
+        abort(400, description=f"{name} must be true or false")
+    return value.lower() in ('true', '1', 'yes')
+
+
+def get_fields_arg():
+    """Return the fields requested with ?fields=..., or None for all fields."""
+    value = request.args.get('fields')
+    if value is None:
+        return None
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in BOOK_FIELDS]
+    if not fields or unknown:
+        abort(400, description=f"fields must be a comma-separated list of: {', '.join(BOOK_FIELDS)}")
+    return fields
+
+
+def encode_cursor(cursor):
+    """Encode a (book ID, sequence[, price]) tuple as an opaque pagination cursor."""
+    book_id, seq, *price = cursor
+    position = f"{seq}@{price[0]!r}" if price else str(seq)
+    return base64.urlsafe_b64encode(f"{position}:{book_id}".encode()).decode()
+
+
+def decode_cursor(value, by_price=False):
+    """
+    Decode a pagination cursor into the position to resume after.
+    
+    Cursors of price-filtered lists carry the last book's price and decode
+    to a (price, sequence) pair; they can't be used without a price range,
+    nor the other way round.
+    """
+    try:
+        position, book_id = base64.urlsafe_b64decode(value.encode()).decode().split(':', 1)
+        seq, _, price = position.partition('@')
+        price = float(price) if price else None
+        if (price is not None) != by_price or (price is not None and not math.isfinite(price)):
+            raise ValueError(position)
+        return catalog.cursor_position(book_id, int(seq), price)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400, description="Invalid cursor")
+
+
+def project(books, fields):
+    """Keep only the requested fields of each book."""
+    if fields is None:
+        return books
+    return [{f: book[f] for f in fields if f in book} for book in books]
+
+
+def wants_ndjson():
+    """Check whether the client prefers an NDJSON stream over a JSON array."""
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE and request.accept_mimetypes[NDJSON_MIMETYPE] > 0
+
+
+def stream_books(fields=None, **filters):
+    """
+    Stream the (filtered) catalog as NDJSON, one book per line.
+    
+    Books are fetched and serialized a page at a time, so memory use stays
+    flat no matter how large the catalog is.
+    """
+    def generate():
+        after = None
+        while True:
+            books, cursor = catalog.list_books(limit=EXPORT_PAGE_SIZE, after=after, **filters)
+            if books:
+                yield b''.join(dumps_json(book) + b'\n' for book in project(books, fields))
+            if cursor is None:
+                return
+            # Resume by ID: sequences change if deleted rows are compacted meanwhile
+            after = catalog.cursor_position(*cursor)
+    
+    return Response(generate(), mimetype=NDJSON_MIMETYPE)
+
+
+def stream_changes(feed, epoch, since):
+    """
+    Stream changes as Server-Sent Events, starting after the given version.
+    
+    Each event's ID is "epoch:version", so a reconnecting client resumes
+    through Last-Event-ID. If the changes it needs are gone, a resnapshot
+    event is sent and the stream carries on from the feed's current position.
+    """
+    def generate():
+        nonlocal epoch, since
+        while True:
+            changes, resnapshot = feed.read(epoch, since, limit=CHANGES_PAGE_SIZE)
+            if resnapshot:
+                epoch, since = feed.position()
+                data = dumps_json({'epoch': epoch, 'next': since})
+                yield f"id: {epoch}:{since}\nevent: resnapshot\ndata: ".encode() + data + b'\n\n'
+            elif changes:
+                for change in changes:
+                    header = f"id: {epoch}:{change['seq']}\nevent: change\ndata: "
+                    yield header.encode() + dumps_json(change) + b'\n\n'
+                since = changes[-1]['seq']
+            elif not feed.wait(epoch, since, SSE_HEARTBEAT):
+                yield b': keep-alive\n\n'
+    
+    return Response(generate(), mimetype=SSE_MIMETYPE, headers={'Cache-Control': 'no-cache'})
+
+
+def parse_price(value):
+    """Convert a price to a float (aborts with 400 if it isn't a finite number)."""
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        price = math.nan
+    # NaN and infinity would break the ordering of the price index
+    if not math.isfinite(price):
+        abort(400, description="price must be a number")
+    return price
+
+
+def check_field_types(book):
+    """
+    Abort with 400 unless the title, author and stock flag present in a payload have the right types.
+    
+    Checked here rather than in a storage backend, so both backends accept
+    and store the same books.
+    """
+    for field in ('title', 'author'):
+        if field in book and not isinstance(book[field], str):
+            abort(400, description=f"{field} must be a string")
+    if 'in_stock' in book and not isinstance(book['in_stock'], bool):
+        abort(400, description="in_stock must be true or false")
+
+
+def new_book_from(data):
+    """Validate a payload for a new book and build it (aborts with 400 if invalid)."""
+    if not isinstance(data, dict):
+        abort(400, description="Book must be a JSON object")
+    
+    # Validate required fields
+    if not all(k in data for k in ('title', 'author', 'price')):
+        abort(400, description="Missing required fields: title, author, price")
+    check_field_types(data)
+    
+    return {
+        'id': str(uuid.uuid4())[:8],  # Generate a short unique ID
+        'title': data['title'],
+        'author': data['author'],
+        'price': parse_price(data['price']),
+        'in_stock': data.get('in_stock', True)
+    }
+
+
+def book_changes_from(data):
+    """Validate a payload for a book update and return the fields to change."""
+    if not isinstance(data, dict):
+        abort(400, description="Book must be a JSON object")
+    # The PUT route refuses an empty body before getting here; batch updates need the same check
+    if not data:
+        abort(400, description="Book must not be empty")
+    
+    # Update book fields if provided
+    changes = {k: data[k] for k in UPDATABLE_FIELDS if k in data}
+    check_field_types(changes)
+    if 'price' in changes:
+        changes['price'] = parse_price(changes['price'])
+    return changes
+
+
+def catalog_etag():
+    """ETag for anything derived from the whole catalog (lists and searches)."""
+    return f"{catalog.epoch}-{catalog.version}"
+
+
+def book_etag(version, mimetype=JSON_MIMETYPE):
+    """
+    ETag for a single book at the given version.
+    
+    Book ETags are strong, so every format gets its own tag.
+    """
+    tag = FORMAT_TAGS.get(mimetype)
+    etag = f"{catalog.epoch}-{version}"
+    return f"{etag}-{tag}" if tag else etag
+
+
+def add_validators(response, etag, last_modified, weak=False):
+    """Attach ETag and Last-Modified headers to a response."""
+    response.set_etag(etag, weak=weak)
+    response.last_modified = datetime.fromtimestamp(last_modified, tz=timezone.utc)
+    return response
+
+
+def not_modified(etag, last_modified, weak=False):
+    """
+    Return a 304 response if the client's cached copy is still current.
+    
+    If-None-Match takes precedence over If-Modified-Since. Returns None when
+    the full response has to be sent.
+    """
+    if request.if_none_match:
+        current = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since:
+        current = int(last_modified) <= request.if_modified_since.timestamp()
+    else:
+        return None
+    
+    if not current:
+        return None
+    return add_validators(Response(status=304), etag, last_modified, weak=weak)
+
+
+def response_mimetype():
+    """Pick the response format from the Accept header (JSON unless the client prefers another)."""
+    return request.accept_mimetypes.best_match(available_mimetypes(), default=JSON_MIMETYPE)
+
+
+def response_coding():
+    """Pick the content coding for a large response from Accept-Encoding, or None."""
+    if not COMPRESS_MIN_SIZE or not request.accept_encodings:
+        return None
+    return request.accept_encodings.best_match(CONTENT_CODINGS)
+
+
+def request_payload():
+    """Decode the request body: JSON, or MessagePack if that is what the client sent."""
+    if request.mimetype in MSGPACK_MIMETYPES:
+        try:
+            return decode(request.get_data(), request.mimetype)
+        except ValueError as e:
+            abort(400, description=str(e))
+    return request.json
+
+
+def payload_response(payload, status=200):
+    """Serialize a payload in the negotiated format."""
+    mimetype = response_mimetype()
+    with phase(SERIALIZE):
+        body = encode(payload, mimetype)
+    response = Response(body, status=status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def cached_response(key, version, build):
+    """
+    Serve a response through the query cache.
+    
+    build() returns (payload, headers) and is only called on a miss. The
+    serialized (and possibly compressed) body is stored under key, the format
+    and the content coding, together with the catalog version (the ETag), so
+    any later write makes the entry stale.
+    """
+    mimetype, coding = response_mimetype(), response_coding()
+    key = (*key, mimetype, coding)
+    entry = query_cache.get(key, version)
+    if entry is None:
+        payload, headers = build()
+        with phase(SERIALIZE):
+            body = encode(payload, mimetype)
+            if coding and len(body) >= COMPRESS_MIN_SIZE:
+                body, headers = compress(body, coding), {**headers, 'Content-Encoding': coding}
+        entry = (body, headers)
+        query_cache.put(key, version, entry)
+    body, headers = entry
+    response = Response(body, mimetype=mimetype, headers=headers)
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+
+def if_match_precondition():
+    """Turn an If-Match header into a version check for the catalog, or None if absent."""
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+    mimetypes = available_mimetypes()
+    return lambda version: any(if_match.contains(book_etag(version, m)) for m in mimetypes)
+
+
+def simulate_delay():
+    """
+    Simulate network delay for realistic API behavior.
+    
+    The delay comes from the route's entry in ROUTE_DELAYS and the configured
+    latency profile. When the app runs under the ASGI server (asgi.py), the
+    delay has already been awaited before the request reached Flask and is
+    only recorded here.
+    """
+    applied = request.environ.get('bookstore.delay')
+    if applied is not None:
+        g.phases[DELAY] += applied
+        return
+    seconds = latency_profile.delay(ROUTE_DELAYS.get(request.endpoint, 0))
+    if seconds:
+        with phase(DELAY):
+            time.sleep(seconds)
+
+
+@app.before_request
+def start_request_metrics():
+    """Start timing the request (and maybe profiling it)."""
+    # Under the ASGI server the clock starts before the (asynchronous) delay
+    g.request_start = request.environ.get('bookstore.request_start', time.perf_counter())
+    g.phases = defaultdict(float)
+    
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.profiler = profiler
+        except ValueError:
+            pass  # Another profiler is already active
+
+
+@app.before_request
+def reload_catalog():
+    """Pick up changes made to the data file outside of this process."""
+    with phase(LOAD):
+        catalog.reload_if_changed()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Record the request's latency and phase breakdown."""
+    if 'request_start' not in g:
+        return response
+    
+    duration = time.perf_counter() - g.request_start
+    phases = dict(g.phases)
+    phases[COMPUTE] = max(0.0, duration - sum(phases.values()))
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    request_metrics.observe(route, request.method, response.status_code, duration, phases)
+    
+    profiler = g.pop('profiler', None)
+    if profiler:
+        profiler.disable()
+        profile_sampler.offer(duration, f"{request.method} {request.full_path}", profiler)
+    
+    if SLOW_REQUEST_MS and duration * 1000 >= SLOW_REQUEST_MS:
+        breakdown = ', '.join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in phases.items())
+        app.logger.warning("Slow request: %s %s took %.1f ms (%s)",
+                           request.method, request.full_path, duration * 1000, breakdown)
+    return response
+
+
+# Registered after record_request_metrics so that it runs first and is timed
+@app.after_request
+def compress_response(response):
+    """Compress large JSON and MessagePack responses if the client accepts it."""
+    if response.mimetype not in available_mimetypes() or response.is_streamed:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'Content-Encoding' in response.headers:
+        return response  # Already compressed (e.g. by the query cache)
+    
+    # A strong ETag identifies the exact bytes, so compressing would invalidate it
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        return response
+    
+    coding = response_coding()
+    if coding and response.content_length and response.content_length >= COMPRESS_MIN_SIZE:
+        with phase(SERIALIZE):
+            response.set_data(compress(response.get_data(), coding))
+        response.headers['Content-Encoding'] = coding
+    return response
 
 
 @app.route('/api/books', methods=['GET'])
 def get_books():
-    """Get all books endpoint."""
+    """
+    Get all books endpoint.
+    
+    Optional query parameters:
+        limit: page size; the cursor for the next page is sent in X-Next-Cursor
+        cursor: cursor returned by the previous page
+        fields: comma-separated fields to include in each book
+        in_stock: only books with this stock status (true/false)
+        min_price, max_price: inclusive price range; the books then come in price order
+    
+    Send "Accept: application/x-ndjson" to stream the books instead.
+    """
     # Simulate network delay for realistic API behavior
-    time.sleep(0.2)
+    simulate_delay()
+    
+    # Read the version before the data so the ETag is never newer than the body
+    etag, last_modified = catalog_etag(), catalog.last_modified
+    
+    fields = get_fields_arg()
+    filters = {
+        'in_stock': get_bool_arg('in_stock'),
+        'min_price': get_float_arg('min_price'),
+        'max_price': get_float_arg('max_price')
+    }
+    
+    # Stream the catalog instead of building one big array if the client asks for NDJSON
+    if wants_ndjson():
+        return stream_books(fields=fields, **filters)
+    
+    limit = get_positive_int_arg('limit')
+    cursor = request.args.get('cursor')
+    
+    cached = not_modified(etag, last_modified, weak=True)
+    if cached:
+        return cached
+    
+    by_price = filters['min_price'] is not None or filters['max_price'] is not None
+    after = decode_cursor(cursor, by_price) if cursor else None
+    
+    def build():
+        books, next_cursor = catalog.list_books(limit=limit, after=after, **filters)
+        headers = {'X-Next-Cursor': encode_cursor(next_cursor)} if next_cursor else {}
+        return project(books, fields), headers
+    
+    key = ('books', limit, after, tuple(fields or ()), *filters.values())
+    response = cached_response(key, etag, build)
+    return add_validators(response, etag, last_modified, weak=True)
+
+
+@app.route('/api/books/export', methods=['GET'])
+def export_books():
+    """
+    Stream the whole catalog as NDJSON (one book per line).
+    
+    Accepts the same fields, in_stock, min_price and max_price parameters
+    as GET /api/books.
+    """
+    # Simulate network delay
+    simulate_delay()
     
-    books = load_books()
-    return jsonify(books)
+    return stream_books(
+        fields=get_fields_arg(),
+        in_stock=get_bool_arg('in_stock'),
+        min_price=get_float_arg('min_price'),
+        max_price=get_float_arg('max_price')
+    )
 
 
 @app.route('/api/books/<book_id>', methods=['GET'])
 def get_book(book_id):
     """Get a specific book by ID."""
     # Simulate network delay
-    time.sleep(0.2)
+    simulate_delay()
     
-    books = load_books()
-    book = next((b for b in books if b['id'] == book_id), None)
+    version = catalog.book_version(book_id)
+    book = catalog.get(book_id)
     
-    if book:
-        return jsonify(book)
-    else:
+    if not book or not version:
         abort(404, description="Book not found")
+    
+    etag, last_modified = book_etag(version[0], response_mimetype()), version[1]
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+    return add_validators(payload_response(book), etag, last_modified)
 
 
 @app.route('/api/books', methods=['POST'])
 def add_book():
     """Add a new book."""
     # Simulate network delay
-    time.sleep(0.5)
+    simulate_delay()
     
-    if not request.json:
+    data = request_payload()
+    if not data:
         abort(400, description="Request must be JSON")
     
-    data = request.json
-    
-    # Validate required fields
-    if not all(k in data for k in ('title', 'author', 'price')):
-        abort(400, description="Missing required fields: title, author, price")
-    
     # Create new book
-    new_book = {
-        'id': str(uuid.uuid4())[:8],  # Generate a short unique ID
-        'title': data['title'],
-        'author': data['author'],
-        'price': float(data['price']),
-        'in_stock': data.get('in_stock', True)
-    }
+    new_book = new_book_from(data)
     
-    books = load_books()
-    books.append(new_book)
-    save_books(books)
+    with phase(PERSIST):
+        catalog.add(new_book)
     
-    return jsonify(new_book), 201
+    response = payload_response(new_book, status=201)
+    version, last_modified = catalog.book_version(new_book['id'])
+    return add_validators(response, book_etag(version, response.mimetype), last_modified)
 
 
 @app.route('/api/books/<book_id>', methods=['PUT'])
 def update_book(book_id):
     """Update an existing book."""
     # Simulate network delay
-    time.sleep(0.5)
+    simulate_delay()
     
-    if not request.json:
+    data = request_payload()
+    if not data:
         abort(400, description="Request must be JSON")
     
-    books = load_books()
-    book = next((b for b in books if b['id'] == book_id), None)
+    changes = book_changes_from(data)
+    
+    # If-Match makes the update conditional on the version the client last saw
+    try:
+        with phase(PERSIST):
+            book = catalog.update(book_id, changes, precondition=if_match_precondition())
+    except PreconditionFailed:
+        abort(412, description="Book was modified by another request")
     
     if not book:
         abort(404, description="Book not found")
     
-    data = request.json
-    
-    # Update book fields if provided
-    book['title'] = data.get('title', book['title'])
-    book['author'] = data.get('author', book['author'])
-    book['price'] = float(data.get('price', book['price']))
-    book['in_stock'] = data.get('in_stock', book['in_stock'])
-    
-    save_books(books)
-    
-    return jsonify(book)
+    response = payload_response(book)
+    version = catalog.book_version(book_id)
+    if version:
+        add_validators(response, book_etag(version[0], response.mimetype), version[1])
+    return response
 
 
 @app.route('/api/books/<book_id>', methods=['DELETE'])
 def delete_book(book_id):
     """Delete a book."""
     # Simulate network delay
-    time.sleep(0.5)
+    simulate_delay()
     
-    books = load_books()
-    book = next((b for b in books if b['id'] == book_id), None)
+    try:
+        with phase(PERSIST):
+            deleted = catalog.delete(book_id, precondition=if_match_precondition())
+    except PreconditionFailed:
+        abort(412, description="Book was modified by another request")
     
-    if not book:
+    if not deleted:
         abort(404, description="Book not found")
     
-    books = [b for b in books if b['id'] != book_id]
-    save_books(books)
+    return payload_response({'message': f"Book with ID {book_id} deleted successfully"})
+
+
+@app.route('/api/books/batch', methods=['POST'])
+def batch_books():
+    """
+    Apply a batch of create, update and delete operations atomically.
+    
+    Request body:
+        {"operations": [
+            {"op": "create", "book": {...}},
+            {"op": "update", "id": "...", "book": {...}},
+            {"op": "delete", "id": "..."}
+        ]}
+    
+    Every operation is validated with the same rules as the single-book
+    routes. Either all operations are applied in one persistence step, or
+    none are and the per-item results show which ones failed.
+    """
+    # Simulate network delay (once per batch rather than once per book)
+    simulate_delay()
+    
+    data = request_payload()
+    if not data:
+        abort(400, description="Request must be JSON")
+    
+    operations = data.get('operations') if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        abort(400, description="operations must be a non-empty list")
+    if len(operations) > MAX_BATCH_SIZE:
+        abort(400, description=f"A batch can contain at most {MAX_BATCH_SIZE} operations")
     
-    return jsonify({'message': f"Book with ID {book_id} deleted successfully"})
+    # Validate each operation, collecting errors instead of stopping at the first one
+    parsed, errors = [], {}
+    for i, item in enumerate(operations):
+        try:
+            if not isinstance(item, dict) or item.get('op') not in ('create', 'update', 'delete'):
+                abort(400, description="op must be one of: create, update, delete")
+            if item['op'] == 'create':
+                parsed.append(('create', new_book_from(item.get('book'))))
+                continue
+            if not isinstance(item.get('id'), str):
+                abort(400, description="id is required")
+            if item['op'] == 'update':
+                parsed.append(('update', item['id'], book_changes_from(item.get('book'))))
+            else:
+                parsed.append(('delete', item['id']))
+        except HTTPException as e:
+            errors[i] = {'status': e.code, 'error': e.description}
+            parsed.append(None)
+    
+    if not errors:
+        with phase(PERSIST):
+            applied, results = catalog.apply_batch(parsed)
+        if not applied:
+            errors = {i: {'status': 404, 'error': "Book not found"}
+                      for i, result in enumerate(results) if result is None}
+    
+    if errors:
+        # Valid operations were not applied because another one failed
+        results = [errors.get(i, {'status': 424, 'error': "Not applied"}) for i in range(len(parsed))]
+        return payload_response({
+            'error': 'Bad Request',
+            'message': "Batch rejected; no changes were applied",
+            'results': results
+        }, status=400)
+    
+    response = []
+    for (kind, *_), result in zip(parsed, results):
+        if kind == 'create':
+            response.append({'status': 201, 'book': result})
+        elif kind == 'update':
+            response.append({'status': 200, 'book': result})
+        else:
+            response.append({'status': 200, 'id': result})
+    return payload_response({'results': response})
 
 
 @app.route('/api/books/search', methods=['GET'])
 def search_books():
     """Search for books by title or author."""
     # Simulate network delay
-    time.sleep(0.3)
+    simulate_delay()
     
     query = request.args.get('query', '').lower()
     
     if not query:
         abort(400, description="Search query is required")
     
-    books = load_books()
-    results = [
-        book for book in books
-        if query in book['title'].lower() or query in book['author'].lower()
-    ]
+    # Optional search modifiers
+    match = request.args.get('match', SUBSTRING)
+    if match not in MATCH_MODES:
+        abort(400, description=f"match must be one of: {', '.join(MATCH_MODES)}")
+    rank = request.args.get('rank', '').lower() in ('1', 'true', 'yes')
+    limit = get_positive_int_arg('limit')
+    
+    etag, last_modified = catalog_etag(), catalog.last_modified
+    cached = not_modified(etag, last_modified, weak=True)
+    if cached:
+        return cached
     
-    return jsonify(results)
+    def build():
+        return catalog.search(query, match=match, rank=rank, limit=limit), {}
+    
+    response = cached_response(('search', query, match, rank, limit), etag, build)
+    return add_validators(response, etag, last_modified, weak=True)
+
+
+@app.route('/api/books/changes', methods=['GET'])
+def book_changes():
+    """
+    Follow changes to the catalog instead of re-downloading it.
+    
+    Optional query parameters:
+        since: last version the client has seen (default: the current version)
+        epoch: epoch of that version (default: the current epoch)
+        limit: maximum number of changes to return
+        wait: seconds to wait for a change if there is none yet (long-poll)
+    
+    Send "Accept: text/event-stream" to receive the changes as Server-Sent Events.
+    """
+    # Simulate network delay
+    simulate_delay()
+    
+    feed = change_feed
+    current_epoch, latest = feed.position()
+    epoch = request.args.get('epoch', current_epoch)
+    since = get_int_arg('since')
+    if since is None:
+        since = latest
+    
+    if request.accept_mimetypes.best == SSE_MIMETYPE:
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        if ':' in last_event_id:
+            epoch, _, seq = last_event_id.rpartition(':')
+            since = int(seq) if seq.isdigit() else -1
+        return stream_changes(feed, epoch, since)
+    
+    limit = get_positive_int_arg('limit') or CHANGES_PAGE_SIZE
+    wait = min(max(get_float_arg('wait') or 0, 0), MAX_CHANGES_WAIT)
+    
+    changes, resnapshot = feed.read(epoch, since, limit=min(limit, CHANGES_PAGE_SIZE))
+    if not changes and not resnapshot and wait:
+        feed.wait(epoch, since, wait)
+        changes, resnapshot = feed.read(epoch, since, limit=min(limit, CHANGES_PAGE_SIZE))
+    
+    if resnapshot:
+        # Reload the catalog, then follow the feed from here
+        epoch, since = feed.position()
+    elif changes:
+        since = changes[-1]['seq']
+    return payload_response({'epoch': epoch, 'next': since, 'resnapshot': resnapshot, 'changes': changes})
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Report query cache hit, miss and eviction counters."""
+    return jsonify(query_cache.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Export request metrics in the Prometheus text format."""
+    cache = query_cache.stats()
+    extra = [
+        ('bookstore_books', 'gauge', 'Books in the catalog.', len(catalog)),
+        ('bookstore_catalog_version', 'gauge', 'Current catalog version.', catalog.version),
+        ('bookstore_query_cache_entries', 'gauge', 'Entries in the query cache.', cache['entries']),
+        ('bookstore_query_cache_hits_total', 'counter', 'Query cache hits.', cache['hits']),
+        ('bookstore_query_cache_misses_total', 'counter', 'Query cache misses.', cache['misses']),
+        ('bookstore_query_cache_evictions_total', 'counter', 'Query cache LRU evictions.', cache['evictions']),
+        ('bookstore_query_cache_expirations_total', 'counter', 'Query cache TTL expirations.', cache['expirations']),
+        ('bookstore_query_cache_invalidations_total', 'counter', 'Query cache entries made stale by writes.',
+         cache['invalidations']),
+    ]
+    return Response(request_metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/metrics/profiles', methods=['GET'])
+def metrics_profiles():
+    """Show cProfile output for the slowest sampled requests."""
+    return Response(profile_sampler.report(), mimetype='text/plain')
 
 
 @app.errorhandler(400)
@@ -194,6 +931,12 @@ def not_found(error):
     return jsonify({'error': 'Not Found', 'message': error.description}), 404
 
 
+@app.errorhandler(412)
+def precondition_failed(error):
+    """Handle failed If-Match preconditions."""
+    return jsonify({'error': 'Precondition Failed', 'message': error.description}), 412
+
+
 @app.errorhandler(500)
 def server_error(error):
     """Handle internal server errors."""
@@ -201,12 +944,6 @@ def server_error(error):
 
 
 if __name__ == '__main__':
-    if not os.path.exists(os.path.dirname(DATA_FILE)):
-        os.makedirs(os.path.dirname(DATA_FILE))
-    
-    # Ensure we have the books.json file
-    if not os.path.exists(DATA_FILE):
-        save_books(SAMPLE_BOOKS)
-    
+    # The catalog is loaded (or seeded with SAMPLE_BOOKS) when the module is imported
     print("Bookstore API running on http://localhost:5000")
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Bookstore API (ASGI)
+
+Serves the same routes as app.py from an asyncio event loop. The simulated
+network delay is awaited with asyncio.sleep before the request is handed to
+Flask, so waiting requests don't hold a thread. Only the actual work (catalog
+reads, serialization and persistence, including file I/O) runs on a small
+thread pool, and streamed responses are read from it chunk by chunk.
+
+Change-feed requests (GET /api/books/changes) can hold their thread for up
+to 30 seconds while they long-poll or stream events, so they run on a pool
+of their own. However many clients follow the feed, ordinary requests never
+queue behind them.
+
+Run it with any ASGI server, for example:
+
+    uvicorn asgi:app --port 5000
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import sys
+import time
+
+from werkzeug.exceptions import HTTPException
+
+import app as bookstore_app
+
+# Threads that run request handlers once their simulated delay is over
+ASGI_WORKERS = int(os.environ.get('BOOKSTORE_ASGI_WORKERS', '8'))
+# Threads that serve change-feed long-polls and event streams
+ASGI_FEED_WORKERS = int(os.environ.get('BOOKSTORE_ASGI_FEED_WORKERS', '32'))
+# Endpoints that wait for changes, and so run on the feed pool
+WAITING_ENDPOINTS = frozenset({'book_changes'})
+
+
+class AsyncBookstore:
+    """ASGI application that runs the Flask app behind non-blocking delays."""
+
+    def __init__(self, flask_app, workers=ASGI_WORKERS, feed_workers=ASGI_FEED_WORKERS):
+        """
+        Wrap a Flask application.
+
+        Parameters:
+            flask_app (Flask): The WSGI application to serve
+            workers (int): Size of the thread pool that runs the handlers
+            feed_workers (int): Size of the thread pool for change-feed requests;
+                followers beyond it wait for a thread without delaying other requests
+        """
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bookstore-asgi')
+        self.feed_executor = ThreadPoolExecutor(max_workers=feed_workers, thread_name_prefix='bookstore-asgi-feed')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def lifespan(self, receive, send):
+        """Handle server startup and shutdown."""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.run(bookstore_app.catalog.close)
+                self.executor.shutdown(wait=False)
+                self.feed_executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run(self, func, *args, executor=None):
+        """Run a blocking call on the handler thread pool (or the given one)."""
+        return await asyncio.get_running_loop().run_in_executor(executor or self.executor, func, *args)
+
+    async def handle_http(self, scope, receive, send):
+        """Serve one HTTP request."""
+        start = time.perf_counter()
+        body = await read_body(receive)
+        environ = build_environ(scope, body)
+
+        endpoint = self.match_endpoint(environ)
+        executor = self.feed_executor if endpoint in WAITING_ENDPOINTS else self.executor
+        delay = bookstore_app.latency_profile.delay(bookstore_app.ROUTE_DELAYS.get(endpoint, 0))
+        if delay:
+            await asyncio.sleep(delay)
+        environ['bookstore.request_start'] = start
+        environ['bookstore.delay'] = delay
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+
+        chunks = await self.run(self.flask_app.wsgi_app, environ, start_response, executor=executor)
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': response['headers']
+            })
+            iterator = iter(chunks)
+            while True:
+                chunk = await self.run(next, iterator, None, executor=executor)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(chunks, 'close'):
+                await self.run(chunks.close, executor=executor)
+
+    def match_endpoint(self, environ):
+        """Return the endpoint a request is for, or None if no route matches."""
+        adapter = self.flask_app.url_map.bind_to_environ(environ)
+        try:
+            endpoint, _ = adapter.match()
+        except HTTPException:
+            return None
+        return endpoint
+
+
+async def read_body(receive):
+    """Read the whole request body."""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return bytes(body)
+
+
+def build_environ(scope, body):
+    """Build a WSGI environ for an ASGI HTTP scope."""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+app = AsyncBookstore(bookstore_app.app)
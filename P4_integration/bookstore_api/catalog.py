@@ -0,0 +1,693 @@
+#!/usr/bin/env python3
+"""
+Book Catalog
+
+A resident, in-memory copy of the bookstore catalog. The data file is parsed
+once at startup, reads are served from memory, and writes are persisted
+according to a configurable policy.
+
+Books are held column by column (see columns.py) and only turned back into
+dicts when they are returned.
+"""
+from array import array
+import bisect
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+
+from columns import BookColumns
+from journal import Journal, read_records
+from search_index import SearchIndex, SUBSTRING, scan
+from snapshot import SnapshotError, read_snapshot, write_snapshot
+from storage import BookStorage, PreconditionFailed
+
+# Persistence policies
+WRITE_THROUGH = 'write-through'  # Rewrite the data file before a write returns
+WRITE_BEHIND = 'write-behind'    # Mark dirty and let a background thread flush
+JOURNAL = 'journal'              # Append each change to a journal, compact in the background
+PERSIST_POLICIES = (WRITE_THROUGH, WRITE_BEHIND, JOURNAL)
+
+# Journal size (bytes) that triggers a background compaction
+DEFAULT_COMPACT_THRESHOLD = 1024 * 1024
+
+# Catalogs with more books than this are search-indexed in the background
+SYNC_INDEX_LIMIT = 10000
+# Books indexed per step of a background build (the lock is held for one step)
+INDEX_CHUNK_SIZE = 2000
+
+# Deleted rows are compacted away once they make up this fraction of the
+# columns, and there are at least HOLE_COMPACT_MIN of them
+HOLE_COMPACT_FRACTION = 0.25
+HOLE_COMPACT_MIN = 1024
+
+
+class BookCatalog(BookStorage):
+    """In-memory book catalog backed by a JSON data file."""
+
+    def __init__(self, path, default_books=None, policy=WRITE_THROUGH,
+                 flush_interval=1.0, compact_threshold=DEFAULT_COMPACT_THRESHOLD,
+                 binary_snapshot=False):
+        """
+        Load the catalog from disk.
+
+        Parameters:
+            path (str): Path of the JSON data file (the snapshot in journal mode)
+            default_books (list): Books to seed the file with if it is missing
+            policy (str): One of PERSIST_POLICIES
+            flush_interval (float): Seconds between write-behind flushes or compaction checks
+            compact_threshold (int): Journal size in bytes that triggers a compaction
+            binary_snapshot (bool): Keep a binary copy of the data file for fast startup
+        """
+        if policy not in PERSIST_POLICIES:
+            raise ValueError(f"Unknown persistence policy: {policy}")
+
+        self.path = path
+        self.policy = policy
+        self.flush_interval = flush_interval
+        self.compact_threshold = compact_threshold
+        self.journal_path = f"{path}.journal"
+        # Journal segment being folded into the snapshot by a compaction
+        self.compacting_path = f"{path}.journal.compacting"
+        # Binary copy of the data file (see snapshot.py), written alongside it
+        self.binary_snapshot_path = f"{path}.snapshot" if binary_snapshot else None
+
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        # Books stored as rows of columns. A book's row is its insertion
+        # sequence number: it never changes, which gives pagination a stable order.
+        self._columns = BookColumns()
+        self._seqs = {}             # book ID -> sequence (row)
+        self._order = array('q')    # sequences of the books in the catalog, sorted
+        self._prices = array('q')   # the same sequences sorted by (price, sequence)
+        self._search_index = SearchIndex()
+        # Large catalogs are indexed in the background; searches scan until then
+        self._indexed = threading.Event()
+        self._index_generation = 0
+        # Versions for conditional requests (books have theirs in the columns).
+        # The epoch changes whenever the catalog is (re)loaded so versions from
+        # an earlier load never collide.
+        self.epoch = None
+        self.version = 0
+        self.last_modified = 0.0
+        self._signature = None
+        self._dirty = False
+        self._journal = None
+        self._stop = threading.Event()
+        self._worker = None
+
+        if os.path.exists(path):
+            self._load()
+        else:
+            # Initialize with the default books if the file doesn't exist
+            self._set_books(default_books or [])
+            self._write()
+
+        if policy == JOURNAL:
+            if os.path.exists(self.compacting_path):
+                # A compaction was interrupted; finish folding it into the snapshot
+                self._write()
+                os.remove(self.compacting_path)
+            self._journal = Journal(self.journal_path)
+
+        if policy in (WRITE_BEHIND, JOURNAL):
+            self._worker = threading.Thread(
+                target=self._background_loop, name='catalog-worker', daemon=True
+            )
+            self._worker.start()
+
+    # Loading and change detection
+
+    def _file_signature(self):
+        """Return a cheap fingerprint of the data file, or None if missing."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _set_books(self, books):
+        """Store a list of books in fresh columns, preserving their order, and reindex them."""
+        columns = BookColumns()
+        for book in {book['id']: book for book in books}.values():
+            columns.append(book)
+        self._set_columns(columns)
+
+    def _set_columns(self, columns):
+        """Replace the catalog with the given columns (every row live) and reindex them."""
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.last_modified = time.time()
+
+        columns.modified = array('d', [self.last_modified]) * len(columns.ids)
+        self._columns = columns
+        self._seqs = {book_id: seq for seq, book_id in enumerate(columns.ids)}
+        self._order = array('q', range(len(columns.ids)))
+        # A stable sort of sequences by price gives (price, sequence) order
+        self._prices = array('q', sorted(self._order, key=columns.prices.__getitem__))
+        self._build_search_index()
+        self._notify(self.epoch, self.version, None)
+
+    def _build_search_index(self):
+        """Rebuild the search index, in the background if the catalog is large."""
+        self._index_generation += 1
+        self._search_index = SearchIndex()
+        self._indexed.clear()
+        if len(self._order) <= SYNC_INDEX_LIMIT:
+            for seq in self._order:
+                self._search_index.add(self._columns.book(seq), seq=seq)
+            self._indexed.set()
+            return
+        threading.Thread(
+            target=self._index_in_background, args=(self._index_generation, list(self._order)),
+            name='catalog-indexer', daemon=True
+        ).start()
+
+    def _index_in_background(self, generation, seqs):
+        """
+        Index the given books a chunk at a time.
+
+        Writes made meanwhile update the partial index themselves, so books
+        are re-read from the columns and deleted ones skipped. A newer build
+        (or close()) stops this one.
+        """
+        for start in range(0, len(seqs), INDEX_CHUNK_SIZE):
+            with self._lock:
+                if generation != self._index_generation:
+                    return
+                for seq in seqs[start:start + INDEX_CHUNK_SIZE]:
+                    if self._columns.ids[seq] is not None:
+                        self._search_index.add(self._columns.book(seq), seq=seq)
+        with self._lock:
+            if generation == self._index_generation:
+                self._indexed.set()
+
+    def wait_until_indexed(self, timeout=None):
+        """Wait for the search index to be complete; returns False on timeout."""
+        return self._indexed.wait(timeout)
+
+    def _price_key(self, seq):
+        """Sort key of the price index."""
+        return (self._columns.prices[seq], seq)
+
+    def _touch(self, record, seq=None):
+        """Bump the catalog version, and the version of the changed book, and notify listeners."""
+        self.version += 1
+        self.last_modified = time.time()
+        if seq is not None:
+            self._columns.versions[seq] = self.version
+            self._columns.modified[seq] = self.last_modified
+        self._notify(self.epoch, self.version, record)
+        return record
+
+    def _unindex_price(self, seq):
+        """Remove a book from the price index (before its price changes)."""
+        i = bisect.bisect_left(self._prices, self._price_key(seq), key=self._price_key)
+        if i == len(self._prices) or self._prices[i] != seq:
+            # A price that doesn't order (NaN read from a data file) throws the bisect off
+            i = self._prices.index(seq)
+        del self._prices[i]
+
+    def _index_price(self, seq):
+        """Add a book to the price index."""
+        bisect.insort(self._prices, seq, key=self._price_key)
+
+    def _load(self):
+        """
+        Load the data file into memory, replaying the journal in journal mode.
+
+        A binary snapshot is used instead of parsing the JSON if it mirrors
+        the current data file; otherwise a new one is written.
+        """
+        signature = self._file_signature()
+        records = []
+        if self.policy == JOURNAL:
+            for segment in (self.compacting_path, self.journal_path):
+                records.extend(read_records(segment))
+
+        columns = self._read_binary_snapshot(signature)
+        if columns is not None and not records:
+            self._set_columns(columns)
+            self._signature = signature
+            return
+
+        if columns is not None:
+            books = {columns.ids[seq]: columns.book(seq) for seq in range(len(columns.ids))}
+        else:
+            with open(self.path, 'r') as f:
+                books = {book['id']: book for book in json.load(f)}
+            self._write_binary_snapshot(list(books.values()), signature)
+
+        # Records are full post-images, so replaying one twice is harmless
+        for record in records:
+            self._replay(books, record)
+
+        self._set_books(books.values())
+        self._signature = signature
+
+    def _read_binary_snapshot(self, signature):
+        """Return the columns of the binary snapshot, or None if it is missing, stale or corrupt."""
+        if self.binary_snapshot_path is None:
+            return None
+        try:
+            columns, source = read_snapshot(self.binary_snapshot_path)
+        except SnapshotError:
+            return None
+        return columns if source == signature else None
+
+    def _write_binary_snapshot(self, books, signature):
+        """Write the binary snapshot that mirrors the data file with the given signature."""
+        if self.binary_snapshot_path is None:
+            return
+        try:
+            write_snapshot(self.binary_snapshot_path, books, source=signature,
+                           fsync=self.policy == JOURNAL)
+        except SnapshotError:
+            # These books can't be snapshotted; make sure a stale snapshot isn't used
+            if os.path.exists(self.binary_snapshot_path):
+                os.remove(self.binary_snapshot_path)
+
+    @classmethod
+    def _replay(cls, books, record):
+        """Apply a journal record to a dict of books."""
+        if record['op'] == 'put':
+            books[record['book']['id']] = record['book']
+        elif record['op'] == 'delete':
+            books.pop(record['id'], None)
+        elif record['op'] == 'batch':
+            for sub_record in record['records']:
+                cls._replay(books, sub_record)
+
+    def reload_if_changed(self):
+        """
+        Reload the catalog if the data file was changed by someone else.
+
+        Only a stat() call is made when nothing changed. Pending write-behind
+        changes take precedence over the file and are never discarded.
+
+        Returns:
+            bool: True if the catalog was reloaded
+        """
+        signature = self._file_signature()
+        if signature == self._signature or signature is None:
+            return False
+
+        with self._lock:
+            if self._dirty or self._file_signature() == self._signature:
+                return False
+            if self._journal is not None:
+                self._journal.sync()
+            self._load()
+            return True
+
+    # Reads
+
+    def _materialize(self, seqs):
+        """Build the book dicts for a list of sequences."""
+        book = self._columns.book
+        return [book(seq) for seq in seqs]
+
+    def all(self):
+        """Return a list of all books in insertion order."""
+        with self._lock:
+            return self._materialize(self._order)
+
+    def get(self, book_id):
+        """Return the book with the given ID, or None if it doesn't exist."""
+        with self._lock:
+            seq = self._seqs.get(book_id)
+            return None if seq is None else self._columns.book(seq)
+
+    def book_version(self, book_id):
+        """Return (version, modified timestamp) for a book, or None if it doesn't exist."""
+        with self._lock:
+            seq = self._seqs.get(book_id)
+            if seq is None:
+                return None
+            return self._columns.versions[seq], self._columns.modified[seq]
+
+    def cursor_position(self, book_id, fallback_seq, price=None):
+        """
+        Return the sequence, or (price, sequence) pair, to resume a listing after.
+
+        A cursor remembers the ID and sequence of the last book on a page, and
+        its price in a price-filtered listing. The ID is preferred because
+        sequences are renumbered when the data file is reloaded or deleted
+        rows are compacted; the sequence is used if that book has since been
+        deleted. The price is the one the page was listed with, so a book
+        whose price changed since doesn't move the cursor.
+        """
+        seq = self._seqs.get(book_id, fallback_seq)
+        return seq if price is None else (price, seq)
+
+    def list_books(self, limit=None, after=None, in_stock=None, min_price=None, max_price=None):
+        """
+        List books with optional filtering and pagination.
+
+        Books come in insertion order, or in (price, sequence) order from the
+        price index when a price range is given.
+
+        Parameters:
+            limit (int): Maximum number of books to return
+            after (int or tuple): Only return books after this sequence number,
+                or after this (price, sequence) position with a price range
+            in_stock (bool): Only return books with this stock status
+            min_price (float): Minimum price (inclusive)
+            max_price (float): Maximum price (inclusive)
+
+        Returns:
+            tuple: (books, cursor) where cursor is (last ID, last sequence),
+                   plus the last price with a price range, if there may be
+                   more results, otherwise None
+        """
+        by_price = min_price is not None or max_price is not None
+        with self._lock:
+            if by_price:
+                # A page bisects straight to its start in the sorted price index
+                lo = 0 if min_price is None else bisect.bisect_left(
+                    self._prices, (min_price, -1), key=self._price_key)
+                if after is not None:
+                    lo = max(lo, bisect.bisect_right(self._prices, after, key=self._price_key))
+                hi = len(self._prices) if max_price is None else bisect.bisect_right(
+                    self._prices, (max_price, float('inf')), key=self._price_key)
+                seqs = itertools.islice(self._prices, lo, hi)
+            else:
+                start = 0 if after is None else bisect.bisect_right(self._order, after)
+                seqs = itertools.islice(self._order, start, None)
+            if in_stock is not None:
+                seqs = (seq for seq in seqs if self._columns.in_stock[seq] == in_stock)
+            # Fetch one extra book to find out whether there is another page
+            seqs = list(itertools.islice(seqs, None if limit is None else limit + 1))
+
+            cursor = None
+            if limit is not None and len(seqs) > limit:
+                seqs = seqs[:limit]
+                cursor = (self._columns.ids[seqs[-1]], seqs[-1])
+                if by_price:
+                    cursor += (self._columns.prices[seqs[-1]],)
+            return self._materialize(seqs), cursor
+
+    def search(self, query, match=SUBSTRING, rank=False, limit=None):
+        """
+        Search titles and authors through the search index.
+
+        See SearchIndex.search for the parameters.
+
+        Returns:
+            list: Matching books
+        """
+        with self._lock:
+            if not self._indexed.is_set():
+                # The index is still being built; scanning gives the same results
+                books = (self._columns.book(seq) for seq in self._order)
+                return scan(query, books, match=match, rank=rank, limit=limit)
+            book_ids = self._search_index.search(query, match=match, rank=rank, limit=limit)
+            return self._materialize(self._seqs[book_id] for book_id in book_ids)
+
+    def __contains__(self, book_id):
+        return book_id in self._seqs
+
+    def __len__(self):
+        return len(self._seqs)
+
+    # Writes
+
+    def _add_locked(self, book):
+        """Insert a book into memory and the indexes; returns its journal record."""
+        seq = self._columns.append(book)
+        self._seqs[book['id']] = seq
+        self._order.append(seq)  # New sequences are always the largest
+        self._index_price(seq)
+        self._search_index.add(book, seq=seq)
+        return self._touch({'op': 'put', 'book': self._columns.book(seq)}, seq)
+
+    def _update_locked(self, book_id, changes):
+        """Apply changes to a book in memory and the indexes; returns its journal record."""
+        seq = self._seqs[book_id]
+        if 'price' in changes:
+            self._unindex_price(seq)
+            try:
+                self._columns.update(seq, changes)
+            finally:
+                self._index_price(seq)
+        else:
+            self._columns.update(seq, changes)
+        book = self._columns.book(seq)
+        self._search_index.update(book, seq=seq)
+        return self._touch({'op': 'put', 'book': book}, seq)
+
+    def _delete_locked(self, book_id):
+        """
+        Remove a book from memory and the indexes; returns its journal record.
+
+        Removing the book's sequence from the sorted order and price arrays
+        moves the entries after it, so a delete costs O(n) memmove. Its row
+        in the columns is left as a hole until _compact_rows() runs.
+        """
+        seq = self._seqs[book_id]
+        # Unindex the price first: nothing has changed yet if it fails
+        self._unindex_price(seq)
+        del self._seqs[book_id]
+        del self._order[bisect.bisect_left(self._order, seq)]
+        self._columns.delete(seq)
+        self._search_index.remove(book_id)
+        record = self._touch({'op': 'delete', 'id': book_id})
+        holes = self._columns.holes
+        if holes >= HOLE_COMPACT_MIN and holes >= HOLE_COMPACT_FRACTION * len(self._columns.ids):
+            self._compact_rows()
+        return record
+
+    def _compact_rows(self):
+        """
+        Rebuild the columns without the rows of deleted books.
+
+        Books are renumbered in catalog order, so the order, price index and
+        search index keep their relative order. Skipped while a background
+        index build holds sequences of the current numbering.
+        """
+        if not self._indexed.is_set():
+            return
+        renumbered = {seq: new for new, seq in enumerate(self._order)}
+        self._columns = self._columns.compacted(self._order)
+        self._seqs = {book_id: seq for seq, book_id in enumerate(self._columns.ids)}
+        self._order = array('q', range(len(self._columns.ids)))
+        self._prices = array('q', (renumbered[seq] for seq in self._prices))
+        self._search_index.renumber(self._seqs)
+
+    def add(self, book):
+        """Add a new book and persist it."""
+        with self._lock:
+            ticket = self._persist(self._add_locked(book))
+        self._wait_durable(ticket)
+        return book
+
+    def _check_precondition(self, book_id, precondition):
+        """Raise PreconditionFailed unless precondition(version) holds for the book."""
+        if precondition is not None and not precondition(self._columns.versions[self._seqs[book_id]]):
+            raise PreconditionFailed(book_id)
+
+    def update(self, book_id, changes, precondition=None):
+        """
+        Apply field changes to an existing book and persist it.
+
+        Parameters:
+            book_id (str): ID of the book to update
+            changes (dict): Fields to change
+            precondition (callable): Optional check of the book's current
+                version, evaluated under the lock (raises PreconditionFailed)
+
+        Returns:
+            dict: The updated book, or None if it doesn't exist
+        """
+        with self._lock:
+            if book_id not in self._seqs:
+                return None
+            self._check_precondition(book_id, precondition)
+            record = self._update_locked(book_id, changes)
+            ticket = self._persist(record)
+        self._wait_durable(ticket)
+        return record['book']
+
+    def delete(self, book_id, precondition=None):
+        """
+        Delete a book and persist the change.
+
+        See update() for the precondition parameter.
+
+        Returns:
+            bool: True if the book existed
+        """
+        with self._lock:
+            if book_id not in self._seqs:
+                return False
+            self._check_precondition(book_id, precondition)
+            ticket = self._persist(self._delete_locked(book_id))
+        self._wait_durable(ticket)
+        return True
+
+    def apply_batch(self, operations):
+        """
+        Apply several operations atomically with a single persistence step.
+
+        Parameters:
+            operations (list): Tuples of ('create', book), ('update', book_id, changes)
+                               or ('delete', book_id)
+
+        Returns:
+            tuple: (applied, results). results holds the new or updated book,
+                   or the deleted book's ID, for each operation, and None for
+                   operations whose book doesn't exist. If any result is None,
+                   applied is False and nothing was changed.
+        """
+        with self._lock:
+            # Check every target first so the batch is all-or-nothing
+            deleted = set()
+            missing = set()
+            for i, (kind, *args) in enumerate(operations):
+                if kind == 'create':
+                    continue
+                book_id = args[0]
+                if book_id not in self._seqs or book_id in deleted:
+                    missing.add(i)
+                elif kind == 'delete':
+                    deleted.add(book_id)
+
+            if missing:
+                results = [None if i in missing else True for i in range(len(operations))]
+                return False, results
+
+            results, records = [], []
+            for kind, *args in operations:
+                if kind == 'create':
+                    records.append(self._add_locked(args[0]))
+                    results.append(args[0])
+                elif kind == 'update':
+                    records.append(self._update_locked(args[0], args[1]))
+                    results.append(records[-1]['book'])
+                else:
+                    records.append(self._delete_locked(args[0]))
+                    results.append(args[0])
+
+            # A single journal line keeps the batch atomic across crashes
+            ticket = self._persist({'op': 'batch', 'records': records})
+        self._wait_durable(ticket)
+        return True, results
+
+    def replace_all(self, books):
+        """Replace the whole catalog and persist it."""
+        if self.policy == JOURNAL:
+            # The journal no longer describes the catalog, so start from a fresh snapshot
+            self.compact(replacement=books)
+            return
+
+        with self._lock:
+            self._set_books(books)
+            self._persist(None)
+
+    # Persistence
+
+    def _persist(self, record):
+        """
+        Persist a change according to the configured policy.
+
+        Must be called with the lock held.
+
+        Returns:
+            int: A journal ticket to wait on in journal mode, otherwise None
+        """
+        if self.policy == WRITE_THROUGH:
+            self._write()
+        elif self.policy == WRITE_BEHIND:
+            self._dirty = True
+        elif record is not None:
+            return self._journal.append(record)
+        return None
+
+    def _wait_durable(self, ticket):
+        """Wait (outside the lock) for a journal record to be committed."""
+        if ticket is not None:
+            self._journal.wait(ticket)
+
+    def _write(self, books=None):
+        """Write the catalog (or the given snapshot of it) to disk atomically."""
+        if books is None:
+            books = self._materialize(self._order)
+        self._replace_file(self._write_temp(books))
+        self._write_binary_snapshot(books, self._signature)
+
+    def _write_temp(self, books):
+        """Write books to a temporary file next to the data file and return its path."""
+        tmp_path = f"{self.path}.tmp"
+        # The file format stays a plain JSON list of books
+        with open(tmp_path, 'w') as f:
+            json.dump(books, f, indent=2)
+            if self.policy == JOURNAL:
+                f.flush()
+                os.fsync(f.fileno())
+        return tmp_path
+
+    def _replace_file(self, tmp_path):
+        """
+        Rename a written temporary file over the data file and record its signature.
+
+        Must be called with the lock held, so reload_if_changed() never sees
+        our own file before its signature is recorded.
+        """
+        os.replace(tmp_path, self.path)
+        self._signature = self._file_signature()
+        self._dirty = False
+
+    def flush(self):
+        """Write any pending changes to disk."""
+        with self._lock:
+            if self._dirty:
+                self._write()
+            if self._journal is not None:
+                self._journal.sync()
+
+    def compact(self, replacement=None):
+        """
+        Fold the journal into a fresh snapshot.
+
+        The journal is rotated aside under the lock; the snapshot is then
+        written without blocking writers, and renamed into place under the
+        lock so the catalog doesn't mistake it for an outside change.
+
+        Parameters:
+            replacement (list): Books to replace the catalog with before snapshotting
+        """
+        with self._compact_lock:
+            with self._lock:
+                if replacement is not None:
+                    self._set_books(replacement)
+                self._journal.rotate(self.compacting_path)
+                books = self._materialize(self._order)
+            tmp_path = self._write_temp(books)
+            with self._lock:
+                self._replace_file(tmp_path)
+                signature = self._signature
+            self._write_binary_snapshot(books, signature)
+            os.remove(self.compacting_path)
+
+    def _background_loop(self):
+        """Background loop that flushes write-behind changes or compacts the journal."""
+        while not self._stop.wait(self.flush_interval):
+            if self.policy == WRITE_BEHIND:
+                self.flush()
+            elif self._journal.size() >= self.compact_threshold:
+                self.compact()
+
+    def close(self):
+        """Stop background work and make pending changes durable."""
+        self._stop.set()
+        with self._lock:
+            self._index_generation += 1  # Stops a background index build
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+        self.flush()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
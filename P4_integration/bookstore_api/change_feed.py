@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Change Feed
+
+A bounded, in-memory log of recent catalog changes that consumers can follow
+instead of re-downloading the catalog. Every change is identified by the
+catalog version it produced, so a consumer only needs to remember the epoch
+and the last version it has seen.
+
+A consumer is told to take a fresh snapshot when the changes it needs are no
+longer available: it fell further behind than the feed's capacity, the
+catalog was replaced or reloaded (new epoch), or some versions were written
+by another process and never passed through this feed.
+"""
+from collections import OrderedDict
+import threading
+
+# Number of changes kept
+DEFAULT_CAPACITY = 10000
+
+
+class ChangeFeed:
+    """Ring buffer of recent changes with blocking reads."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, epoch=None, version=0):
+        """
+        Create an empty feed.
+
+        Parameters:
+            capacity (int): Maximum number of changes kept
+            epoch (str): Catalog epoch the feed starts at
+            version (int): Catalog version the feed starts at
+        """
+        self.capacity = capacity
+        self._cond = threading.Condition()
+        self._reset(epoch, version)
+
+    def _reset(self, epoch, version):
+        """Forget every change and start over at the given version."""
+        self.epoch = epoch
+        self.latest = version  # Newest version seen
+        self.floor = version   # Oldest version a consumer can resume from
+        self._changes = OrderedDict()  # version -> change, oldest first
+
+    def publish(self, epoch, version, record):
+        """
+        Add a change. Has the signature of a BookStorage listener.
+
+        record is a journal-style {'op': 'put', 'book': ...} or
+        {'op': 'delete', 'id': ...} record, or None if the catalog was
+        replaced, in which case every consumer has to resnapshot.
+        """
+        with self._cond:
+            if record is None:
+                self._reset(epoch, version)
+            elif epoch != self.epoch:
+                self._reset(epoch, version - 1)
+            if record is not None:
+                change = {'seq': version, 'op': record['op']}
+                if record['op'] == 'put':
+                    change['id'] = record['book']['id']
+                    change['book'] = record['book']
+                else:
+                    change['id'] = record['id']
+                self._changes[version] = change
+                self.latest = max(self.latest, version)
+                while len(self._changes) > self.capacity:
+                    self.floor, _ = self._changes.popitem(last=False)
+            self._cond.notify_all()
+
+    def position(self):
+        """Return (epoch, latest version): where a consumer starting now should begin."""
+        with self._cond:
+            return self.epoch, self.latest
+
+    def read(self, epoch, since, limit=None):
+        """
+        Return the changes after a version.
+
+        Parameters:
+            epoch (str): Catalog epoch the consumer is following
+            since (int): Last version the consumer has seen
+            limit (int): Maximum number of changes to return
+
+        Returns:
+            tuple: (changes, resnapshot). If resnapshot is True the changes
+                   after since are not available and the consumer has to
+                   reload the catalog and continue from the feed's latest version.
+        """
+        with self._cond:
+            if epoch != self.epoch or since < self.floor or since > self.latest:
+                return [], True
+            changes = []
+            version = since + 1
+            while version in self._changes and (limit is None or len(changes) < limit):
+                changes.append(self._changes[version])
+                version += 1
+            # Newer versions exist but the next one never reached this feed
+            if not changes and self.latest > since:
+                return [], True
+            return changes, False
+
+    def wait(self, epoch, since, timeout):
+        """
+        Block until there is something to read after since (or a resnapshot).
+
+        Returns:
+            bool: False if the timeout expired first
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: epoch != self.epoch or self.latest > since, timeout
+            )
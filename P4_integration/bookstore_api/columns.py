@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Book Columns
+
+A compact, column-oriented store for the books held in memory. Instead of
+one dict per book, each field is kept in its own column and a book is a row
+number:
+
+- IDs and titles in lists of strings
+- authors as array('I') codes into a table of interned names
+- prices in an array('d') of float64
+- the stock flag in a bytearray
+- the version and modification time of each book in arrays
+
+Dicts are only built when a book leaves the catalog (to be serialized).
+Deleted rows are left as holes until the store is rebuilt with compacted().
+"""
+from array import array
+import sys
+
+# Fields stored in columns, in the order they appear in a materialized book
+FIELDS = ('id', 'title', 'author', 'price', 'in_stock')
+
+# Marks a standard field that a book doesn't have
+MISSING = object()
+
+
+class BookColumns:
+    """Books stored column by column and addressed by row number."""
+
+    def __init__(self):
+        self.ids = []                # row -> book ID (None once deleted)
+        self.titles = []             # row -> title
+        self.authors = array('I')    # row -> index into author_names
+        self.author_names = []       # distinct, interned author names
+        self._author_codes = {}      # author name -> index into author_names
+        self.prices = array('d')     # row -> price as a float
+        self.in_stock = bytearray()  # row -> 1 if in stock
+        self.versions = array('q')   # row -> version of the last change
+        self.modified = array('d')   # row -> timestamp of the last change
+        # row -> fields that don't fit the columns: values of another type
+        # (kept exactly as given), missing standard fields and extra fields
+        self.extras = {}
+        self._live = 0
+
+    @classmethod
+    def from_columns(cls, ids, titles, author_names, authors, prices, in_stock, extras=None):
+        """
+        Build a store from ready-made columns (e.g. read from a snapshot).
+
+        Every row must be live. Versions start at 0 and modification times at 0.
+        """
+        columns = cls()
+        columns.ids = ids
+        columns.titles = titles
+        columns.author_names = [sys.intern(name) for name in author_names]
+        columns._author_codes = {name: code for code, name in enumerate(columns.author_names)}
+        columns.authors = authors
+        columns.prices = prices
+        columns.in_stock = in_stock
+        columns.versions = array('q', bytes(8 * len(ids)))
+        columns.modified = array('d', bytes(8 * len(ids)))
+        columns.extras = extras or {}
+        columns._live = len(ids)
+        return columns
+
+    def __len__(self):
+        return self._live
+
+    @property
+    def holes(self):
+        """Number of deleted rows still taking up space."""
+        return len(self.ids) - self._live
+
+    def _author_code(self, author):
+        """Return the code of an author name, adding it to the table if new."""
+        code = self._author_codes.get(author)
+        if code is None:
+            code = len(self.author_names)
+            author = sys.intern(author)
+            self.author_names.append(author)
+            self._author_codes[author] = code
+        return code
+
+    def _set(self, row, field, value, extras):
+        """Store one field of a row, recording values the column can't hold in extras."""
+        if field == 'title':
+            exact = isinstance(value, str)
+            self.titles[row] = value if exact else str(value)
+        elif field == 'author':
+            exact = isinstance(value, str)
+            self.authors[row] = self._author_code(value if exact else str(value))
+        elif field == 'price':
+            exact = type(value) is float
+            self.prices[row] = float(value)
+        elif field == 'in_stock':
+            exact = type(value) is bool
+            self.in_stock[row] = bool(value)
+        else:
+            extras[field] = value
+            return
+
+        if exact:
+            extras.pop(field, None)
+        else:
+            extras[field] = value
+
+    def append(self, book, version=0, modified=0.0):
+        """
+        Add a book as a new row.
+
+        Parameters:
+            book (dict): The book; it must have an id and a price
+            version (int): Version of the book
+            modified (float): Timestamp of its last change
+
+        Returns:
+            int: The new row number
+        """
+        book_id, price = book['id'], book['price']
+        title, author, in_stock = book.get('title'), book.get('author'), book.get('in_stock')
+        row = len(self.ids)
+        if (len(book) == len(FIELDS) and type(title) is str and type(author) is str
+                and type(price) is float and type(in_stock) is bool):
+            # Fast path for the common case: every field fits its column
+            self.ids.append(book_id)
+            self.titles.append(title)
+            self.authors.append(self._author_code(author))
+            self.prices.append(price)
+            self.in_stock.append(in_stock)
+            self.versions.append(version)
+            self.modified.append(modified)
+            self._live += 1
+            return row
+
+        float(price)  # Fail before adding anything if the price isn't a number
+        self.ids.append(book_id)
+        self.titles.append('')
+        self.authors.append(self._author_code(''))
+        self.prices.append(0.0)
+        self.in_stock.append(0)
+        self.versions.append(version)
+        self.modified.append(modified)
+
+        extras = {}
+        for field in FIELDS[1:]:
+            if field not in book:
+                extras[field] = MISSING
+        for field, value in book.items():
+            if field != 'id':
+                self._set(row, field, value, extras)
+        if extras:
+            self.extras[row] = extras
+        self._live += 1
+        return row
+
+    def update(self, row, changes):
+        """Apply field changes to a row."""
+        if 'price' in changes:
+            float(changes['price'])  # Fail before changing anything
+        extras = self.extras.get(row, {})
+        for field, value in changes.items():
+            if field != 'id':
+                self._set(row, field, value, extras)
+        if extras:
+            self.extras[row] = extras
+        else:
+            self.extras.pop(row, None)
+
+    def delete(self, row):
+        """Delete a row, leaving a hole."""
+        self.ids[row] = None
+        self.titles[row] = ''
+        self.extras.pop(row, None)
+        self._live -= 1
+
+    def compacted(self, rows):
+        """
+        Return a store holding only the given rows, renumbered from 0 in that order.
+
+        Versions, modification times and extras are kept; authors no longer
+        used by any row are dropped from the name table.
+        """
+        columns = BookColumns()
+        columns.ids = [self.ids[row] for row in rows]
+        columns.titles = [self.titles[row] for row in rows]
+        names = self.author_names
+        columns.authors = array('I', (columns._author_code(names[self.authors[row]]) for row in rows))
+        columns.prices = array('d', (self.prices[row] for row in rows))
+        columns.in_stock = bytearray(self.in_stock[row] for row in rows)
+        columns.versions = array('q', (self.versions[row] for row in rows))
+        columns.modified = array('d', (self.modified[row] for row in rows))
+        columns.extras = {new: self.extras[row] for new, row in enumerate(rows) if row in self.extras}
+        columns._live = len(columns.ids)
+        return columns
+
+    def book(self, row):
+        """Materialize a row as a book dict."""
+        book = {
+            'id': self.ids[row],
+            'title': self.titles[row],
+            'author': self.author_names[self.authors[row]],
+            'price': self.prices[row],
+            'in_stock': bool(self.in_stock[row])
+        }
+        extras = self.extras.get(row)
+        if extras:
+            for field, value in extras.items():
+                if value is MISSING:
+                    del book[field]
+                else:
+                    book[field] = value
+        return book
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Book Journal
+
+An append-only log of catalog mutations. Each mutation is a single JSON line,
+so a write costs O(size of the book) instead of O(size of the catalog).
+Appends are made durable by a background committer that fsyncs in batches
+(group commit): writers that arrive while an fsync is in progress share the
+next one.
+"""
+import json
+import os
+import threading
+import time
+
+# How long the committer waits for more writers to join a batch
+DEFAULT_COMMIT_INTERVAL = 0.002
+
+
+def read_records(path):
+    """
+    Yield the records stored in a journal file.
+
+    A torn final line (from a crash in the middle of an append) is ignored.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            yield json.loads(line)
+
+
+def _truncate_torn_tail(path):
+    """Cut off a partially written final line so new appends start cleanly."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        # Scan backwards in chunks for the last newline
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            chunk = f.read(end - start)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
+
+
+class Journal:
+    """Append-only JSON-lines journal with group commit."""
+
+    def __init__(self, path, commit_interval=DEFAULT_COMMIT_INTERVAL):
+        """
+        Open (or create) a journal for appending.
+
+        Parameters:
+            path (str): Path of the journal file
+            commit_interval (float): Seconds to wait for more appends before each fsync
+        """
+        self.path = path
+        self.commit_interval = commit_interval
+
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._pending = []
+        self._issued = 0   # Tickets handed out by append()
+        self._durable = 0  # Highest ticket that has been fsynced
+        self._error = None
+        self._closed = False
+
+        _truncate_torn_tail(path)
+        self._file = open(path, 'a', encoding='utf-8')
+
+        self._committer = threading.Thread(
+            target=self._commit_loop, name='journal-committer', daemon=True
+        )
+        self._committer.start()
+
+    def append(self, record):
+        """
+        Queue a record for the next group commit.
+
+        Returns:
+            int: A ticket to pass to wait()
+        """
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Journal is closed")
+            self._pending.append(line)
+            self._issued += 1
+            self._cond.notify_all()
+            return self._issued
+
+    def wait(self, ticket):
+        """Block until the record with the given ticket is on disk."""
+        with self._cond:
+            while self._durable < ticket and self._error is None:
+                self._cond.wait()
+            if self._durable < ticket:
+                raise OSError(f"Journal commit failed: {self._error}")
+
+    def sync(self):
+        """Block until everything appended so far is on disk."""
+        with self._cond:
+            ticket = self._issued
+        self.wait(ticket)
+
+    def _commit_loop(self):
+        """Background loop that writes and fsyncs pending records in batches."""
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+
+            # Give concurrent writers a moment to join this batch
+            if self.commit_interval:
+                time.sleep(self.commit_interval)
+
+            with self._cond:
+                batch, self._pending = self._pending, []
+                ticket = self._issued
+
+            try:
+                with self._io_lock:
+                    self._file.writelines(batch)
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+            except OSError as e:
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._durable = ticket
+                self._cond.notify_all()
+
+    def size(self):
+        """Return the size of the journal file in bytes."""
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def rotate(self, segment_path):
+        """
+        Move the current journal to segment_path and start an empty one.
+
+        The caller must make sure no appends happen while rotating.
+        """
+        self.sync()
+        with self._io_lock:
+            self._file.close()
+            os.replace(self.path, segment_path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        """Commit pending records and close the journal."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._committer.join()
+        with self._io_lock:
+            self._file.close()
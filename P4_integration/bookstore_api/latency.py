@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Latency Injection
+
+The API simulates network latency on every route. A latency profile turns
+each route's nominal delay into the delay that is actually applied:
+
+- "fixed": always the nominal delay (the original behaviour)
+- "zero": no delay at all, so benchmarks measure the real server cost
+- "uniform": uniformly distributed between 0 and twice the nominal delay
+- "exponential": exponentially distributed with the nominal delay as its mean
+"""
+import random
+
+# Latency profiles
+FIXED = 'fixed'
+ZERO = 'zero'
+UNIFORM = 'uniform'
+EXPONENTIAL = 'exponential'
+LATENCY_PROFILES = (FIXED, ZERO, UNIFORM, EXPONENTIAL)
+
+
+class LatencyProfile:
+    """Samples the delay to inject for a route with a given nominal delay."""
+
+    def __init__(self, kind=FIXED, scale=1.0, rng=None):
+        """
+        Create a latency profile.
+
+        Parameters:
+            kind (str): One of LATENCY_PROFILES
+            scale (float): Factor applied to every nominal delay
+            rng (random.Random): Random source (injectable for tests)
+        """
+        if kind not in LATENCY_PROFILES:
+            raise ValueError(f"Unknown latency profile: {kind}")
+        if scale < 0:
+            raise ValueError("Latency scale must not be negative")
+        self.kind = kind
+        self.scale = scale
+        self._rng = rng or random.Random()
+
+    def delay(self, seconds):
+        """Return the delay in seconds to inject for a nominal delay."""
+        mean = seconds * self.scale
+        if self.kind == ZERO or mean <= 0:
+            return 0.0
+        if self.kind == UNIFORM:
+            return self._rng.uniform(0, 2 * mean)
+        if self.kind == EXPONENTIAL:
+            return self._rng.expovariate(1 / mean)
+        return mean
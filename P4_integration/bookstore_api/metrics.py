@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Request Metrics
+
+Per-route latency histograms, a per-request breakdown into phases (simulated
+delay, storage load, compute, serialize, persist), Prometheus text export,
+and an opt-in sampler that keeps cProfile output for the slowest requests.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+import heapq
+import io
+import itertools
+import pstats
+import threading
+import time
+
+from flask import g, has_request_context
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Request phases. "compute" is whatever time is not attributed to another phase.
+DELAY = 'delay'
+LOAD = 'load'
+COMPUTE = 'compute'
+SERIALIZE = 'serialize'
+PERSIST = 'persist'
+PHASES = (DELAY, LOAD, COMPUTE, SERIALIZE, PERSIST)
+
+
+class Histogram:
+    """A cumulative-bucket latency histogram, as used by Prometheus."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record one observation."""
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Yield (upper bound, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+        yield float('inf'), self.count
+
+
+@contextmanager
+def phase(name):
+    """Attribute the time spent in a with block to a phase of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and 'phases' in g:
+            g.phases[name] += time.perf_counter() - start
+
+
+def _labels(**labels):
+    """Format Prometheus labels."""
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _bound(value):
+    """Format a bucket bound the way Prometheus expects."""
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+class ProfileSampler:
+    """Keeps the cProfile stats of the N slowest sampled requests."""
+
+    def __init__(self, keep=5):
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._heap = []  # (duration, tie-breaker, description, stats text)
+        self._counter = itertools.count()
+
+    def offer(self, duration, description, profiler):
+        """Keep a profile if it is among the slowest seen so far."""
+        with self._lock:
+            if len(self._heap) >= self.keep and duration <= self._heap[0][0]:
+                return
+        # Formatting the stats is slow, so only do it for profiles that are kept
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+        entry = (duration, next(self._counter), description, out.getvalue())
+        with self._lock:
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, entry)
+            else:
+                heapq.heappushpop(self._heap, entry)
+
+    def report(self):
+        """Return the kept profiles as text, slowest first."""
+        with self._lock:
+            entries = sorted(self._heap, reverse=True)
+        if not entries:
+            return "No requests have been profiled.\n"
+        return '\n'.join(
+            f"=== {description}: {duration * 1000:.1f} ms ===\n{stats}"
+            for duration, _, description, stats in entries
+        )
+
+
+class MetricsRegistry:
+    """Collects request counts, latency histograms and phase histograms."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = defaultdict(int)                    # (route, method, status) -> count
+        self._latency = defaultdict(lambda: Histogram(self.buckets))  # (route, method)
+        self._phases = defaultdict(lambda: Histogram(self.buckets))   # (route, method, phase)
+
+    def observe(self, route, method, status, duration, phases):
+        """Record a finished request and its phase breakdown."""
+        with self._lock:
+            self._requests[(route, method, status)] += 1
+            self._latency[(route, method)].observe(duration)
+            for name, seconds in phases.items():
+                self._phases[(route, method, name)].observe(seconds)
+
+    def render(self, extra=()):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Parameters:
+            extra (iterable): Additional (name, type, help, value) metrics to append
+        """
+        lines = []
+        with self._lock:
+            lines.append('# HELP bookstore_requests_total Requests handled, by route, method and status.')
+            lines.append('# TYPE bookstore_requests_total counter')
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append(f'bookstore_requests_total{{{_labels(route=route, method=method, status=status)}}} {count}')
+
+            lines.append('# HELP bookstore_request_duration_seconds Request latency by route.')
+            lines.append('# TYPE bookstore_request_duration_seconds histogram')
+            for (route, method), hist in sorted(self._latency.items()):
+                self._render_histogram(lines, 'bookstore_request_duration_seconds', hist,
+                                       route=route, method=method)
+
+            lines.append('# HELP bookstore_request_phase_seconds Time spent in each phase of a request.')
+            lines.append('# TYPE bookstore_request_phase_seconds histogram')
+            for (route, method, name), hist in sorted(self._phases.items()):
+                self._render_histogram(lines, 'bookstore_request_phase_seconds', hist,
+                                       route=route, method=method, phase=name)
+
+        for name, kind, help_text, value in extra:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histogram(lines, name, hist, **labels):
+        """Append the bucket, sum and count lines of one histogram."""
+        for bound, count in hist.cumulative():
+            lines.append(f'{name}_bucket{{{_labels(**labels, le=_bound(bound))}}} {count}')
+        lines.append(f'{name}_sum{{{_labels(**labels)}}} {hist.sum}')
+        lines.append(f'{name}_count{{{_labels(**labels)}}} {hist.count}')
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Query Cache
+
+A bounded LRU cache with a TTL for serialized list and search responses.
+Every entry remembers the catalog version it was computed at, so a write
+invalidates exactly the entries computed before it without having to track
+which queries it affected.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class QueryCache:
+    """LRU + TTL cache keyed on normalized query parameters."""
+
+    def __init__(self, max_entries=1024, ttl=30.0, clock=time.monotonic):
+        """
+        Create an empty cache.
+
+        Parameters:
+            max_entries (int): Maximum number of entries; 0 disables the cache
+            ttl (float): Seconds an entry stays valid
+            clock (callable): Time source (injectable for tests)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, expires_at, value)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0       # Dropped to stay within max_entries
+        self.expirations = 0     # Dropped because the TTL ran out
+        self.invalidations = 0   # Dropped because the catalog changed
+
+    @property
+    def enabled(self):
+        """Whether caching is turned on."""
+        return self.max_entries > 0
+
+    def get(self, key, version):
+        """Return the cached value for key at the given catalog version, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_version, expires_at, value = entry
+                if entry_version != version:
+                    del self._entries[key]
+                    self.invalidations += 1
+                elif expires_at <= self._clock():
+                    del self._entries[key]
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, version, value):
+        """Store a value computed at the given catalog version."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (version, self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Search Index
+
+An incrementally maintained inverted index over book titles and authors.
+A trigram index answers substring queries and a token index answers
+whole-word queries, so a search only looks at candidate books instead of
+scanning the whole catalog.
+"""
+from collections import defaultdict
+import heapq
+import itertools
+import re
+
+# Fields that are searched
+FIELDS = ('title', 'author')
+
+# Match modes
+SUBSTRING = 'substring'  # Query must appear anywhere in the title or author
+WORD = 'word'            # Every query word must appear as a whole word
+MATCH_MODES = (SUBSTRING, WORD)
+
+GRAM_SIZE = 3
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def trigrams(text):
+    """Return the set of trigrams in a (lowercased) string."""
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def tokens(text):
+    """Return the set of words in a (lowercased) string."""
+    return set(TOKEN_PATTERN.findall(text))
+
+
+def _field_score(query, text):
+    """Score how well a query matches one field: exact > prefix > word > substring."""
+    if text == query:
+        return 4
+    if text.startswith(query):
+        return 3
+    if re.search(rf'\b{re.escape(query)}\b', text):
+        return 2
+    if query in text:
+        return 1
+    return 0
+
+
+def relevance(query, title, author):
+    """Relevance of a book to a (lowercased) query; title matches weigh double."""
+    return 2 * _field_score(query, title.lower()) + _field_score(query, author.lower())
+
+
+def scan(query, books, match=SUBSTRING, rank=False, limit=None):
+    """
+    Search books one by one, without an index.
+
+    Returns the same results as SearchIndex.search, but as books rather than
+    IDs. Used while an index is still being built.
+
+    Parameters:
+        query (str): The search text (case-insensitive)
+        books (iterable): Books in catalog order
+        match (str): One of MATCH_MODES
+        rank (bool): Order by relevance instead of catalog order
+        limit (int): Maximum number of books to return
+
+    Returns:
+        list: Matching books
+    """
+    if match not in MATCH_MODES:
+        raise ValueError(f"Unknown match mode: {match}")
+
+    query = query.lower()
+    words = tokens(query) if match == WORD else None
+    if words is not None and not words:
+        return []
+
+    hits = []
+    for book in books:
+        title, author = (str(book.get(field, '')).lower() for field in FIELDS)
+        if words is None:
+            found = query in title or query in author
+        else:
+            found = words <= tokens(title) | tokens(author)
+        if found:
+            hits.append((title, author, book))
+
+    if rank:
+        # The sort is stable, so equally relevant books stay in catalog order
+        hits.sort(key=lambda hit: -relevance(query, hit[0], hit[1]))
+    return [book for _, _, book in hits[:limit]]
+
+
+class SearchIndex:
+    """Trigram and token index over the title and author of each book."""
+
+    def __init__(self, books=()):
+        """Build the index from an iterable of books."""
+        # field -> trigram -> set of book IDs
+        self._grams = {field: defaultdict(set) for field in FIELDS}
+        # word -> set of book IDs (title and author combined)
+        self._tokens = defaultdict(set)
+        # book ID -> (insertion sequence, {field: lowercased text})
+        self._docs = {}
+        self._seq = itertools.count()
+        for book in books:
+            self.add(book)
+
+    def __len__(self):
+        return len(self._docs)
+
+    # Maintenance
+
+    def add(self, book, seq=None):
+        """
+        Index a book, replacing any previous entry with the same ID.
+
+        seq is the book's position in catalog order; by default books are
+        ordered by when they were first added to the index.
+        """
+        book_id = book['id']
+        previous = self._docs.get(book_id)
+        # Updates keep their original position so results stay in catalog order
+        if previous:
+            seq = previous[0]
+        elif seq is None:
+            seq = next(self._seq)
+        if previous:
+            self._unindex(book_id, previous[1])
+
+        texts = {field: str(book.get(field, '')).lower() for field in FIELDS}
+        for field, text in texts.items():
+            postings = self._grams[field]
+            for gram in trigrams(text):
+                postings[gram].add(book_id)
+            for token in tokens(text):
+                self._tokens[token].add(book_id)
+        self._docs[book_id] = (seq, texts)
+
+    update = add
+
+    def renumber(self, seqs):
+        """Give every indexed book its new position from a dict of book ID -> sequence."""
+        self._docs = {book_id: (seqs[book_id], texts) for book_id, (_, texts) in self._docs.items()}
+
+    def remove(self, book_id):
+        """Remove a book from the index if present."""
+        entry = self._docs.pop(book_id, None)
+        if entry:
+            self._unindex(book_id, entry[1])
+
+    def _unindex(self, book_id, texts):
+        """Drop a book's postings, deleting posting lists that become empty."""
+        for field, text in texts.items():
+            postings = self._grams[field]
+            for gram in trigrams(text):
+                ids = postings[gram]
+                ids.discard(book_id)
+                if not ids:
+                    del postings[gram]
+            for token in tokens(text):
+                ids = self._tokens[token]
+                ids.discard(book_id)
+                if not ids:
+                    del self._tokens[token]
+
+    # Queries
+
+    @staticmethod
+    def _intersect(postings, keys):
+        """Intersect the posting sets for the given keys, smallest first."""
+        sets = []
+        for key in keys:
+            ids = postings.get(key)
+            if not ids:
+                return set()
+            sets.append(ids)
+        sets.sort(key=len)
+        return set(sets[0]).intersection(*sets[1:])
+
+    def _substring_candidates(self, query):
+        """Return IDs of books whose title or author contains the query."""
+        if len(query) < GRAM_SIZE:
+            # Too short for trigrams; these queries match most of the catalog anyway
+            candidates = self._docs.keys()
+        else:
+            grams = trigrams(query)
+            candidates = set()
+            for field in FIELDS:
+                candidates |= self._intersect(self._grams[field], grams)
+
+        # Trigrams can produce false positives, so confirm the real substring
+        return [
+            book_id for book_id in candidates
+            if any(query in text for text in self._docs[book_id][1].values())
+        ]
+
+    def _word_candidates(self, query):
+        """Return IDs of books containing every word of the query."""
+        words = tokens(query)
+        if not words:
+            return []
+        return list(self._intersect(self._tokens, words))
+
+    def search(self, query, match=SUBSTRING, rank=False, limit=None):
+        """
+        Search the index.
+
+        Parameters:
+            query (str): The search text (case-insensitive)
+            match (str): One of MATCH_MODES
+            rank (bool): Order by relevance instead of catalog order
+            limit (int): Maximum number of IDs to return
+
+        Returns:
+            list: Matching book IDs
+        """
+        if match not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode: {match}")
+
+        query = query.lower()
+        if match == SUBSTRING:
+            candidates = self._substring_candidates(query)
+        else:
+            candidates = self._word_candidates(query)
+
+        if rank:
+            def key(book_id):
+                seq, texts = self._docs[book_id]
+                return (-relevance(query, texts['title'], texts['author']), seq)
+        else:
+            def key(book_id):
+                return self._docs[book_id][0]
+
+        if limit is not None:
+            return heapq.nsmallest(limit, candidates, key=key)
+        return sorted(candidates, key=key)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Response Serialization
+
+Encoders for the formats the API can send (JSON and, if the msgpack package
+is installed, MessagePack) and response compression.
+
+orjson is used for JSON when it is installed and falls back to the standard
+json module otherwise; both produce compact output.
+"""
+import gzip
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+# Media types
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+# Older name for MessagePack that some clients still send
+MSGPACK_MIMETYPES = (MSGPACK_MIMETYPE, 'application/x-msgpack')
+
+# Content codings, in order of preference
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+CONTENT_CODINGS = (GZIP, DEFLATE)
+
+# Compression level: responses are compressed on every request, so favour speed
+COMPRESSION_LEVEL = 5
+
+# Short tags that tell representations of the same resource apart in strong ETags
+FORMAT_TAGS = {JSON_MIMETYPE: '', MSGPACK_MIMETYPE: 'msgpack'}
+
+
+def available_mimetypes():
+    """Return the media types the server can produce, preferred first."""
+    if msgpack is None:
+        return [JSON_MIMETYPE]
+    return [JSON_MIMETYPE, MSGPACK_MIMETYPE]
+
+
+def dumps_json(payload):
+    """Serialize a payload to compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def encode(payload, mimetype=JSON_MIMETYPE):
+    """Serialize a payload in the given format."""
+    if mimetype == MSGPACK_MIMETYPE:
+        return msgpack.packb(payload)
+    return dumps_json(payload)
+
+
+def decode(body, mimetype):
+    """
+    Deserialize a request body.
+
+    Raises:
+        ValueError: If the body isn't valid in the given format
+    """
+    if mimetype in MSGPACK_MIMETYPES:
+        if msgpack is None:
+            raise ValueError("MessagePack is not supported by this server")
+        try:
+            return msgpack.unpackb(body)
+        except Exception as e:  # msgpack raises several unrelated exception types
+            raise ValueError(f"Invalid MessagePack body: {e}") from e
+    return json.loads(body)
+
+
+def compress(body, coding):
+    """Compress a body with the given content coding."""
+    if coding == GZIP:
+        return gzip.compress(body, compresslevel=COMPRESSION_LEVEL, mtime=0)
+    if coding == DEFLATE:
+        return zlib.compress(body, COMPRESSION_LEVEL)
+    raise ValueError(f"Unknown content coding: {coding}")
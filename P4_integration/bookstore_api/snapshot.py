@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Catalog Snapshots
+
+A compact binary copy of books.json that the server can load much faster
+than it can parse JSON. The snapshot stores the catalog column by column
+(see columns.py), so loading it is mostly a handful of bulk copies out of a
+memory-mapped file rather than one Python object per field.
+
+Layout (little-endian):
+
+    header   magic, format version, flags, book count, signature of the
+             books.json it mirrors, CRC-32 of the body, body length
+    body     sections, each an 8-byte length followed by its bytes:
+             IDs, titles and author names as NUL-separated UTF-8,
+             author codes (uint32), prices (float64), stock flags (uint8),
+             and JSON for anything the columns can't hold
+"""
+from array import array
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from columns import BookColumns, MISSING
+
+MAGIC = b'BOOKSNAP'
+FORMAT_VERSION = 1
+
+# magic, format version, flags, book count, source mtime_ns, source size,
+# source inode, body CRC-32, body length
+HEADER = struct.Struct('<8sHHQqqqIQ')
+SECTION_LENGTH = struct.Struct('<Q')
+
+SEPARATOR = '\0'
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot can't be written or is missing, corrupt or of another version."""
+
+
+def _little_endian(values):
+    """Return the bytes of an array in little-endian order."""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _join(strings):
+    """Encode strings as one NUL-separated block."""
+    return SEPARATOR.join(strings).encode('utf-8')
+
+
+def _split(block, count):
+    """Decode a NUL-separated block back into a list of strings."""
+    if count == 0:
+        return []
+    return str(block, 'utf-8').split(SEPARATOR)
+
+
+def write_snapshot(path, books, source=None, fsync=False):
+    """
+    Write books to a snapshot file atomically.
+
+    Parameters:
+        path (str): Snapshot file to write
+        books (list): Books in catalog order
+        source (tuple): (mtime_ns, size, inode) of the books.json this snapshot mirrors
+        fsync (bool): Flush the file to disk before renaming it into place
+    """
+    columns = BookColumns()
+    for book in books:
+        # IDs are stored as strings, so others wouldn't come back as they were
+        if not isinstance(book['id'], str):
+            raise SnapshotError(f"Book IDs must be strings, not {type(book['id']).__name__}")
+        if SEPARATOR in book['id']:
+            raise SnapshotError("Book IDs can't contain NUL characters")
+        columns.append(book)
+
+    # Strings containing the separator are stored in the extras instead
+    extras = {row: dict(fields) for row, fields in columns.extras.items()}
+    for row, title in enumerate(columns.titles):
+        if SEPARATOR in title:
+            extras.setdefault(row, {})['title'] = title
+            columns.titles[row] = ''
+    author_names = [name.replace(SEPARATOR, '') for name in columns.author_names]
+    for row, code in enumerate(columns.authors):
+        if SEPARATOR in columns.author_names[code]:
+            extras.setdefault(row, {})['author'] = columns.author_names[code]
+
+    encoded_extras = {
+        str(row): {
+            'fields': {k: v for k, v in fields.items() if v is not MISSING},
+            'missing': [k for k, v in fields.items() if v is MISSING]
+        }
+        for row, fields in extras.items()
+    }
+
+    sections = [
+        _join(columns.ids),
+        _join(columns.titles),
+        _join(author_names),
+        _little_endian(columns.authors),
+        _little_endian(columns.prices),
+        bytes(columns.in_stock),
+        json.dumps(encoded_extras).encode('utf-8'),
+    ]
+    body = b''.join(SECTION_LENGTH.pack(len(section)) + section for section in sections)
+    mtime_ns, size, inode = source or (0, 0, 0)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(columns.ids), mtime_ns, size, inode,
+                         zlib.crc32(body), len(body))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(body)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """
+    Load a snapshot through a read-only memory map.
+
+    Returns:
+        tuple: (columns, source) where columns is a BookColumns and source the
+               (mtime_ns, size, inode) of the books.json it mirrors
+
+    Raises:
+        SnapshotError: If the file is missing, truncated, corrupt or of another format version
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        raise SnapshotError(f"No snapshot at {path}")
+    with f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise SnapshotError("Snapshot is truncated")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Every view into the map has to be released before it can be closed
+            views = [memoryview(mm)]
+            try:
+                return _decode(views)
+            finally:
+                for view in reversed(views):
+                    view.release()
+
+
+def _decode(views):
+    """Decode a snapshot from a buffer, appending every view taken of it to views."""
+    view = views[0]
+    (magic, version, _, count, mtime_ns, size, inode,
+     crc, body_length) = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise SnapshotError("Not a catalog snapshot")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+    body = view[HEADER.size:]
+    views.append(body)
+    if len(body) != body_length or zlib.crc32(body) != crc:
+        raise SnapshotError("Snapshot checksum mismatch")
+
+    sections, offset = [], 0
+    while offset + SECTION_LENGTH.size <= len(body):
+        (length,) = SECTION_LENGTH.unpack_from(body, offset)
+        offset += SECTION_LENGTH.size
+        sections.append(body[offset:offset + length])
+        offset += length
+    views.extend(sections)
+    if len(sections) != 7 or offset != len(body):
+        raise SnapshotError("Snapshot is missing sections")
+    ids, titles, names, codes, prices, stock, extras = sections
+
+    authors, price_column = array('I'), array('d')
+    authors.frombytes(codes)
+    price_column.frombytes(prices)
+    if sys.byteorder == 'big':
+        authors.byteswap()
+        price_column.byteswap()
+
+    decoded_extras = {}
+    for row, entry in json.loads(str(extras, 'utf-8')).items():
+        fields = dict(entry['fields'])
+        fields.update(dict.fromkeys(entry['missing'], MISSING))
+        decoded_extras[int(row)] = fields
+
+    columns = BookColumns.from_columns(
+        ids=_split(ids, count),
+        titles=_split(titles, count),
+        author_names=_split(names, 1),
+        authors=authors,
+        prices=price_column,
+        in_stock=bytearray(stock),
+        extras=decoded_extras
+    )
+    if not (len(columns.ids) == len(columns.titles) == len(authors) == len(price_column)
+            == len(columns.in_stock) == count):
+        raise SnapshotError("Snapshot columns have inconsistent lengths")
+    return columns, (mtime_ns, size, inode)
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+SQLite Catalog
+
+A storage backend that keeps books in a SQLite database instead of memory.
+The database runs in WAL mode so several worker processes can read while one
+writes, every write is a single transaction, and search is served by FTS5
+tables (trigram for substring queries, unicode61 for whole-word queries).
+"""
+from contextlib import contextmanager
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from search_index import MATCH_MODES, SUBSTRING, relevance, tokens
+from storage import BookStorage, PreconditionFailed
+
+# Maximum number of idle connections kept per worker process
+DEFAULT_POOL_SIZE = 8
+# Number of prepared statements cached per connection
+STATEMENT_CACHE_SIZE = 64
+# Shortest query the trigram tokenizer can match
+MIN_TRIGRAM_QUERY = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    price REAL NOT NULL,
+    in_stock INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    modified_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_price ON books (price, seq);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author, content='books', content_rowid='seq', tokenize='trigram'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS books_words USING fts5(
+    title, author, content='books', content_rowid='seq'
+);
+
+CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title, author) VALUES (new.seq, new.title, new.author);
+    INSERT INTO books_words (rowid, title, author) VALUES (new.seq, new.title, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.seq, old.title, old.author);
+    INSERT INTO books_words (books_words, rowid, title, author) VALUES ('delete', old.seq, old.title, old.author);
+END;
+CREATE TRIGGER IF NOT EXISTS books_au AFTER UPDATE OF title, author ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.seq, old.title, old.author);
+    INSERT INTO books_words (books_words, rowid, title, author) VALUES ('delete', old.seq, old.title, old.author);
+    INSERT INTO books_fts (rowid, title, author) VALUES (new.seq, new.title, new.author);
+    INSERT INTO books_words (rowid, title, author) VALUES (new.seq, new.title, new.author);
+END;
+"""
+
+# Statements are kept as constants so each connection prepares them once
+BOOK_COLUMNS = "id, title, author, price, in_stock"
+SELECT_ALL = f"SELECT {BOOK_COLUMNS} FROM books ORDER BY seq"
+SELECT_BOOK = f"SELECT {BOOK_COLUMNS}, version, seq FROM books WHERE id = ?"
+SELECT_VERSION = "SELECT version, modified_at FROM books WHERE id = ?"
+SELECT_SEQ = "SELECT seq FROM books WHERE id = ?"
+SELECT_META = "SELECT value FROM meta WHERE key = ?"
+UPSERT_META = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+COUNT_BOOKS = "SELECT COUNT(*) FROM books"
+INSERT_BOOK = (
+    "INSERT INTO books (id, title, author, price, in_stock, version, modified_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+UPDATE_BOOK = (
+    "UPDATE books SET title = ?, author = ?, price = ?, in_stock = ?, version = ?, modified_at = ? "
+    "WHERE id = ?"
+)
+DELETE_BOOK = "DELETE FROM books WHERE id = ?"
+SEARCH_SUBSTRING = (
+    f"SELECT {BOOK_COLUMNS} FROM books WHERE seq IN "
+    "(SELECT rowid FROM books_fts WHERE books_fts MATCH ?) ORDER BY seq"
+)
+SEARCH_SHORT = (
+    f"SELECT {BOOK_COLUMNS} FROM books "
+    "WHERE instr(py_lower(title), ?) OR instr(py_lower(author), ?) ORDER BY seq"
+)
+SEARCH_WORDS = (
+    f"SELECT {BOOK_COLUMNS} FROM books WHERE seq IN "
+    "(SELECT rowid FROM books_words WHERE books_words MATCH ?) ORDER BY seq"
+)
+
+
+def _row_to_book(row):
+    """Convert a (id, title, author, price, in_stock) row into a book dict."""
+    return {
+        'id': row[0],
+        'title': row[1],
+        'author': row[2],
+        'price': row[3],
+        'in_stock': bool(row[4])
+    }
+
+
+def _phrase(text):
+    """Quote text as a single FTS5 phrase."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+class ConnectionPool:
+    """
+    A small pool of SQLite connections for one worker process.
+
+    Connections are never shared across a fork: if the pool is used from a
+    new process it starts over with fresh connections.
+    """
+
+    def __init__(self, path, size=DEFAULT_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        """Open and configure a new connection."""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,  # Transactions are managed explicitly
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.create_function('py_lower', 1, str.lower, deterministic=True)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block."""
+        if os.getpid() != self._pid:
+            # Forked (e.g. a new gunicorn worker): don't reuse the parent's connections
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue(maxsize=self.size)
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class SqliteCatalog(BookStorage):
+    """Book storage backed by a SQLite database."""
+
+    def __init__(self, path, seed_file=None, default_books=None, pool_size=DEFAULT_POOL_SIZE):
+        """
+        Open (and if necessary create) the database.
+
+        Parameters:
+            path (str): Path of the SQLite database file
+            seed_file (str): books.json to import when the database is new
+            default_books (list): Books to start with if there is no seed file
+            pool_size (int): Maximum idle connections kept per process
+        """
+        self.path = path
+        self._pool = ConnectionPool(path, size=pool_size)
+        # SQLite allows one writer at a time anyway; holding a lock in this
+        # process as well lets listeners see this process's changes in order
+        self._write_lock = threading.Lock()
+        self._pending = []  # (epoch, version, record) to notify after the commit
+
+        with self._pool.connection() as conn:
+            conn.executescript(SCHEMA)
+        with self._transaction() as conn:
+            if self._meta(conn, 'epoch') is None:
+                self._seed(conn, seed_file, default_books or [])
+
+    # Connections and transactions
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Run a block in a write transaction that takes the write lock up front.
+
+        Changes recorded with _record() are passed to listeners once committed.
+        """
+        with self._write_lock, self._pool.connection() as conn:
+            self._pending = []
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            for change in self._pending:
+                self._notify(*change)
+            self._pending = []
+
+    def _record(self, conn, version, record):
+        """Remember a change made in the current transaction for the listeners."""
+        if self._listeners:
+            self._pending.append((self._meta(conn, 'epoch'), version, record))
+
+    @staticmethod
+    def _meta(conn, key):
+        """Read a value from the meta table."""
+        row = conn.execute(SELECT_META, (key,)).fetchone()
+        return row[0] if row else None
+
+    def _read_meta(self, key, default):
+        """Read a value from the meta table outside of a transaction."""
+        with self._pool.connection() as conn:
+            value = self._meta(conn, key)
+        return default if value is None else value
+
+    def _seed(self, conn, seed_file, default_books):
+        """Fill a new database from books.json, or the default books if there is none."""
+        books = default_books
+        if seed_file and os.path.exists(seed_file):
+            with open(seed_file, 'r') as f:
+                books = json.load(f)
+        now = time.time()
+        conn.executemany(INSERT_BOOK, [
+            (b['id'], b['title'], b['author'], float(b['price']), bool(b['in_stock']), 0, now)
+            for b in books
+        ])
+        conn.execute(UPSERT_META, ('epoch', uuid.uuid4().hex[:8]))
+        conn.execute(UPSERT_META, ('version', 0))
+        conn.execute(UPSERT_META, ('last_modified', now))
+
+    def _bump(self, conn):
+        """Increase the catalog version inside a write transaction."""
+        version = self._meta(conn, 'version') + 1
+        now = time.time()
+        conn.execute(UPSERT_META, ('version', version))
+        conn.execute(UPSERT_META, ('last_modified', now))
+        return version, now
+
+    # Versions are shared by every worker, so they live in the database
+
+    @property
+    def epoch(self):
+        return self._read_meta('epoch', None)
+
+    @property
+    def version(self):
+        return self._read_meta('version', 0)
+
+    @property
+    def last_modified(self):
+        return self._read_meta('last_modified', 0.0)
+
+    # Reads
+
+    def all(self):
+        """Return a list of all books in insertion order."""
+        with self._pool.connection() as conn:
+            return [_row_to_book(row) for row in conn.execute(SELECT_ALL)]
+
+    def get(self, book_id):
+        """Return the book with the given ID, or None if it doesn't exist."""
+        with self._pool.connection() as conn:
+            row = conn.execute(SELECT_BOOK, (book_id,)).fetchone()
+        return _row_to_book(row) if row else None
+
+    def book_version(self, book_id):
+        """Return (version, modified timestamp) for a book, or None if it doesn't exist."""
+        with self._pool.connection() as conn:
+            row = conn.execute(SELECT_VERSION, (book_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def cursor_position(self, book_id, fallback_seq, price=None):
+        """Return the position to resume a listing after the given book; see BookStorage."""
+        with self._pool.connection() as conn:
+            row = conn.execute(SELECT_SEQ, (book_id,)).fetchone()
+        seq = row[0] if row else fallback_seq
+        return seq if price is None else (price, seq)
+
+    def list_books(self, limit=None, after=None, in_stock=None, min_price=None, max_price=None):
+        """List books in insertion or (price, seq) order; see BookStorage.list_books."""
+        by_price = min_price is not None or max_price is not None
+        clauses, params = [], []
+        if after is not None and by_price:
+            # A row-value comparison lets SQLite seek in the (price, seq) index
+            clauses.append("(price, seq) > (?, ?)")
+            params.extend(after)
+        elif after is not None:
+            clauses.append("seq > ?")
+            params.append(after)
+        if in_stock is not None:
+            clauses.append("in_stock = ?")
+            params.append(int(in_stock))
+        if min_price is not None:
+            clauses.append("price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            clauses.append("price <= ?")
+            params.append(max_price)
+
+        sql = f"SELECT {BOOK_COLUMNS}, seq FROM books"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY price, seq" if by_price else " ORDER BY seq"
+        if limit is not None:
+            # Fetch one extra row to find out whether there is another page
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            cursor = (rows[-1][0], rows[-1][5])
+            if by_price:
+                cursor += (rows[-1][3],)
+        return [_row_to_book(row) for row in rows], cursor
+
+    def search(self, query, match=SUBSTRING, rank=False, limit=None):
+        """Search titles and authors through the FTS5 tables."""
+        if match not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode: {match}")
+
+        query = query.lower()
+        if match == SUBSTRING:
+            if len(query) < MIN_TRIGRAM_QUERY:
+                sql, params = SEARCH_SHORT, [query, query]
+            else:
+                sql, params = SEARCH_SUBSTRING, [_phrase(query)]
+        else:
+            words = tokens(query)
+            if not words:
+                return []
+            sql, params = SEARCH_WORDS, [' '.join(_phrase(word) for word in sorted(words))]
+
+        if limit is not None and not rank:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._pool.connection() as conn:
+            books = [_row_to_book(row) for row in conn.execute(sql, params)]
+
+        if rank:
+            # Stable sort keeps catalog order between books with equal scores
+            books.sort(key=lambda b: -relevance(query, b['title'], b['author']))
+            books = books[:limit]
+        return books
+
+    def __len__(self):
+        with self._pool.connection() as conn:
+            return conn.execute(COUNT_BOOKS).fetchone()[0]
+
+    # Writes
+
+    def _insert(self, conn, book, version, now):
+        """Insert a new book row."""
+        conn.execute(INSERT_BOOK, (
+            book['id'], book['title'], book['author'], float(book['price']),
+            bool(book['in_stock']), version, now
+        ))
+
+    def _update_row(self, conn, row, changes, version, now):
+        """Apply changes to a selected row and return the updated book."""
+        book = _row_to_book(row)
+        book.update(changes)
+        conn.execute(UPDATE_BOOK, (
+            book['title'], book['author'], float(book['price']), bool(book['in_stock']),
+            version, now, book['id']
+        ))
+        return book
+
+    def add(self, book):
+        """Add a new book and persist it."""
+        with self._transaction() as conn:
+            version, now = self._bump(conn)
+            self._insert(conn, book, version, now)
+            self._record(conn, version, {'op': 'put', 'book': book})
+        return book
+
+    def update(self, book_id, changes, precondition=None):
+        """Apply field changes to an existing book; see BookStorage.update."""
+        with self._transaction() as conn:
+            row = conn.execute(SELECT_BOOK, (book_id,)).fetchone()
+            if row is None:
+                return None
+            if precondition is not None and not precondition(row[5]):
+                raise PreconditionFailed(book_id)
+            version, now = self._bump(conn)
+            book = self._update_row(conn, row, changes, version, now)
+            self._record(conn, version, {'op': 'put', 'book': book})
+            return book
+
+    def delete(self, book_id, precondition=None):
+        """Delete a book; see BookStorage.delete."""
+        with self._transaction() as conn:
+            row = conn.execute(SELECT_BOOK, (book_id,)).fetchone()
+            if row is None:
+                return False
+            if precondition is not None and not precondition(row[5]):
+                raise PreconditionFailed(book_id)
+            version, _ = self._bump(conn)
+            conn.execute(DELETE_BOOK, (book_id,))
+            self._record(conn, version, {'op': 'delete', 'id': book_id})
+            return True
+
+    def apply_batch(self, operations):
+        """Apply several operations in one transaction; see BookCatalog.apply_batch."""
+        with self._transaction() as conn:
+            rows, deleted, missing = {}, set(), set()
+            for i, (kind, *args) in enumerate(operations):
+                if kind == 'create':
+                    continue
+                book_id = args[0]
+                if book_id not in rows:
+                    rows[book_id] = conn.execute(SELECT_BOOK, (book_id,)).fetchone()
+                if rows[book_id] is None or book_id in deleted:
+                    missing.add(i)
+                elif kind == 'delete':
+                    deleted.add(book_id)
+
+            if missing:
+                return False, [None if i in missing else True for i in range(len(operations))]
+
+            results = []
+            for kind, *args in operations:
+                version, now = self._bump(conn)
+                if kind == 'create':
+                    self._insert(conn, args[0], version, now)
+                    self._record(conn, version, {'op': 'put', 'book': args[0]})
+                    results.append(args[0])
+                elif kind == 'update':
+                    book = self._update_row(conn, rows[args[0]], args[1], version, now)
+                    # Later operations on the same book start from the updated row
+                    rows[args[0]] = conn.execute(SELECT_BOOK, (args[0],)).fetchone()
+                    self._record(conn, version, {'op': 'put', 'book': book})
+                    results.append(book)
+                else:
+                    conn.execute(DELETE_BOOK, (args[0],))
+                    self._record(conn, version, {'op': 'delete', 'id': args[0]})
+                    results.append(args[0])
+        return True, results
+
+    def replace_all(self, books):
+        """Replace the whole catalog and persist it."""
+        with self._transaction() as conn:
+            version, now = self._bump(conn)
+            conn.execute("DELETE FROM books")
+            for book in books:
+                self._insert(conn, book, version, now)
+            self._record(conn, version, None)
+
+    def close(self):
+        """Close the pooled connections."""
+        self._pool.close()
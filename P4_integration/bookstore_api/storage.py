@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Book Storage
+
+The interface the API routes use to read and write books, and a factory
+that opens the configured backend:
+
+- "json": BookCatalog, the in-memory catalog persisted to books.json
+- "sqlite": SqliteCatalog, a SQLite database that is safe to share between
+  several worker processes
+"""
+from search_index import SUBSTRING
+
+# Storage backends
+JSON_STORAGE = 'json'
+SQLITE_STORAGE = 'sqlite'
+STORAGE_BACKENDS = (JSON_STORAGE, SQLITE_STORAGE)
+
+
+class PreconditionFailed(Exception):
+    """Raised when a conditional write finds a different version than expected."""
+
+
+class BookStorage:
+    """
+    Interface implemented by every storage backend.
+
+    Books are plain dicts with the id, title, author, price and in_stock
+    fields. Every book also has an insertion sequence number (for stable
+    pagination) and a version (for conditional requests).
+
+    Attributes:
+        epoch (str): Changes whenever versions restart from scratch
+        version (int): Catalog version, increased by every change
+        last_modified (float): Timestamp of the last change
+    """
+
+    epoch = None
+    version = 0
+    last_modified = 0.0
+
+    # Reads
+
+    def all(self):
+        """Return a list of all books in insertion order."""
+        raise NotImplementedError
+
+    def get(self, book_id):
+        """Return the book with the given ID, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    def book_version(self, book_id):
+        """Return (version, modified timestamp) for a book, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    def cursor_position(self, book_id, fallback_seq, price=None):
+        """
+        Return the position to resume a listing after the given book.
+
+        That is its sequence, or the (price, sequence) pair if the cursor
+        came from a price-filtered listing and carries the book's price.
+        """
+        raise NotImplementedError
+
+    def list_books(self, limit=None, after=None, in_stock=None, min_price=None, max_price=None):
+        """
+        List books with optional filtering and pagination.
+
+        Books come in insertion order, or in (price, sequence) order when a
+        price range is given, so each page starts straight from the price
+        index. after is a sequence, or a (price, sequence) pair with a price range.
+
+        Returns:
+            tuple: (books, cursor) where cursor is (last ID, last sequence),
+                   plus the last price with a price range, if there may be
+                   more results, otherwise None
+        """
+        raise NotImplementedError
+
+    def search(self, query, match=SUBSTRING, rank=False, limit=None):
+        """Return books whose title or author match the query."""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, book_id):
+        return self.get(book_id) is not None
+
+    # Writes
+
+    def add(self, book):
+        """Add a new book and persist it."""
+        raise NotImplementedError
+
+    def update(self, book_id, changes, precondition=None):
+        """
+        Apply field changes to an existing book and persist it.
+
+        precondition is an optional callable that receives the book's current
+        version; if it returns False, PreconditionFailed is raised.
+
+        Returns:
+            dict: The updated book, or None if it doesn't exist
+        """
+        raise NotImplementedError
+
+    def delete(self, book_id, precondition=None):
+        """
+        Delete a book and persist the change.
+
+        Returns:
+            bool: True if the book existed
+        """
+        raise NotImplementedError
+
+    def apply_batch(self, operations):
+        """
+        Apply ('create', book), ('update', book_id, changes) and ('delete', book_id)
+        operations atomically.
+
+        Returns:
+            tuple: (applied, results); see BookCatalog.apply_batch
+        """
+        raise NotImplementedError
+
+    def replace_all(self, books):
+        """Replace the whole catalog and persist it."""
+        raise NotImplementedError
+
+    # Change notifications
+
+    _listeners = ()
+
+    def add_listener(self, listener):
+        """
+        Call listener(epoch, version, record) after every change.
+
+        record is {'op': 'put', 'book': book} or {'op': 'delete', 'id': book_id},
+        or None when the whole catalog was replaced or reloaded. Listeners are
+        called in version order while the change is still being applied, so
+        they must be quick and must not call back into the storage.
+        """
+        self._listeners = [*self._listeners, listener]
+
+    def _notify(self, epoch, version, record):
+        """Pass a change to every listener."""
+        for listener in self._listeners:
+            listener(epoch, version, record)
+
+    # Lifecycle
+
+    def reload_if_changed(self):
+        """Pick up changes made outside this process; returns True if reloaded."""
+        return False
+
+    def close(self):
+        """Release resources and make pending changes durable."""
+
+
+def open_storage(backend, data_file, sqlite_file=None, default_books=None, **options):
+    """
+    Open the configured storage backend.
+
+    Parameters:
+        backend (str): One of STORAGE_BACKENDS
+        data_file (str): Path of books.json (used to seed a new SQLite database)
+        sqlite_file (str): Path of the SQLite database
+        default_books (list): Books to start with if there is no data yet
+        options: Extra keyword arguments for BookCatalog (persistence policy etc.)
+
+    Returns:
+        BookStorage: The opened storage
+    """
+    if backend == JSON_STORAGE:
+        from catalog import BookCatalog
+        return BookCatalog(data_file, default_books=default_books, **options)
+    if backend == SQLITE_STORAGE:
+        from sqlite_catalog import SqliteCatalog
+        return SqliteCatalog(sqlite_file, seed_file=data_file, default_books=default_books)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,1239 @@
+#!/usr/bin/env python3
+"""
+Test script for the Bookstore API
+
+This script exercises the API routes through Flask's test client against a
+catalog stored in a temporary directory.
+"""
+import asyncio
+import gzip
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import app as bookstore_app
+from asgi import AsyncBookstore
+from catalog import BookCatalog, JOURNAL, WRITE_BEHIND
+from change_feed import ChangeFeed
+from journal import read_records
+from latency import EXPONENTIAL, FIXED, UNIFORM, ZERO, LatencyProfile
+from metrics import Histogram, MetricsRegistry, ProfileSampler
+from query_cache import QueryCache
+from search_index import SearchIndex, WORD, scan
+import serialization
+from snapshot import SnapshotError, read_snapshot, write_snapshot
+from sqlite_catalog import SqliteCatalog
+
+
+class BookstoreApiTestCase(unittest.TestCase):
+    """Base class that points the app at a temporary catalog."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.tmp_dir, 'books.json')
+        self.catalog = self.make_catalog()
+        self.change_feed = ChangeFeed(epoch=self.catalog.epoch, version=self.catalog.version)
+        self.catalog.add_listener(self.change_feed.publish)
+
+        # Swap in the temporary catalog and skip the simulated delays
+        patchers = [
+            patch.object(bookstore_app, 'catalog', self.catalog),
+            patch.object(bookstore_app, 'change_feed', self.change_feed),
+            patch.object(bookstore_app, 'query_cache', QueryCache()),
+            patch.object(bookstore_app, 'request_metrics', MetricsRegistry()),
+            patch('app.time.sleep'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.client = bookstore_app.app.test_client()
+
+    def tearDown(self):
+        """Clean up the temporary catalog."""
+        self.catalog.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_catalog(self):
+        """Create the storage backend under test."""
+        return BookCatalog(self.data_file, default_books=bookstore_app.SAMPLE_BOOKS)
+
+    def read_data_file(self):
+        """Return the books currently stored on disk."""
+        with open(self.data_file) as f:
+            return json.load(f)
+
+
+class TestBookRoutes(BookstoreApiTestCase):
+    """Test cases for the book CRUD and search routes."""
+
+    def test_get_books(self):
+        """Test listing all books."""
+        response = self.client.get('/api/books')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b['id'] for b in response.json], ['1', '2', '3'])
+
+    def test_get_book(self):
+        """Test fetching a single book and a missing one."""
+        self.assertEqual(self.client.get('/api/books/2').json['title'], '1984')
+        self.assertEqual(self.client.get('/api/books/999').status_code, 404)
+
+    def test_add_book(self):
+        """Test that a new book is served from memory and written to disk."""
+        response = self.client.post('/api/books', json={
+            'title': 'Dune', 'author': 'Frank Herbert', 'price': '9.99'
+        })
+        self.assertEqual(response.status_code, 201)
+        book_id = response.json['id']
+
+        self.assertEqual(self.client.get(f'/api/books/{book_id}').json['price'], 9.99)
+        self.assertIn(book_id, [b['id'] for b in self.read_data_file()])
+
+    def test_add_book_missing_fields(self):
+        """Test validation of required fields."""
+        response = self.client.post('/api/books', json={'title': 'Dune'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_book(self):
+        """Test partial updates keep the other fields."""
+        response = self.client.put('/api/books/1', json={'price': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['price'], 5.0)
+        self.assertEqual(response.json['title'], 'To Kill a Mockingbird')
+        self.assertEqual(self.client.put('/api/books/999', json={'price': 5}).status_code, 404)
+
+    def test_delete_book(self):
+        """Test deleting a book."""
+        self.assertEqual(self.client.delete('/api/books/2').status_code, 200)
+        self.assertEqual(self.client.get('/api/books/2').status_code, 404)
+        self.assertEqual(self.client.delete('/api/books/2').status_code, 404)
+        self.assertNotIn('2', [b['id'] for b in self.read_data_file()])
+
+    def test_pagination(self):
+        """Test that cursor pagination walks every book once in a stable order."""
+        for i in range(7):
+            self.client.post('/api/books', json={'title': f'B{i}', 'author': 'A', 'price': i})
+
+        seen, cursor = [], None
+        while True:
+            url = '/api/books?limit=3' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.json), 3)
+            seen.extend(b['id'] for b in response.json)
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+            # Deleting the last book of a page must not break its cursor
+            self.client.delete(f"/api/books/{seen[-1]}")
+
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(len(set(seen)), 10)
+        self.assertEqual(self.client.get('/api/books?cursor=@@').status_code, 400)
+
+    def test_filters_and_projection(self):
+        """Test price range, stock filters and field projection."""
+        # A price range lists books in price order
+        response = self.client.get('/api/books?min_price=11&max_price=12.99&fields=id,price')
+        self.assertEqual(response.json, [{'id': '3', 'price': 11.5}, {'id': '1', 'price': 12.99}])
+
+        response = self.client.get('/api/books?in_stock=false')
+        self.assertEqual([b['id'] for b in response.json], ['3'])
+
+        self.client.put('/api/books/2', json={'price': 11.75})
+        response = self.client.get('/api/books?min_price=11&max_price=12&limit=1&fields=id')
+        self.assertEqual(response.json, [{'id': '3'}])
+        response = self.client.get(
+            f"/api/books?min_price=11&max_price=12&limit=1&cursor={response.headers['X-Next-Cursor']}"
+        )
+        self.assertEqual([b['id'] for b in response.json], ['2'])
+        self.assertNotIn('X-Next-Cursor', response.headers)
+
+        self.assertEqual(self.client.get('/api/books?fields=isbn').status_code, 400)
+        self.assertEqual(self.client.get('/api/books?min_price=cheap').status_code, 400)
+        self.assertEqual(self.client.get('/api/books?in_stock=maybe').status_code, 400)
+
+    def test_price_pagination(self):
+        """Test that price-filtered pages resume at their cursor's (price, sequence) position."""
+        prices = [5, 1, 3, 1, 4, 2, 3, 5, 2, 4]
+        ids = [self.client.post('/api/books', json={'title': f'B{i}', 'author': 'A', 'price': price}).json['id']
+               for i, price in enumerate(prices)]
+        expected = [book_id for _, _, book_id in sorted(zip(prices, range(10), ids))]
+
+        seen, cursor = [], None
+        while True:
+            url = '/api/books?max_price=5&limit=3&fields=id' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(url)
+            seen.extend(b['id'] for b in response.json)
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+            # Neither a price change nor a delete of the page's last book moves the cursor
+            if len(seen) == 3:
+                self.client.put(f'/api/books/{seen[-1]}', json={'price': 0.5})
+            else:
+                self.client.delete(f'/api/books/{seen[-1]}')
+        self.assertEqual(seen, expected)
+
+        # Cursors of price-filtered lists only work with a price range, and vice versa
+        priced = self.client.get('/api/books?min_price=0&limit=1').headers['X-Next-Cursor']
+        plain = self.client.get('/api/books?limit=1').headers['X-Next-Cursor']
+        self.assertEqual(self.client.get(f'/api/books?cursor={priced}').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/books?min_price=0&cursor={plain}').status_code, 400)
+
+    def test_field_types(self):
+        """Test that both backends reject the same badly typed fields and store the same book."""
+        bad_fields = [{'title': 123}, {'title': ['Dune']}, {'author': None},
+                      {'in_stock': 'false'}, {'in_stock': 1}]
+        for fields in bad_fields:
+            with self.subTest(fields=fields):
+                book = {'title': 'Dune', 'author': 'Frank Herbert', 'price': 9.99, **fields}
+                self.assertEqual(self.client.post('/api/books', json=book).status_code, 400)
+                self.assertEqual(self.client.put('/api/books/1', json=fields).status_code, 400)
+                response = self.client.post('/api/books/batch', json={'operations': [
+                    {'op': 'create', 'book': book}, {'op': 'update', 'id': '1', 'book': fields}
+                ]})
+                self.assertEqual([r['status'] for r in response.json['results']], [400, 400])
+        self.assertEqual(self.client.get('/api/books/1').json, bookstore_app.SAMPLE_BOOKS[0])
+
+        response = self.client.post('/api/books', json={'title': 'Dune', 'author': 'F', 'price': 1, 'in_stock': False})
+        self.assertEqual(self.client.get(f"/api/books/{response.json['id']}").json, response.json)
+        self.assertIs(response.json['in_stock'], False)
+
+    def test_non_finite_numbers(self):
+        """Test that NaN and infinite prices and price filters are rejected."""
+        for price in ('nan', 'inf', '-Infinity'):
+            response = self.client.post('/api/books', json={'title': 'T', 'author': 'A', 'price': price})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json['message'], "price must be a number")
+            self.assertEqual(self.client.put('/api/books/1', json={'price': price}).status_code, 400)
+        # JSON payloads may carry a bare NaN literal too
+        response = self.client.post('/api/books', data='{"title": "T", "author": "A", "price": NaN}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        for query in ('min_price=nan', 'max_price=nan', 'min_price=-inf'):
+            response = self.client.get(f'/api/books?{query}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('must be a number', response.json['message'])
+        self.assertEqual(len(self.client.get('/api/books').json), 3)
+        self.assertEqual(self.client.delete('/api/books/1').status_code, 200)
+
+    def test_export_ndjson(self):
+        """Test streaming the catalog as NDJSON across several chunks."""
+        for i in range(5):
+            self.client.post('/api/books', json={'title': f'B{i}', 'author': 'A', 'price': i})
+
+        with patch.object(bookstore_app, 'EXPORT_PAGE_SIZE', 2):
+            response = self.client.get('/api/books/export?fields=id')
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            self.assertTrue(response.is_streamed)
+            lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 8)
+        self.assertEqual(json.loads(lines[0]), {'id': '1'})
+
+        # GET /api/books streams too when NDJSON is requested
+        response = self.client.get('/api/books?in_stock=false',
+                                   headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual([json.loads(line)['id'] for line in response.get_data(as_text=True).splitlines()], ['3'])
+        self.assertEqual(self.client.get('/api/books').mimetype, 'application/json')
+
+    def test_batch(self):
+        """Test that a valid batch is applied in one step with per-item results."""
+        response = self.client.post('/api/books/batch', json={'operations': [
+            {'op': 'create', 'book': {'title': 'Dune', 'author': 'Frank Herbert', 'price': '9.99'}},
+            {'op': 'update', 'id': '1', 'book': {'price': 1}},
+            {'op': 'delete', 'id': '2'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.json['results']
+        self.assertEqual([r['status'] for r in results], [201, 200, 200])
+        self.assertEqual(results[1]['book']['price'], 1.0)
+
+        self.assertEqual([b['id'] for b in self.read_data_file()], ['1', '3', results[0]['book']['id']])
+        self.assertEqual(len(self.client.get('/api/books/search?query=dune').json), 1)
+
+    def test_batch_is_atomic(self):
+        """Test that one bad operation rejects the whole batch."""
+        response = self.client.post('/api/books/batch', json={'operations': [
+            {'op': 'delete', 'id': '1'},
+            {'op': 'create', 'book': {'title': 'No price', 'author': 'A'}},
+            {'op': 'update', 'id': '2', 'book': {'price': 'free'}},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([r['status'] for r in response.json['results']], [424, 400, 400])
+
+        response = self.client.post('/api/books/batch', json={'operations': [
+            {'op': 'delete', 'id': '1'},
+            {'op': 'delete', 'id': '1'},
+        ]})
+        self.assertEqual([r['status'] for r in response.json['results']], [424, 404])
+        self.assertEqual(len(self.read_data_file()), 3)
+
+        # An empty update is refused as it is by PUT /api/books/<id>
+        self.assertEqual(self.client.put('/api/books/1', json={}).status_code, 400)
+        response = self.client.post('/api/books/batch', json={'operations': [
+            {'op': 'update', 'id': '1', 'book': {}},
+            {'op': 'update', 'id': '2', 'book': {'price': 1}},
+        ]})
+        self.assertEqual([r['status'] for r in response.json['results']], [400, 424])
+        self.assertEqual(response.json['results'][0]['error'], "Book must not be empty")
+        self.assertEqual(self.client.get('/api/books/1').status_code, 200)
+
+    def test_conditional_get(self):
+        """Test ETag/If-None-Match revalidation for a book and for the list."""
+        response = self.client.get('/api/books/1')
+        etag = response.headers['ETag']
+        self.assertIn('Last-Modified', response.headers)
+
+        response = self.client.get('/api/books/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        list_etag = self.client.get('/api/books').headers['ETag']
+        self.assertEqual(self.client.get('/api/books', headers={'If-None-Match': list_etag}).status_code, 304)
+
+        # Changing a different book leaves book 1's ETag valid but not the list's
+        self.client.put('/api/books/2', json={'price': 1})
+        self.assertEqual(self.client.get('/api/books/1', headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.client.get('/api/books', headers={'If-None-Match': list_etag}).status_code, 200)
+
+        self.client.put('/api/books/1', json={'price': 1})
+        self.assertEqual(self.client.get('/api/books/1', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_if_match(self):
+        """Test optimistic concurrency with If-Match on PUT and DELETE."""
+        etag = self.client.get('/api/books/1').headers['ETag']
+
+        response = self.client.put('/api/books/1', json={'price': 2}, headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        new_etag = response.headers['ETag']
+        self.assertNotEqual(new_etag, etag)
+
+        # A stale ETag is rejected
+        response = self.client.put('/api/books/1', json={'price': 3}, headers={'If-Match': etag})
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.client.delete('/api/books/1', headers={'If-Match': etag}).status_code, 412)
+        self.assertEqual(self.client.get('/api/books/1').json['price'], 2.0)
+
+        self.assertEqual(self.client.delete('/api/books/1', headers={'If-Match': new_etag}).status_code, 200)
+
+    def test_query_cache(self):
+        """Test that repeated searches hit the cache and writes invalidate it."""
+        self.client.get('/api/books/search?query=gatsby')
+        response = self.client.get('/api/books/search?query=GATSBY')
+        self.assertEqual([b['id'] for b in response.json], ['3'])
+
+        stats = self.client.get('/api/cache/stats').json
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        self.client.put('/api/books/2', json={'title': 'Gatsby Returns'})
+        response = self.client.get('/api/books/search?query=gatsby')
+        self.assertEqual([b['id'] for b in response.json], ['2', '3'])
+        self.assertEqual(self.client.get('/api/cache/stats').json['invalidations'], 1)
+
+        # Paged lists are cached with their cursor header
+        first = self.client.get('/api/books?limit=1')
+        second = self.client.get('/api/books?limit=1')
+        self.assertEqual(second.headers['X-Next-Cursor'], first.headers['X-Next-Cursor'])
+        self.assertEqual(second.json, first.json)
+
+    @unittest.skipIf(serialization.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        """Test MessagePack responses and request bodies."""
+        msgpack = serialization.msgpack
+        accept = {'Accept': 'application/msgpack, application/json;q=0.9'}
+
+        response = self.client.get('/api/books', headers=accept)
+        self.assertEqual(response.mimetype, 'application/msgpack')
+        self.assertIn('Accept', response.vary)
+        self.assertEqual([b['id'] for b in msgpack.unpackb(response.data)], ['1', '2', '3'])
+
+        # Each format of a book has its own strong ETag, and both satisfy If-Match
+        response = self.client.get('/api/books/1', headers=accept)
+        self.assertEqual(msgpack.unpackb(response.data)['title'], 'To Kill a Mockingbird')
+        etag = response.headers['ETag']
+        self.assertNotEqual(etag, self.client.get('/api/books/1').headers['ETag'])
+        response = self.client.put('/api/books/1', data=msgpack.packb({'price': 2}),
+                                   content_type='application/msgpack', headers={'If-Match': etag, **accept})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(msgpack.unpackb(response.data)['price'], 2.0)
+
+        response = self.client.post('/api/books', data=b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
+
+        # Without msgpack the server falls back to JSON
+        with patch.object(serialization, 'msgpack', None):
+            response = self.client.get('/api/books/1', headers=accept)
+        self.assertEqual(response.mimetype, 'application/json')
+
+    def test_compression(self):
+        """Test that large responses are compressed when the client accepts it."""
+        self.catalog.replace_all([
+            {'id': str(i), 'title': f"Book {i}", 'author': 'A', 'price': 1.0, 'in_stock': True}
+            for i in range(100)
+        ])
+        response = self.client.get('/api/books', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.vary)
+        self.assertEqual(len(json.loads(gzip.decompress(response.data))), 100)
+
+        response = self.client.get('/api/books', headers={'Accept-Encoding': 'deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+
+        # Small responses and clients that don't ask for compression get plain bodies
+        self.assertNotIn('Content-Encoding', self.client.get('/api/books').headers)
+        response = self.client.get('/api/books?limit=1', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+        # Uncached routes are compressed after the fact
+        response = self.client.post('/api/books/batch', headers={'Accept-Encoding': 'gzip'}, json={
+            'operations': [{'op': 'delete', 'id': str(i)} for i in range(100)]
+        })
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.data))['results']), 100)
+
+    def test_change_feed(self):
+        """Test following creates, updates and deletes through the change feed."""
+        start = self.client.get('/api/books/changes').json
+        self.assertEqual((start['changes'], start['resnapshot']), ([], False))
+
+        book_id = self.client.post('/api/books', json={'title': 'Dune', 'author': 'F', 'price': 1}).json['id']
+        self.client.put('/api/books/1', json={'price': 2})
+        self.client.post('/api/books/batch', json={'operations': [
+            {'op': 'delete', 'id': '2'}, {'op': 'update', 'id': book_id, 'book': {'price': 3}}
+        ]})
+
+        feed = self.client.get(f"/api/books/changes?since={start['next']}&epoch={start['epoch']}").json
+        self.assertFalse(feed['resnapshot'])
+        self.assertEqual([(c['op'], c['id']) for c in feed['changes']],
+                         [('put', book_id), ('put', '1'), ('delete', '2'), ('put', book_id)])
+        self.assertEqual(feed['changes'][-1]['book']['price'], 3.0)
+        self.assertEqual(feed['next'], start['next'] + 4)
+
+        # Paging with limit
+        page = self.client.get(f"/api/books/changes?since={start['next']}&limit=3").json
+        self.assertEqual(len(page['changes']), 3)
+        rest = self.client.get(f"/api/books/changes?since={page['next']}").json
+        self.assertEqual(rest['changes'], feed['changes'][3:])
+
+        # A consumer from another epoch has to resnapshot
+        stale = self.client.get(f"/api/books/changes?since={start['next']}&epoch=other").json
+        self.assertTrue(stale['resnapshot'])
+        self.assertEqual((stale['epoch'], stale['next']), (feed['epoch'], feed['next']))
+
+    def test_change_feed_long_poll(self):
+        """Test that a long-poll returns as soon as a change is made."""
+        since = self.client.get('/api/books/changes').json['next']
+        timer = threading.Timer(0.05, self.catalog.delete, args=('3',))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        feed = self.client.get(f"/api/books/changes?since={since}&wait=10").json
+        self.assertEqual([c['id'] for c in feed['changes']], ['3'])
+
+        # Without changes the wait times out with an empty result
+        feed = self.client.get(f"/api/books/changes?since={feed['next']}&wait=0.01").json
+        self.assertEqual((feed['changes'], feed['resnapshot']), ([], False))
+
+    def test_change_feed_rejects_non_finite_wait(self):
+        """Test that wait=nan is refused instead of waiting for the next write."""
+        since = self.client.get('/api/books/changes').json['next']
+        responses = []
+        for wait in ('nan', 'inf'):
+            request = threading.Thread(target=lambda: responses.append(
+                self.client.get(f'/api/books/changes?since={since}&wait={wait}')), daemon=True)
+            request.start()
+            request.join(5)
+            self.assertFalse(request.is_alive(), f"wait={wait} held the request")
+        self.assertEqual([r.status_code for r in responses], [400, 400])
+
+    def test_change_feed_events(self):
+        """Test the Server-Sent Events stream and resuming it with Last-Event-ID."""
+        start = self.client.get('/api/books/changes').json
+        self.client.delete('/api/books/1')
+        self.client.delete('/api/books/2')
+
+        response = self.client.get('/api/books/changes', buffered=False, headers={
+            'Accept': 'text/event-stream',
+            'Last-Event-ID': f"{start['epoch']}:{start['next'] + 1}"
+        })
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        event = next(response.response).decode()
+        response.close()
+        self.assertTrue(event.startswith(f"id: {start['epoch']}:{start['next'] + 2}\nevent: change\n"))
+        self.assertEqual(json.loads(event.split('data: ')[1])['id'], '2')
+
+        response = self.client.get('/api/books/changes', buffered=False, headers={
+            'Accept': 'text/event-stream', 'Last-Event-ID': 'old:1'
+        })
+        event = next(response.response).decode()
+        response.close()
+        self.assertIn('event: resnapshot', event)
+
+    def test_search_books(self):
+        """Test case-insensitive substring search on title and author."""
+        response = self.client.get('/api/books/search?query=ORWELL')
+        self.assertEqual([b['id'] for b in response.json], ['2'])
+        self.assertEqual(self.client.get('/api/books/search').status_code, 400)
+
+    def test_search_modifiers(self):
+        """Test the match, rank and limit search parameters."""
+        self.client.post('/api/books', json={'title': 'Gatsby Notes', 'author': 'X', 'price': 1})
+
+        response = self.client.get('/api/books/search?query=gatsby&rank=true')
+        self.assertEqual([b['title'] for b in response.json], ['Gatsby Notes', 'The Great Gatsby'])
+
+        response = self.client.get('/api/books/search?query=gatsby&limit=1')
+        self.assertEqual([b['title'] for b in response.json], ['The Great Gatsby'])
+
+        response = self.client.get('/api/books/search?query=gats&match=word')
+        self.assertEqual(response.json, [])
+
+        self.assertEqual(self.client.get('/api/books/search?query=a&limit=0').status_code, 400)
+        self.assertEqual(self.client.get('/api/books/search?query=a&match=fuzzy').status_code, 400)
+
+    def test_search_follows_mutations(self):
+        """Test that updates and deletes are reflected in search results."""
+        self.client.put('/api/books/2', json={'title': 'Animal Farm'})
+        self.assertEqual(self.client.get('/api/books/search?query=1984').json, [])
+        self.assertEqual(len(self.client.get('/api/books/search?query=farm').json), 1)
+
+        self.client.delete('/api/books/2')
+        self.assertEqual(self.client.get('/api/books/search?query=farm').json, [])
+
+
+class TestBookRoutesSqlite(TestBookRoutes):
+    """Run the route tests against the SQLite backend."""
+
+    def make_catalog(self):
+        """Create a SQLite catalog seeded with the sample books."""
+        return SqliteCatalog(os.path.join(self.tmp_dir, 'books.db'),
+                             default_books=bookstore_app.SAMPLE_BOOKS)
+
+    def read_data_file(self):
+        """Return the books committed to the database, read through a new connection."""
+        reopened = SqliteCatalog(self.catalog.path)
+        try:
+            return reopened.all()
+        finally:
+            reopened.close()
+
+
+class TestSqliteCatalog(unittest.TestCase):
+    """Test cases specific to the SQLite backend."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'books.db')
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+
+    def test_seeds_from_json(self):
+        """Test that a new database imports the existing books.json."""
+        data_file = os.path.join(self.tmp_dir, 'books.json')
+        with open(data_file, 'w') as f:
+            json.dump([{'id': 'x', 'title': 'T', 'author': 'A', 'price': 1, 'in_stock': False}], f)
+
+        catalog = SqliteCatalog(self.db_file, seed_file=data_file)
+        self.assertEqual(catalog.all(), [{'id': 'x', 'title': 'T', 'author': 'A', 'price': 1.0, 'in_stock': False}])
+        catalog.close()
+
+    def test_shared_between_instances(self):
+        """Test that two instances (like two workers) see each other's writes and versions."""
+        first = SqliteCatalog(self.db_file, default_books=bookstore_app.SAMPLE_BOOKS)
+        second = SqliteCatalog(self.db_file)
+        self.assertEqual(len(second), 3)
+
+        first.update('1', {'title': 'Go Set a Watchman'})
+        self.assertEqual(second.get('1')['title'], 'Go Set a Watchman')
+        self.assertEqual([b['id'] for b in second.search('watchman')], ['1'])
+        self.assertEqual(second.version, first.version)
+        self.assertEqual(second.epoch, first.epoch)
+        first.close()
+        second.close()
+
+    def test_search_matches_json_backend(self):
+        """Test that FTS5 search returns the same results as the in-memory index."""
+        books = [
+            {'id': str(i), 'title': title, 'author': author, 'price': 1.0, 'in_stock': True}
+            for i, (title, author) in enumerate([
+                ('The Great Gatsby', 'F. Scott Fitzgerald'),
+                ('Great Expectations', 'Charles Dickens'),
+                ('Gatsby Notes', 'Scott Study'),
+                ('A "Quoted" Title', 'X'),
+            ])
+        ]
+        sqlite_catalog = SqliteCatalog(self.db_file, default_books=books)
+        json_catalog = BookCatalog(os.path.join(self.tmp_dir, 'books.json'), default_books=books)
+
+        for query, kwargs in [('gats', {}), ('SCOTT', {}), ('at', {}), ('"quoted"', {}),
+                              ('great', {'match': WORD}), ('scott gatsby', {'match': WORD}),
+                              ('gatsby', {'rank': True}), ('e', {'limit': 2})]:
+            self.assertEqual(sqlite_catalog.search(query, **kwargs),
+                             json_catalog.search(query, **kwargs), (query, kwargs))
+        sqlite_catalog.close()
+
+
+class TestBookCatalog(unittest.TestCase):
+    """Test cases for the resident catalog store."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.tmp_dir, 'books.json')
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+
+    def test_seeds_missing_file(self):
+        """Test that a missing data file is created from the defaults."""
+        catalog = BookCatalog(self.data_file, default_books=bookstore_app.SAMPLE_BOOKS)
+        self.assertEqual(len(catalog), 3)
+        self.assertTrue(os.path.exists(self.data_file))
+
+    def test_reload_if_changed(self):
+        """Test that external edits are picked up and unchanged files are not reparsed."""
+        catalog = BookCatalog(self.data_file, default_books=bookstore_app.SAMPLE_BOOKS)
+        self.assertFalse(catalog.reload_if_changed())
+
+        with open(self.data_file, 'w') as f:
+            json.dump([{'id': 'x', 'title': 'T', 'author': 'A', 'price': 1.0, 'in_stock': True}], f)
+
+        self.assertTrue(catalog.reload_if_changed())
+        self.assertEqual([b['id'] for b in catalog.all()], ['x'])
+
+    def test_columnar_books(self):
+        """Test that books round-trip through the columns unchanged."""
+        odd = {'id': 'o', 'title': 'Odd', 'author': 'Harper Lee', 'price': 7, 'in_stock': 'yes', 'isbn': '123'}
+        missing = {'id': 'm', 'title': 'No Author', 'price': 1.5, 'in_stock': False}
+        catalog = BookCatalog(self.data_file, default_books=bookstore_app.SAMPLE_BOOKS + [odd, missing])
+
+        self.assertEqual(catalog.get('o'), odd)
+        self.assertEqual(list(catalog.get('o')), list(odd))
+        self.assertEqual(catalog.get('m'), missing)
+        self.assertEqual(catalog.all(), bookstore_app.SAMPLE_BOOKS + [odd, missing])
+        # Integer prices keep their type but are indexed as numbers
+        self.assertEqual([b['id'] for b in catalog.list_books(min_price=7, max_price=7)[0]], ['o'])
+        self.assertEqual([b['id'] for b in catalog.list_books(in_stock=True)[0]], ['1', '2', 'o'])
+
+        # Returned books are copies
+        catalog.get('1')['title'] = 'Changed'
+        self.assertEqual(catalog.get('1')['title'], 'To Kill a Mockingbird')
+
+        updated = catalog.update('o', {'price': 8.5, 'in_stock': True})
+        self.assertEqual(updated, {**odd, 'price': 8.5, 'in_stock': True})
+        self.assertEqual([b['id'] for b in catalog.list_books(min_price=8, max_price=9)[0]], ['o'])
+
+        with self.assertRaises(ValueError):
+            catalog.update('o', {'price': 'free'})
+        self.assertEqual(catalog.get('o')['price'], 8.5)
+        self.assertEqual(len(catalog.list_books(min_price=0)[0]), 5)
+
+        catalog.delete('1')
+        self.assertEqual(len(catalog), 4)
+        self.assertIsNone(catalog.get('1'))
+        with open(self.data_file) as f:
+            self.assertEqual(json.load(f), catalog.all())
+
+    def test_binary_snapshot(self):
+        """Test that the binary snapshot mirrors the data file and replaces parsing it."""
+        catalog = BookCatalog(self.data_file, default_books=bookstore_app.SAMPLE_BOOKS, binary_snapshot=True)
+        catalog.update('1', {'price': 5.0})
+        catalog.close()
+        self.assertTrue(os.path.exists(f"{self.data_file}.snapshot"))
+
+        with patch('catalog.json.load', side_effect=AssertionError("parsed books.json")):
+            catalog = BookCatalog(self.data_file, binary_snapshot=True)
+        self.assertEqual(catalog.get('1')['price'], 5.0)
+        with open(self.data_file) as f:
+            self.assertEqual(catalog.all(), json.load(f))
+        catalog.close()
+
+        # A data file edited by someone else makes the snapshot stale
+        with open(self.data_file, 'w') as f:
+            json.dump([{'id': 'x', 'title': 'T', 'author': 'A', 'price': 1.0, 'in_stock': True}], f)
+        catalog = BookCatalog(self.data_file, binary_snapshot=True)
+        self.assertEqual([b['id'] for b in catalog.all()], ['x'])
+        catalog.close()
+        columns, _ = read_snapshot(f"{self.data_file}.snapshot")
+        self.assertEqual(columns.ids, ['x'])
+
+    def test_background_indexing(self):
+        """Test that searches give the same results while the index is being built."""
+        books = [
+            {'id': str(i), 'title': f"Book {i}", 'author': 'Author', 'price': 1.0, 'in_stock': True}
+            for i in range(50)
+        ]
+        with patch('catalog.SYNC_INDEX_LIMIT', 10), patch('catalog.INDEX_CHUNK_SIZE', 5):
+            catalog = BookCatalog(self.data_file, default_books=books)
+            catalog.update('12', {'title': 'Renamed'})
+            catalog.delete('15')
+            during = catalog.search('book 1', rank=True)
+            self.assertTrue(catalog.wait_until_indexed(5))
+            after = catalog.search('book 1', rank=True)
+        self.assertEqual(during, after)
+        self.assertEqual([b['id'] for b in after], ['1', '10', '11', '13', '14', '16', '17', '18', '19'])
+        self.assertEqual(catalog.search('renamed'), [catalog.get('12')])
+        catalog.close()
+
+    def test_write_behind(self):
+        """Test that write-behind defers disk writes until flushed."""
+        catalog = BookCatalog(self.data_file, default_books=bookstore_app.SAMPLE_BOOKS,
+                              policy=WRITE_BEHIND, flush_interval=60)
+        catalog.delete('1')
+
+        with open(self.data_file) as f:
+            self.assertEqual(len(json.load(f)), 3)
+        # Pending changes win over the (stale) file
+        self.assertFalse(catalog.reload_if_changed())
+
+        catalog.close()
+        with open(self.data_file) as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+    def test_id_index_keeps_order(self):
+        """Test that keyed updates and deletes keep insertion order and the list file format."""
+        catalog = BookCatalog(self.data_file, default_books=bookstore_app.SAMPLE_BOOKS)
+        catalog.add({'id': '4', 'title': 'T', 'author': 'A', 'price': 1.0, 'in_stock': True})
+        catalog.update('1', {'price': 2.0})
+        self.assertTrue(catalog.delete('2'))
+        self.assertFalse(catalog.delete('2'))
+
+        self.assertEqual([b['id'] for b in catalog.all()], ['1', '3', '4'])
+        self.assertEqual(catalog.get('1')['price'], 2.0)
+        with open(self.data_file) as f:
+            self.assertEqual([b['id'] for b in json.load(f)], ['1', '3', '4'])
+
+    def test_deleted_rows_are_compacted(self):
+        """Test that deleted rows are dropped from the columns once there are enough of them."""
+        books = [{'id': str(i), 'title': f'Book {i}', 'author': f'Author {i % 3}', 'price': float(10 - i),
+                  'in_stock': True} for i in range(10)]
+        catalog = BookCatalog(self.data_file, default_books=books)
+        catalog.update('9', {'title': 'Last Book', 'isbn': '978'})
+        version = catalog.book_version('9')
+        page, cursor = catalog.list_books(limit=4)
+
+        with patch('catalog.HOLE_COMPACT_MIN', 3):
+            catalog.delete('1')
+            catalog.delete('2')
+            self.assertEqual(len(catalog._columns.ids), 10)
+            catalog.delete('5')
+        self.assertEqual(len(catalog._columns.ids), 7)
+
+        expected = [b for b in books if b['id'] not in ('1', '2', '5')]
+        expected[-1] = dict(expected[-1], title='Last Book', isbn='978')
+        self.assertEqual(catalog.all(), expected)
+        self.assertEqual(catalog.book_version('9'), version)
+        self.assertEqual([b['id'] for b in catalog.list_books(max_price=5)[0]], ['9', '8', '7', '6'])
+        self.assertEqual([b['id'] for b in catalog.list_books(after=catalog.cursor_position(*cursor))[0]],
+                         ['4', '6', '7', '8', '9'])
+        self.assertEqual([b['id'] for b in catalog.search('book')], ['0', '3', '4', '6', '7', '8', '9'])
+        catalog.add({'id': 'new', 'title': 'Book New', 'author': 'A', 'price': 0.5, 'in_stock': False})
+        self.assertEqual(catalog.search('book')[-1]['id'], 'new')
+        self.assertEqual([b['id'] for b in catalog.list_books(max_price=1)[0]], ['new', '9'])
+
+    def test_nan_price_in_data_file(self):
+        """Test that a NaN price read from the data file doesn't corrupt the price index."""
+        books = [{'id': str(i), 'title': 'T', 'author': 'A', 'price': float(i), 'in_stock': True} for i in range(6)]
+        books[2]['price'] = float('nan')
+        with open(self.data_file, 'w') as f:
+            json.dump(books, f)
+        catalog = BookCatalog(self.data_file)
+
+        catalog.update('4', {'price': 0.5})
+        self.assertTrue(catalog.delete('2'))
+        self.assertTrue(catalog.delete('3'))
+        self.assertEqual([b['id'] for b in catalog.list_books(min_price=0)[0]], ['0', '1', '4', '5'])
+        self.assertEqual([b['id'] for b in catalog.all()], ['0', '1', '4', '5'])
+
+    def test_unknown_policy(self):
+        """Test that an unknown persistence policy is rejected."""
+        with self.assertRaises(ValueError):
+            BookCatalog(self.data_file, policy='sometimes')
+
+
+class TestMetrics(BookstoreApiTestCase):
+    """Test cases for request instrumentation and the /metrics endpoint."""
+
+    def test_prometheus_export(self):
+        """Test that route histograms and phase breakdowns are exported."""
+        self.client.get('/api/books/1')
+        self.client.get('/api/books/2')
+        self.client.put('/api/books/1', json={'price': 1})
+
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('bookstore_requests_total{route="/api/books/<book_id>",method="GET",status="200"} 2', text)
+        self.assertIn('bookstore_request_duration_seconds_count{route="/api/books/<book_id>",method="GET"} 2', text)
+        self.assertIn('bookstore_request_duration_seconds_bucket{route="/api/books/<book_id>",method="GET",le="+Inf"} 2', text)
+        for name in ('delay', 'load', 'compute', 'serialize', 'persist'):
+            self.assertIn(f'phase="{name}"', text)
+        self.assertIn('bookstore_books 3', text)
+
+    def test_slow_request_log(self):
+        """Test that slow requests are logged with their phases."""
+        with patch.object(bookstore_app, 'SLOW_REQUEST_MS', 0.000001):
+            with self.assertLogs(bookstore_app.app.logger, level='WARNING') as logs:
+                self.client.get('/api/books/1')
+        self.assertIn('Slow request: GET /api/books/1', logs.output[0])
+        self.assertIn('serialize=', logs.output[0])
+
+    def test_profile_sampling(self):
+        """Test that sampled requests keep a cProfile report."""
+        sampler = ProfileSampler(keep=1)
+        with patch.object(bookstore_app, 'PROFILE_SAMPLE_RATE', 1.0), \
+                patch.object(bookstore_app, 'profile_sampler', sampler):
+            self.client.get('/api/books/search?query=gatsby')
+            report = self.client.get('/metrics/profiles').get_data(as_text=True)
+        self.assertIn('GET /api/books/search?query=gatsby', report)
+        self.assertIn('cumulative', report)
+
+    def test_histogram_buckets(self):
+        """Test cumulative bucket counts."""
+        hist = Histogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5):
+            hist.observe(value)
+        self.assertEqual(list(hist.cumulative()), [(0.1, 1), (1.0, 3), (float('inf'), 4)])
+        self.assertEqual(hist.sum, 6.05)
+
+
+class TestAsgiServer(BookstoreApiTestCase):
+    """Test cases for serving the API from the ASGI wrapper."""
+
+    def setUp(self):
+        """Set up an ASGI app with a short fixed delay and two worker threads."""
+        super().setUp()
+        patcher = patch.object(bookstore_app, 'latency_profile', LatencyProfile(FIXED, scale=0.25))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.asgi_app = AsyncBookstore(bookstore_app.app, workers=2)
+        self.addCleanup(self.asgi_app.executor.shutdown)
+        self.addCleanup(self.asgi_app.feed_executor.shutdown)
+
+    async def call(self, method, path, body=b'', headers=()):
+        """Send one request through the ASGI app and return (status, headers, body)."""
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'method': method, 'path': path,
+            'query_string': query.encode(), 'headers': list(headers)
+        }
+        request_messages = [{'type': 'http.request', 'body': body}]
+        sent = []
+
+        async def receive():
+            return request_messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.asgi_app(scope, receive, send)
+        headers = {name.decode(): value.decode() for name, value in sent[0]['headers']}
+        return sent[0]['status'], headers, b''.join(m.get('body', b'') for m in sent[1:])
+
+    def test_routes(self):
+        """Test reading and writing books through the ASGI app."""
+        status, _, body = asyncio.run(self.call('GET', '/api/books?fields=id'))
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), [{'id': '1'}, {'id': '2'}, {'id': '3'}])
+
+        status, _, body = asyncio.run(self.call(
+            'POST', '/api/books',
+            body=json.dumps({'title': 'Dune', 'author': 'Frank Herbert', 'price': 9.99}).encode(),
+            headers=[(b'content-type', b'application/json')]
+        ))
+        self.assertEqual(status, 201)
+        self.assertEqual(self.catalog.get(json.loads(body)['id'])['title'], 'Dune')
+
+        status, headers, body = asyncio.run(self.call('GET', '/api/books/export'))
+        self.assertEqual(headers['content-type'], bookstore_app.NDJSON_MIMETYPE)
+        self.assertEqual(len(body.splitlines()), 4)
+
+        status, _, _ = asyncio.run(self.call('GET', '/api/books/999'))
+        self.assertEqual(status, 404)
+
+    def test_delays_do_not_hold_threads(self):
+        """Test that many delayed requests are in flight at once on two threads."""
+        async def burst():
+            return await asyncio.gather(*(self.call('GET', '/api/books/1') for _ in range(40)))
+
+        start = time.perf_counter()
+        results = asyncio.run(burst())
+        elapsed = time.perf_counter() - start
+
+        self.assertTrue(all(status == 200 for status, _, _ in results))
+        # Sleeping in two threads would take 40 * 0.05 / 2 = 1 second
+        self.assertLess(elapsed, 0.5)
+        text = bookstore_app.request_metrics.render()
+        self.assertIn('bookstore_request_phase_seconds_count{route="/api/books/<book_id>",method="GET",phase="delay"} 40', text)
+
+    def test_long_polls_do_not_hold_handler_threads(self):
+        """Test that change-feed long-polls don't delay other requests."""
+        async def scenario():
+            polls = [asyncio.create_task(self.call('GET', '/api/books/changes?wait=1')) for _ in range(4)]
+            await asyncio.sleep(0.2)
+            start = time.perf_counter()
+            status, _, _ = await self.call('GET', '/api/books?fields=id')
+            elapsed = time.perf_counter() - start
+            await asyncio.gather(*polls)
+            return status, elapsed
+
+        status, elapsed = asyncio.run(scenario())
+        self.assertEqual(status, 200)
+        # On the two handler threads the list would wait for a long-poll to end
+        self.assertLess(elapsed, 0.5)
+
+
+class TestLatencyProfile(BookstoreApiTestCase):
+    """Test cases for the latency injection profiles."""
+
+    def test_profiles(self):
+        """Test the delay each profile derives from a nominal delay."""
+        self.assertEqual(LatencyProfile(FIXED).delay(0.2), 0.2)
+        self.assertEqual(LatencyProfile(FIXED, scale=0.5).delay(0.2), 0.1)
+        self.assertEqual(LatencyProfile(ZERO).delay(0.2), 0.0)
+
+        rng = random.Random(42)
+        uniform = [LatencyProfile(UNIFORM, rng=rng).delay(0.2) for _ in range(1000)]
+        self.assertTrue(all(0 <= d <= 0.4 for d in uniform))
+        exponential = [LatencyProfile(EXPONENTIAL, rng=rng).delay(0.2) for _ in range(1000)]
+        self.assertAlmostEqual(sum(exponential) / len(exponential), 0.2, delta=0.03)
+
+        with self.assertRaises(ValueError):
+            LatencyProfile('gaussian')
+
+    def test_flask_route_delay(self):
+        """Test that the Flask routes sleep for their profile's delay."""
+        with patch.object(bookstore_app, 'latency_profile', LatencyProfile(FIXED, scale=2)), \
+                patch('app.time.sleep') as sleep:
+            self.client.get('/api/books/search?query=a')
+        sleep.assert_called_once_with(0.6)
+
+        with patch.object(bookstore_app, 'latency_profile', LatencyProfile(ZERO)), \
+                patch('app.time.sleep') as sleep:
+            self.client.get('/api/books/search?query=a')
+        sleep.assert_not_called()
+
+
+class TestSnapshot(unittest.TestCase):
+    """Test cases for the binary snapshot format."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'books.json.snapshot')
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+
+    def test_round_trip(self):
+        """Test that books of every shape come back unchanged."""
+        books = bookstore_app.SAMPLE_BOOKS + [
+            {'id': 'n', 'title': 'Nul\0Title', 'author': 'Ünïcødé', 'price': 3, 'in_stock': 1},
+            {'id': 'm', 'title': 'Missing Author', 'price': 2.5, 'in_stock': False, 'isbn': '978'},
+        ]
+        write_snapshot(self.path, books, source=(1, 2, 3))
+        columns, source = read_snapshot(self.path)
+        self.assertEqual(source, (1, 2, 3))
+        self.assertEqual([columns.book(row) for row in range(len(columns))], books)
+
+        write_snapshot(self.path, [])
+        self.assertEqual(len(read_snapshot(self.path)[0]), 0)
+
+    def test_unsupported_ids(self):
+        """Test that non-string IDs are refused and the catalog falls back to JSON."""
+        for book_id in (7, 'a\0b'):
+            with self.assertRaises(SnapshotError):
+                write_snapshot(self.path, [{'id': book_id, 'title': 'T', 'author': 'A', 'price': 1.0}])
+
+        data_file = os.path.join(self.tmp_dir, 'books.json')
+        with open(data_file, 'w') as f:
+            json.dump([{'id': 7, 'title': 'T', 'author': 'A', 'price': 1.0, 'in_stock': True}], f)
+        catalog = BookCatalog(data_file, binary_snapshot=True)
+        self.assertEqual(catalog.get(7)['title'], 'T')
+        self.assertFalse(os.path.exists(f"{data_file}.snapshot"))
+        catalog.close()
+
+    def test_rejects_corrupt_files(self):
+        """Test the checksum, magic number and truncation checks."""
+        write_snapshot(self.path, bookstore_app.SAMPLE_BOOKS)
+        with open(self.path, 'rb') as f:
+            data = bytearray(f.read())
+
+        for corrupt in (data[:-1] + bytes([data[-1] ^ 1]), b'NOTASNAP' + data[8:], data[:10]):
+            with open(self.path, 'wb') as f:
+                f.write(corrupt)
+            with self.assertRaises(SnapshotError):
+                read_snapshot(self.path)
+        with self.assertRaises(SnapshotError):
+            read_snapshot(os.path.join(self.tmp_dir, 'missing'))
+
+
+class TestChangeFeed(unittest.TestCase):
+    """Test cases for the change feed ring buffer."""
+
+    def test_ring_buffer(self):
+        """Test that consumers who fall behind or miss versions must resnapshot."""
+        feed = ChangeFeed(capacity=2, epoch='e', version=10)
+        for version in (11, 12, 13):
+            feed.publish('e', version, {'op': 'delete', 'id': str(version)})
+
+        self.assertEqual(feed.read('e', 11), ([{'seq': 12, 'op': 'delete', 'id': '12'},
+                                               {'seq': 13, 'op': 'delete', 'id': '13'}], False))
+        self.assertEqual(feed.read('e', 13), ([], False))
+        # Version 11 was evicted
+        self.assertEqual(feed.read('e', 10), ([], True))
+        self.assertEqual(feed.read('other', 13), ([], True))
+
+        # Version 14 was written elsewhere and never published here
+        feed.publish('e', 15, {'op': 'delete', 'id': '15'})
+        self.assertEqual(feed.read('e', 13), ([], True))
+
+        # Replacing the catalog invalidates every position
+        feed.publish('e', 16, None)
+        self.assertEqual(feed.read('e', 15), ([], True))
+        self.assertEqual(feed.position(), ('e', 16))
+        self.assertFalse(feed.wait('e', 16, 0.01))
+
+
+class TestQueryCache(unittest.TestCase):
+    """Test cases for the LRU + TTL query cache."""
+
+    def setUp(self):
+        """Set up a cache with a controllable clock."""
+        self.now = 0.0
+        self.cache = QueryCache(max_entries=2, ttl=10, clock=lambda: self.now)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted first."""
+        self.cache.put('a', 1, 'A')
+        self.cache.put('b', 1, 'B')
+        self.assertEqual(self.cache.get('a', 1), 'A')
+        self.cache.put('c', 1, 'C')
+
+        self.assertIsNone(self.cache.get('b', 1))
+        self.assertEqual(self.cache.get('a', 1), 'A')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_ttl_and_version(self):
+        """Test that entries expire and are invalidated by a newer version."""
+        self.cache.put('a', 1, 'A')
+        self.assertIsNone(self.cache.get('a', 2))
+
+        self.cache.put('a', 2, 'A2')
+        self.now = 10
+        self.assertIsNone(self.cache.get('a', 2))
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['invalidations'], stats['expirations'], stats['misses']), (1, 1, 2))
+
+    def test_disabled(self):
+        """Test that a size of zero turns the cache off."""
+        cache = QueryCache(max_entries=0)
+        cache.put('a', 1, 'A')
+        self.assertIsNone(cache.get('a', 1))
+
+
+class TestJournalCatalog(unittest.TestCase):
+    """Test cases for journaled persistence."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.tmp_dir, 'books.json')
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+
+    def open_catalog(self, **kwargs):
+        """Open a journaled catalog that won't compact on its own."""
+        kwargs.setdefault('flush_interval', 60)
+        return BookCatalog(self.data_file, default_books=bookstore_app.SAMPLE_BOOKS,
+                           policy=JOURNAL, **kwargs)
+
+    def test_appends_instead_of_rewriting(self):
+        """Test that writes go to the journal and the snapshot is left alone."""
+        catalog = self.open_catalog()
+        catalog.update('1', {'price': 1.0})
+        catalog.delete('2')
+
+        with open(self.data_file) as f:
+            self.assertEqual(len(json.load(f)), 3)
+        self.assertEqual(
+            [r['op'] for r in read_records(catalog.journal_path)], ['put', 'delete']
+        )
+        catalog.close()
+
+    def test_replay_on_startup(self):
+        """Test that state is rebuilt from the snapshot plus the journal."""
+        catalog = self.open_catalog()
+        catalog.add({'id': '4', 'title': 'T', 'author': 'A', 'price': 1.0, 'in_stock': True})
+        catalog.update('1', {'price': 1.0})
+        catalog.delete('2')
+        catalog.close()
+
+        # Simulate a crash in the middle of an append
+        with open(catalog.journal_path, 'a') as f:
+            f.write('{"op": "delete", "id"')
+
+        reopened = self.open_catalog()
+        self.assertEqual([b['id'] for b in reopened.all()], ['1', '3', '4'])
+        self.assertEqual(reopened.get('1')['price'], 1.0)
+        self.assertEqual(reopened.search('t')[-1]['id'], '4')
+
+        # The torn record is discarded and new appends remain readable
+        reopened.delete('3')
+        reopened.close()
+        self.assertEqual([b['id'] for b in self.open_catalog().all()], ['1', '4'])
+
+    def test_compaction(self):
+        """Test that compaction folds the journal into a new snapshot."""
+        catalog = self.open_catalog()
+        catalog.delete('1')
+        catalog.compact()
+
+        self.assertEqual(os.path.getsize(catalog.journal_path), 0)
+        self.assertFalse(os.path.exists(catalog.compacting_path))
+        with open(self.data_file) as f:
+            self.assertEqual([b['id'] for b in json.load(f)], ['2', '3'])
+        catalog.close()
+
+    def test_compaction_keeps_epoch(self):
+        """Test that a compaction isn't mistaken for an outside change and reloaded."""
+        catalog = self.open_catalog()
+        epoch = catalog.epoch
+        replace = os.replace
+        reloads = []
+
+        def replace_during_request(src, dst):
+            # A request checks for changes right after the rename
+            replace(src, dst)
+            if dst == self.data_file:
+                thread = threading.Thread(target=lambda: reloads.append(catalog.reload_if_changed()))
+                thread.start()
+                thread.join(0.2)
+                threads.append(thread)
+
+        threads = []
+        with patch('catalog.os.replace', replace_during_request):
+            for i in range(3):
+                catalog.update('1', {'price': float(i + 1)})
+                catalog.compact()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(reloads, [False] * 3)
+        self.assertEqual(catalog.epoch, epoch)
+        self.assertFalse(catalog.reload_if_changed())
+        catalog.close()
+
+    def test_background_compaction(self):
+        """Test that the journal is compacted once it reaches the threshold."""
+        catalog = self.open_catalog(flush_interval=0.01, compact_threshold=1)
+        catalog.delete('1')
+
+        for _ in range(500):
+            if os.path.getsize(catalog.journal_path) == 0:
+                break
+            threading.Event().wait(0.01)
+        catalog.close()
+        with open(self.data_file) as f:
+            self.assertEqual([b['id'] for b in json.load(f)], ['2', '3'])
+
+    def test_batch_replay(self):
+        """Test that a batch is journaled as one record and replayed on startup."""
+        catalog = self.open_catalog()
+        catalog.apply_batch([('delete', '1'), ('update', '2', {'price': 3.0})])
+        catalog.close()
+
+        self.assertEqual([r['op'] for r in read_records(catalog.journal_path)], ['batch'])
+        reopened = self.open_catalog()
+        self.assertEqual([b['id'] for b in reopened.all()], ['2', '3'])
+        self.assertEqual(reopened.get('2')['price'], 3.0)
+        reopened.close()
+
+    def test_group_commit(self):
+        """Test that concurrent writers are all made durable."""
+        catalog = self.open_catalog()
+
+        def writer(n):
+            for i in range(20):
+                catalog.add({'id': f'{n}-{i}', 'title': 'T', 'author': 'A',
+                             'price': 1.0, 'in_stock': True})
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(list(read_records(catalog.journal_path))), 100)
+        catalog.close()
+
+
+class TestSearchIndex(unittest.TestCase):
+    """Test cases for the trigram and token search index."""
+
+    def test_matches_substring_scan(self):
+        """Test that indexed results equal a plain substring scan, in catalog order."""
+        rng = random.Random(42)
+        words = ['the', 'great', 'gatsby', 'harper', 'lee', 'orwell', 'ab', 'x']
+        books = [
+            {
+                'id': str(i),
+                'title': ' '.join(rng.choice(words) for _ in range(3)).title(),
+                'author': ' '.join(rng.choice(words) for _ in range(2)),
+            }
+            for i in range(200)
+        ]
+        index = SearchIndex(books)
+
+        for query in ['gat', 'Great G', 'e', 'ab x', 'rwel', 'lee the', 'zzz', 'sby har']:
+            q = query.lower()
+            expected = [
+                b['id'] for b in books
+                if q in b['title'].lower() or q in b['author'].lower()
+            ]
+            self.assertEqual(index.search(query), expected, query)
+
+    def test_word_match(self):
+        """Test that word mode requires every query word as a whole word."""
+        index = SearchIndex([
+            {'id': '1', 'title': 'The Great Gatsby', 'author': 'F. Scott Fitzgerald'},
+            {'id': '2', 'title': 'Great Expectations', 'author': 'Charles Dickens'},
+        ])
+        self.assertEqual(index.search('great', match=WORD), ['1', '2'])
+        self.assertEqual(index.search('great scott', match=WORD), ['1'])
+        self.assertEqual(index.search('grea', match=WORD), [])
+
+    def test_scan_matches_index(self):
+        """Test that scanning without an index gives the indexed results."""
+        rng = random.Random(7)
+        words = ['the', 'great', 'gatsby', 'harper', 'lee', 'orwell', 'ab', 'x']
+        books = [
+            {'id': str(i), 'title': ' '.join(rng.choice(words) for _ in range(3)),
+             'author': ' '.join(rng.choice(words) for _ in range(2))}
+            for i in range(200)
+        ]
+        index = SearchIndex(books)
+        for query in ['gat', 'e', 'great lee', 'lee', 'zzz', 'ab x']:
+            for match in ('substring', 'word'):
+                for rank, limit in ((False, None), (True, None), (True, 5)):
+                    found = scan(query, books, match=match, rank=rank, limit=limit)
+                    self.assertEqual([b['id'] for b in found],
+                                     index.search(query, match=match, rank=rank, limit=limit),
+                                     (query, match, rank, limit))
+
+    def test_update_keeps_position(self):
+        """Test that reindexing a book keeps its place in catalog order."""
+        index = SearchIndex([
+            {'id': '1', 'title': 'Alpha', 'author': 'A'},
+            {'id': '2', 'title': 'Alpha Beta', 'author': 'B'},
+        ])
+        index.update({'id': '1', 'title': 'Alphabet', 'author': 'A'})
+        self.assertEqual(index.search('alpha'), ['1', '2'])
+        index.remove('1')
+        self.assertEqual(index.search('alpha'), ['2'])
+
+
+if __name__ == '__main__':
+    print("Running tests for the Bookstore API...")
+    unittest.main()
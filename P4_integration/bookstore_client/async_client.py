@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Bookstore Async Client
+
+An asyncio client for the Bookstore API, for jobs that need many requests
+in flight at once (e.g. fetching thousands of books by ID). Each request
+still sees the server's simulated delay, but they overlap instead of
+running one after another.
+
+It speaks HTTP/1.1 over asyncio streams, so it needs nothing beyond the
+standard library. Connections are kept alive and reused, and a semaphore
+bounds how many requests are in flight. Errors are raised as the same
+requests.exceptions as BookstoreClient, so callers can handle both alike.
+
+Example:
+
+    async with AsyncBookstoreClient(concurrency=50) as bookstore:
+        books = await bookstore.get_books_by_ids(ids)
+"""
+import asyncio
+import gzip
+import json
+import random
+import zlib
+from urllib.parse import quote, urlencode, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from client import (
+    ACCEPT_HEADER,
+    API_BASE_URL,
+    CONNECT_TIMEOUT,
+    IDEMPOTENT_METHODS,
+    READ_TIMEOUT,
+    RETRIES,
+    RETRY_BACKOFF,
+    RETRY_JITTER,
+    RETRY_STATUSES,
+    decode_response
+)
+
+# Maximum requests in flight (and connections kept open)
+DEFAULT_CONCURRENCY = 20
+
+
+class AsyncResponse:
+    """The parts of a requests.Response that the client functions use."""
+
+    def __init__(self, url, status_code, reason, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        try:
+            return json.loads(self.content)
+        except ValueError as e:
+            raise requests.exceptions.JSONDecodeError(e.msg, e.doc, e.pos) from e
+
+    def raise_for_status(self):
+        """Raise requests.exceptions.HTTPError for 4xx and 5xx responses."""
+        if not self.ok:
+            kind = "Client" if self.status_code < 500 else "Server"
+            raise requests.exceptions.HTTPError(
+                f"{self.status_code} {kind} Error: {self.reason} for url: {self.url}", response=self
+            )
+
+
+class _Connection:
+    """One keep-alive connection to the server."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncBookstoreClient:
+    """
+    Asyncio client for the Bookstore API.
+
+    The methods mirror BookstoreClient and raise requests.exceptions.RequestException
+    on failure. Idempotent requests are retried with the same backoff and
+    jitter as BookstoreClient.
+    """
+
+    def __init__(self, base_url=API_BASE_URL, concurrency=DEFAULT_CONCURRENCY,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=RETRIES, backoff_factor=RETRY_BACKOFF, backoff_jitter=RETRY_JITTER):
+        """
+        Create a client. Connections are opened on first use.
+
+        Parameters:
+            base_url (str): URL of the API, e.g. http://localhost:5000/api
+            concurrency (int): Maximum requests in flight
+            connect_timeout (float): Seconds to wait for a connection
+            read_timeout (float): Seconds to wait for a whole response
+            retries (int): Maximum retries of an idempotent request (0 disables retries)
+            backoff_factor (float): Wait before the first retry, doubled for each further one
+            backoff_jitter (float): Maximum random seconds added to each wait
+        """
+        url = urlsplit(base_url.rstrip("/"))
+        if url.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {url.scheme}")
+        self.base_url = base_url.rstrip("/")
+        self.books_path = f"{url.path}/books"
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.ssl = url.scheme == "https"
+        self.host_header = url.netloc
+        self.origin = f"{url.scheme}://{url.netloc}"
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._idle = []  # Connections ready for the next request
+        self.connections_opened = 0
+
+    async def close(self):
+        """Close the idle connections."""
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _connect(self):
+        """Return an idle connection, or open one. The flag tells whether it was reused."""
+        while self._idle:
+            connection = self._idle.pop()
+            if not connection.reader.at_eof():
+                return connection, True
+            connection.close()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.connect_timeout
+            )
+        except asyncio.TimeoutError:
+            raise requests.exceptions.ConnectTimeout(f"Connecting to {self.host_header} timed out")
+        except OSError as e:
+            raise requests.exceptions.ConnectionError(f"Failed to connect to {self.host_header}: {e}")
+        self.connections_opened += 1
+        return _Connection(reader, writer), False
+
+    async def _exchange(self, connection, method, target, body):
+        """Send one request and read its response. Returns (response, keep_alive)."""
+        lines = [
+            f"{method} {target} HTTP/1.1",
+            f"Host: {self.host_header}",
+            f"Accept: {ACCEPT_HEADER}",
+            "Accept-Encoding: gzip, deflate",
+            "Connection: keep-alive",
+        ]
+        if body is not None:
+            lines += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        connection.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await connection.writer.drain()
+
+        reader = connection.reader
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Server closed the connection")
+        version, status, *reason = status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        headers = CaseInsensitiveDict()
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip()] = value.strip()
+
+        status = int(status)
+        connection_header = headers.get("Connection", "").lower()
+        keep_alive = (connection_header != "close" if version == "HTTP/1.1"
+                      else connection_header == "keep-alive")
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            content = b""
+        elif "chunked" in headers.get("Transfer-Encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b"".join(chunks)
+        elif "Content-Length" in headers:
+            content = await reader.readexactly(int(headers["Content-Length"]))
+        else:
+            content = await reader.read()
+            keep_alive = False
+
+        coding = headers.get("Content-Encoding", "").lower()
+        try:
+            if coding == "gzip":
+                content = gzip.decompress(content)
+            elif coding == "deflate":
+                content = zlib.decompress(content)
+        except (OSError, EOFError, zlib.error) as e:
+            raise requests.exceptions.ContentDecodingError(f"Failed to decode {coding} response body: {e}")
+
+        response = AsyncResponse(self.origin + target, status, reason[0] if reason else "", headers, content)
+        return response, keep_alive
+
+    async def request(self, method, path, params=None, json_body=None):
+        """
+        Send a request and return the response, after raise_for_status().
+
+        Parameters:
+            method (str): HTTP method
+            path (str): Path on the server, e.g. /api/books/1
+            params (dict): Query parameters
+            json_body: Request body, sent as JSON
+        """
+        target = f"{path}?{urlencode(params)}" if params else path
+        body = json.dumps(json_body).encode("utf-8") if json_body is not None else None
+        retries = self.retries if method in IDEMPOTENT_METHODS else 0
+
+        async with self._semaphore:
+            attempt = 0
+            while True:
+                connection, reused = await self._connect()
+                try:
+                    response, keep_alive = await asyncio.wait_for(
+                        self._exchange(connection, method, target, body), self.read_timeout
+                    )
+                except asyncio.TimeoutError:
+                    # Caught first: since Python 3.11 it is the builtin TimeoutError, an OSError
+                    connection.close()
+                    raise requests.exceptions.ReadTimeout(f"{method} {target} timed out")
+                except requests.exceptions.RequestException:
+                    # Also an OSError; the response arrived but can't be decoded
+                    connection.close()
+                    raise
+                except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    connection.close()
+                    # The server may have dropped an idle connection: try a fresh one
+                    if reused and method in IDEMPOTENT_METHODS:
+                        continue
+                    if attempt < retries:
+                        attempt += 1
+                        await self._backoff(attempt)
+                        continue
+                    raise requests.exceptions.ConnectionError(f"{method} {target} failed: {e}")
+
+                if keep_alive:
+                    self._idle.append(connection)
+                else:
+                    connection.close()
+                if response.status_code in RETRY_STATUSES and attempt < retries:
+                    attempt += 1
+                    await self._backoff(attempt, response.headers.get("Retry-After"))
+                    continue
+                response.raise_for_status()
+                return response
+
+    async def _backoff(self, attempt, retry_after=None):
+        """Wait before a retry."""
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = self.backoff_factor * 2 ** (attempt - 1) + random.uniform(0, self.backoff_jitter)
+        await asyncio.sleep(delay)
+
+    async def get_all_books(self):
+        """Return every book in the catalog."""
+        return decode_response(await self.request("GET", self.books_path))
+
+    async def get_book(self, book_id):
+        """Return the book with the given ID."""
+        return decode_response(await self.request("GET", f"{self.books_path}/{quote(str(book_id), safe='')}"))
+
+    async def get_books_by_ids(self, ids):
+        """
+        Fetch many books at once.
+
+        Up to `concurrency` requests are in flight at a time.
+
+        Parameters:
+            ids (list): IDs of the books to fetch
+
+        Returns:
+            list: The books in the order of ids, with None for books that don't exist
+        """
+        async def fetch(book_id):
+            try:
+                return await self.get_book(book_id)
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    return None
+                raise
+
+        return await asyncio.gather(*(fetch(book_id) for book_id in ids))
+
+    async def add_book(self, book):
+        """Add a book and return it as stored, with its new ID."""
+        return decode_response(await self.request("POST", self.books_path, json_body=book))
+
+    async def update_book(self, book_id, changes):
+        """Update the given fields of a book and return the updated book."""
+        return decode_response(await self.request("PUT", f"{self.books_path}/{quote(str(book_id), safe='')}", json_body=changes))
+
+    async def delete_book(self, book_id):
+        """Delete a book and return the server's confirmation message."""
+        return decode_response(await self.request("DELETE", f"{self.books_path}/{quote(str(book_id), safe='')}")).get("message")
+
+    async def search_books(self, query, **params):
+        """Return the books matching a query (params: match, rank, limit)."""
+        response = await self.request("GET", f"{self.books_path}/search", params={"query": query, **params})
+        return decode_response(response)
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Bulk Import and Export
+
+Loads books from a CSV or JSONL file into the Bookstore API, or writes the
+catalog to one, without any prompts:
+
+    python bulk.py import books.csv --batch-size 500 --concurrency 4 --rate 10
+    python bulk.py export books.jsonl
+
+Import streams the file through a pipeline of generators: rows are read,
+validated with the same rules as the interactive add_book prompt, grouped
+into batches and sent to POST /api/books/batch from a few threads, at most
+--rate batches per second. Only a bounded number of batches is in memory at
+any time, so the file can be of any size.
+
+Progress is checkpointed to <file>.checkpoint after every batch. If an
+import is interrupted, running it again with --resume skips the rows that
+were already sent. New books get new IDs from the server, so IDs in the
+file are ignored.
+
+Export streams the NDJSON export endpoint straight to disk.
+"""
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+
+from client import (
+    BookstoreClient,
+    BookValidationError,
+    decode_response,
+    print_error,
+    print_info,
+    print_success,
+    validate_book
+)
+from profiling import ClientProfile
+
+# File formats
+CSV_FORMAT = "csv"
+JSONL_FORMAT = "jsonl"
+FORMATS = (CSV_FORMAT, JSONL_FORMAT)
+
+# Columns written to (and read from) CSV files
+CSV_FIELDS = ["id", "title", "author", "price", "in_stock"]
+
+DEFAULT_BATCH_SIZE = 500
+# Most operations the API accepts in one batch
+MAX_BATCH_SIZE = 10000
+DEFAULT_CONCURRENCY = 4
+# Invalid rows reported one by one before only counting them
+MAX_REPORTED_ERRORS = 20
+
+
+def detect_format(path, fmt=None):
+    """Return the file format: fmt if given, otherwise from the file extension."""
+    if fmt:
+        return fmt
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension in ("jsonl", "ndjson"):
+        return JSONL_FORMAT
+    if extension == "csv":
+        return CSV_FORMAT
+    raise ValueError(f"Can't tell the format of {path}; use --format {'/'.join(FORMATS)}")
+
+
+class RateLimiter:
+    """Allows at most `rate` calls of acquire() per second, across threads."""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        """
+        Parameters:
+            rate (float): Calls per second; None or 0 means no limit
+        """
+        self.interval = 1.0 / rate if rate else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next = None  # Earliest time of the next call
+
+    def acquire(self):
+        """Wait until the next call is allowed."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = self._clock()
+            start = now if self._next is None else max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            self._sleep(start - now)
+
+
+class Checkpoint:
+    """
+    Which rows of an import file have been handled, saved after every batch.
+
+    Batches finish out of order, so besides the number of leading rows that
+    are done, the checkpoint lists the ranges of rows done after them.
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.done = 0      # Rows [0, done) are handled
+        self.ranges = []   # Sorted, non-overlapping [start, end) ranges handled after that
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, source):
+        """Read a checkpoint, or start a new one if there is none for this file."""
+        checkpoint = cls(path, source)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return checkpoint
+        if data.get("source") != checkpoint.source:
+            raise ValueError(f"{path} is the checkpoint of another file ({data.get('source')})")
+        checkpoint.done = data["done"]
+        checkpoint.ranges = [tuple(r) for r in data["ranges"]]
+        return checkpoint
+
+    def is_done(self, row):
+        """Whether a row was handled by an earlier run."""
+        return row < self.done or any(start <= row < end for start, end in self.ranges)
+
+    def mark(self, start, end):
+        """Record rows [start, end) as handled and save the checkpoint."""
+        with self._lock:
+            ranges = sorted(self.ranges + [(start, end)])
+            merged = []
+            for lo, hi in ranges:
+                if merged and lo <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+                else:
+                    merged.append((lo, hi))
+            if merged and merged[0][0] <= self.done:
+                self.done = max(self.done, merged.pop(0)[1])
+            self.ranges = merged
+            self._save()
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"source": self.source, "done": self.done, "ranges": self.ranges}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        """Delete the checkpoint once the import is complete."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ImportReport:
+    """Counters and timings of an import."""
+
+    def __init__(self):
+        self.rows = 0          # Rows read from the file
+        self.skipped = 0       # Already imported by an earlier run
+        self.invalid = 0       # Failed validation
+        self.imported = 0
+        self.rejected = 0      # Refused by the server
+        self.batches = 0
+        self.batch_seconds = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def add_batch(self, seconds, imported, rejected):
+        with self._lock:
+            self.batches += 1
+            self.batch_seconds.append(seconds)
+            self.imported += imported
+            self.rejected += rejected
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def summary(self):
+        """Return the report as a dict."""
+        seconds = sorted(self.batch_seconds)
+
+        def percentile(fraction):
+            return round(seconds[min(len(seconds) - 1, int(fraction * len(seconds)))] * 1000, 1) if seconds else None
+
+        return {
+            "rows": self.rows,
+            "skipped": self.skipped,
+            "invalid": self.invalid,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "books_per_second": round(self.imported / self.elapsed, 1) if self.elapsed else None,
+            "batch_p50_ms": percentile(0.50),
+            "batch_p95_ms": percentile(0.95),
+        }
+
+
+# Import pipeline
+
+def read_rows(path, fmt):
+    """Yield each row of a CSV or JSONL file as a dict."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == CSV_FORMAT:
+            yield from csv.DictReader(f)
+            return
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {"_error": f"Invalid JSON on line {line_number}: {e}"}
+            yield row if isinstance(row, dict) else {"_error": f"Line {line_number} is not an object"}
+
+
+def validated(rows, checkpoint, report):
+    """
+    Validate rows and yield (row number, book) for the ones to import.
+
+    Rows done by an earlier run are skipped; invalid ones are reported,
+    counted and checkpointed as handled.
+    """
+    for number, row in enumerate(rows):
+        report.rows += 1
+        if checkpoint.is_done(number):
+            report.skipped += 1
+            continue
+        try:
+            if "_error" in row:
+                raise BookValidationError(row["_error"])
+            book = validate_book(row.get("title"), row.get("author"), row.get("price"), row.get("in_stock"))
+        except BookValidationError as e:
+            report.invalid += 1
+            if report.invalid <= MAX_REPORTED_ERRORS:
+                print_error(f"Row {number + 1}: {e}")
+            checkpoint.mark(number, number + 1)
+            continue
+        yield number, book
+
+
+def batched(items, size):
+    """Group an iterable into lists of at most size items."""
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def rejected_books(response, count):
+    """
+    Return the per-book results of a batch the API rejected because of some of its books.
+
+    Returns:
+        list: One result dict per book, or None if the response is not such a
+              rejection (e.g. the whole request was refused)
+    """
+    if response is None or response.status_code != 400:
+        return None
+    try:
+        body = decode_response(response)
+    except ValueError:
+        return None
+    results = body.get("results") if isinstance(body, dict) else None
+    if (not isinstance(results, list) or len(results) != count
+            or not all(isinstance(result, dict) for result in results)
+            or all(result.get("status") == 424 for result in results)):
+        return None
+    return results
+
+
+def send_batch(client, batch, limiter, checkpoint, report):
+    """
+    Create the books of one batch and checkpoint its rows.
+
+    The API applies a batch all or nothing, so if it refuses some books the
+    rest are sent again without them.
+
+    Raises:
+        requests.exceptions.HTTPError: If the API rejected the request as a
+            whole rather than some of its books (no per-book results)
+    """
+    start = time.perf_counter()
+    pending, rejected = batch, 0
+    while pending:
+        limiter.acquire()
+        try:
+            client.batch([{"op": "create", "book": book} for _, book in pending])
+            break
+        except requests.exceptions.HTTPError as e:
+            results = rejected_books(e.response, len(pending))
+            if results is None:
+                raise
+            refused = [(item, result) for item, result in zip(pending, results) if result.get("status") != 424]
+            for (number, _), result in refused:
+                print_error(f"Row {number + 1}: rejected by the server: {result.get('error')}")
+            rejected += len(refused)
+            refused_rows = {number for (number, _), _ in refused}
+            pending = [item for item in pending if item[0] not in refused_rows]
+    report.add_batch(time.perf_counter() - start, len(batch) - rejected, rejected)
+    # Rows of a batch are contiguous apart from skipped and invalid rows,
+    # which are already marked
+    checkpoint.mark(batch[0][0], batch[-1][0] + 1)
+
+
+def import_books(client, path, fmt=None, batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                 rate=None, checkpoint_path=None, resume=False):
+    """
+    Import books from a CSV or JSONL file.
+
+    Parameters:
+        client (BookstoreClient): Client to send the batches with
+        path (str): File to import
+        fmt (str): One of FORMATS (default: from the file extension)
+        batch_size (int): Books per batch request (at most MAX_BATCH_SIZE)
+        concurrency (int): Batches in flight at once
+        rate (float): Maximum batches per second (None: no limit)
+        checkpoint_path (str): Progress file (default: <path>.checkpoint)
+        resume (bool): Continue from the checkpoint of an interrupted import
+
+    Returns:
+        ImportReport: What was imported, and how fast
+
+    Raises:
+        ValueError: If batch_size is out of range
+        requests.exceptions.RequestException: If the API fails or rejects a
+            whole batch; the checkpoint is kept so the import can be resumed
+    """
+    if not 1 <= batch_size <= MAX_BATCH_SIZE:
+        raise ValueError(f"The batch size must be between 1 and {MAX_BATCH_SIZE}")
+    fmt = detect_format(path, fmt)
+    checkpoint_path = checkpoint_path or f"{path}.checkpoint"
+    if resume:
+        checkpoint = Checkpoint.load(checkpoint_path, path)
+    else:
+        checkpoint = Checkpoint(checkpoint_path, path)
+    limiter = RateLimiter(rate)
+    report = ImportReport()
+
+    batches = batched(validated(read_rows(path, fmt), checkpoint, report), batch_size)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        try:
+            for batch in batches:
+                # Keep a bounded number of batches in memory
+                if len(pending) >= concurrency * 2:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(send_batch, client, batch, limiter, checkpoint, report))
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+    report.finish()
+    checkpoint.remove()
+    return report
+
+
+# Export
+
+def export_books(client, path, fmt=None):
+    """
+    Write the whole catalog to a CSV or JSONL file, one book at a time.
+
+    The file is written under a temporary name and renamed when complete.
+
+    Returns:
+        int: Number of books written
+    """
+    fmt = detect_format(path, fmt)
+    tmp_path = f"{path}.tmp"
+    count = 0
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            if fmt == CSV_FORMAT:
+                writer = csv.DictWriter(f, fieldnames=CSV_FIELDS, extrasaction="ignore")
+                writer.writeheader()
+            for book in client.iter_all_books():
+                if fmt == CSV_FORMAT:
+                    # Written so that the file can be imported again
+                    writer.writerow(dict(book, price=f"{book.get('price', 0):.2f}",
+                                         in_stock="y" if book.get("in_stock") else "n"))
+                else:
+                    f.write(json.dumps(book) + "\n")
+                count += 1
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+def parse_batch_size(text):
+    """Parse --batch-size, which the API limits to MAX_BATCH_SIZE."""
+    size = int(text)
+    if not 1 <= size <= MAX_BATCH_SIZE:
+        raise argparse.ArgumentTypeError(f"must be between 1 and {MAX_BATCH_SIZE}")
+    return size
+
+
+def main(argv=None):
+    """Run the import or export command."""
+    parser = argparse.ArgumentParser(description="Import books into, or export them from, the Bookstore API.")
+    parser.add_argument("--url", help="base URL of the API (default: BOOKSTORE_API_URL)")
+    parser.add_argument("--profile", action="store_true", help="print histograms of request timings at the end")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="add the books in a CSV or JSONL file")
+    importer.add_argument("file")
+    importer.add_argument("--format", choices=FORMATS, help="file format (default: from the extension)")
+    importer.add_argument("--batch-size", type=parse_batch_size, default=DEFAULT_BATCH_SIZE,
+                          help=f"books per request (default: {DEFAULT_BATCH_SIZE})")
+    importer.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                          help=f"requests in flight (default: {DEFAULT_CONCURRENCY})")
+    importer.add_argument("--rate", type=float, help="maximum requests per second (default: no limit)")
+    importer.add_argument("--checkpoint", help="progress file (default: FILE.checkpoint)")
+    importer.add_argument("--resume", action="store_true", help="skip rows imported by an interrupted run")
+
+    exporter = commands.add_parser("export", help="write the catalog to a CSV or JSONL file")
+    exporter.add_argument("file")
+    exporter.add_argument("--format", choices=FORMATS, help="file format (default: from the extension)")
+
+    args = parser.parse_args(argv)
+    profile = ClientProfile() if args.profile else None
+    client = BookstoreClient(args.url, profile=profile) if args.url else BookstoreClient(profile=profile)
+    try:
+        if args.command == "import":
+            report = import_books(client, args.file, args.format, batch_size=args.batch_size,
+                                  concurrency=args.concurrency, rate=args.rate,
+                                  checkpoint_path=args.checkpoint, resume=args.resume)
+            summary = report.summary()
+            print_success(f"Imported {summary['imported']} books in {summary['elapsed_seconds']}s "
+                          f"({summary['books_per_second']} books/s).")
+            print(json.dumps(summary, indent=2))
+        else:
+            start = time.perf_counter()
+            count = export_books(client, args.file, args.format)
+            elapsed = time.perf_counter() - start
+            print_success(f"Exported {count} books to {args.file} in {elapsed:.2f}s "
+                          f"({count / elapsed if elapsed else 0:.0f} books/s).")
+    # RequestException is an OSError, so it must be caught first
+    except requests.exceptions.RequestException as e:
+        print_error(f"Request failed: {e}")
+        if args.command == "import":
+            print_info("Progress was saved; run the same command with --resume to continue.")
+        return 1
+    except (ValueError, OSError) as e:
+        print_error(str(e))
+        return 1
+    finally:
+        client.close()
+        if profile is not None:
+            print(profile.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
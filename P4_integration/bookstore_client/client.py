@@ -4,33 +4,178 @@ Bookstore Client
 
 A client application for interacting with the Bookstore API.
 This client is intentionally incomplete and contains TODOs for implementation.
+
+Run without arguments for the interactive menu, or with a command for
+scripts (JSON output):
+
+    python client.py list --in-stock
+    python client.py get 1
+    python client.py add --title Dune --author "Frank Herbert" --price 9.99
+    python client.py update 1 --price 7.50
+    python client.py delete 1
+    python client.py search orwell --match word
 """
-import requests
+import argparse
+import copy
+import importlib.util
+import itertools
 import json
-from tabulate import tabulate
+import os
+import shutil
 import sys
-from colorama import Fore, Style, init
+import time
 import re
 
-# Initialize colorama
-init(autoreset=True)
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+
+def _lazy_import(name):
+    """
+    Return a module that is only loaded when one of its attributes is first used.
+    
+    requests, colorama and msgpack take longer to import than the rest of the
+    client, and commands like --help don't need them at all.
+    
+    Returns:
+        module: The (not yet loaded) module, or None if it isn't installed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return None
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+requests = _lazy_import("requests")
+colorama = _lazy_import("colorama")
+# MessagePack is optional; without it the client asks for JSON
+msgpack = _lazy_import("msgpack")
 
 # Constants
-API_BASE_URL = "http://localhost:5000/api"
-BOOKS_ENDPOINT = f"{API_BASE_URL}/books"
+API_BASE_URL = os.environ.get("BOOKSTORE_API_URL", "http://localhost:5000/api")
+
+# Connection pool and timeouts (seconds) of a BookstoreClient
+POOL_SIZE = int(os.environ.get("BOOKSTORE_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.environ.get("BOOKSTORE_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.environ.get("BOOKSTORE_READ_TIMEOUT", "30"))
+
+# Retries of idempotent requests: the n-th retry waits
+# RETRY_BACKOFF * 2 ** (n - 1) seconds plus up to RETRY_JITTER seconds at random
+RETRIES = int(os.environ.get("BOOKSTORE_RETRIES", "3"))
+RETRY_BACKOFF = 0.5
+RETRY_JITTER = 0.25
+RETRY_STATUSES = (429, 502, 503, 504)
+# POST is not retried: a retried add could create the book twice
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+# Response cache of the shared client: entries kept (0 disables it) and
+# seconds an entry is used before it is revalidated with If-None-Match
+CACHE_SIZE = int(os.environ.get("BOOKSTORE_CACHE_SIZE", "0"))
+CACHE_TTL = float(os.environ.get("BOOKSTORE_CACHE_TTL", "30"))
+
+# SQLite file of a local replica of the catalog; if set, lookups and
+# searches are answered from the replica instead of the API
+REPLICA_FILE = os.environ.get("BOOKSTORE_REPLICA_FILE")
+
+# Bytes read at a time from streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024
+# Books fetched per request when the catalog is paged through
+BOOKS_PAGE_SIZE = 500
+
+# Book tables: rows used to size the columns of a streamed table, and the
+# widest a column may get (longer cells are cut short)
+TABLE_HEADERS = ["ID", "Title", "Author", "Price", "In Stock"]
+TABLE_SAMPLE_SIZE = 100
+MAX_COLUMN_WIDTH = 60
+# Table lines shown per page (0: fit the terminal)
+PAGER_LINES = int(os.environ.get("BOOKSTORE_PAGER_LINES", "0"))
+
+# Response formats, best first. requests already asks for (and decodes) gzip/deflate.
+MSGPACK_MIMETYPE = "application/msgpack"
+ACCEPT_HEADER = f"{MSGPACK_MIMETYPE}, application/json;q=0.9" if msgpack else "application/json"
 
 # Helper functions for formatting output
+_colorama_initialized = False
+
+def _colored(color, message):
+    """Return a message in a colorama foreground color, initializing colorama on first use."""
+    global _colorama_initialized
+    if not _colorama_initialized:
+        colorama.init(autoreset=True)
+        _colorama_initialized = True
+    return f"{getattr(colorama.Fore, color)}{message}{colorama.Style.RESET_ALL}"
+
 def print_success(message):
     """Print a success message in green."""
-    print(f"{Fore.GREEN}{message}{Style.RESET_ALL}")
+    print(_colored("GREEN", message))
 
-def print_error(message):
-    """Print an error message in red."""
-    print(f"{Fore.RED}Error: {message}{Style.RESET_ALL}")
+def print_error(message, stderr=False):
+    """Print an error message in red, to stdout or stderr."""
+    message = _colored("RED", f"Error: {message}")
+    # Looked up after _colored(), which may have wrapped the streams
+    print(message, file=sys.stderr if stderr else sys.stdout)
 
 def print_info(message):
     """Print an info message in blue."""
-    print(f"{Fore.BLUE}{message}{Style.RESET_ALL}")
+    print(_colored("BLUE", message))
+
+def book_row(book):
+    """Return the table cells of a book."""
+    return [
+        str(book.get("id", "N/A")),
+        str(book.get("title", "N/A")),
+        str(book.get("author", "N/A")),
+        f"${book.get('price', 0):.2f}",
+        "Yes" if book.get("in_stock", False) else "No"
+    ]
+
+def _fit(text, width):
+    """Pad text to a column width, cutting it short if it is too long."""
+    if len(text) > width:
+        return text[:width - 1] + "…"
+    return text.ljust(width)
+
+def iter_book_table(books, sample_size=TABLE_SAMPLE_SIZE, max_width=MAX_COLUMN_WIDTH):
+    """
+    Render books as a grid table, one line at a time.
+    
+    Only the first sample_size books are read before the first line is
+    produced: they decide the column widths. The remaining books are read
+    and rendered as the lines are consumed, so a large catalog starts
+    showing at once and is never held in memory as a whole.
+    
+    Parameters:
+        books (iterable): Books to render (may be a generator)
+        sample_size (int): Books used to size the columns (None: all of them)
+        max_width (int): Widest a column may get (None: no limit)
+    
+    Yields:
+        str: Each line of the table; nothing if there are no books
+    """
+    rows = map(book_row, books)
+    sample = list(itertools.islice(rows, sample_size)) if sample_size is not None else list(rows)
+    if not sample:
+        return
+    
+    widths = [max(len(cell) for cell in column) for column in zip(TABLE_HEADERS, *sample)]
+    if max_width is not None:
+        widths = [min(width, max_width) for width in widths]
+    border = "+" + "+".join("-" * (width + 2) for width in widths) + "+"
+    
+    def line(cells):
+        return "| " + " | ".join(_fit(cell, width) for cell, width in zip(cells, widths)) + " |"
+    
+    yield border
+    yield line(TABLE_HEADERS)
+    yield border.replace("-", "=")
+    for row in itertools.chain(sample, rows):
+        yield line(row)
+        yield border
 
 def format_book_table(books):
     """Format a list of books as a table."""
@@ -41,38 +186,469 @@ def format_book_table(books):
     if isinstance(books, dict):
         books = [books]
     
-    headers = ["ID", "Title", "Author", "Price", "In Stock"]
-    rows = [
-        [
-            book.get("id", "N/A"),
-            book.get("title", "N/A"),
-            book.get("author", "N/A"),
-            f"${book.get('price', 0):.2f}",
-            "Yes" if book.get("in_stock", False) else "No"
-        ]
-        for book in books
-    ]
+    return "\n".join(iter_book_table(books, sample_size=None, max_width=None))
+
+def page_lines(lines, page_size=None):
+    """
+    Print lines a page at a time, asking before each further page.
+    
+    Lines are pulled from the iterable only as pages are shown, so when they
+    are rendered from books fetched on demand, nothing past the current page
+    is fetched. Without a terminal everything is printed.
+    
+    Parameters:
+        lines (iterable): Lines to print
+        page_size (int): Lines per page (default: PAGER_LINES or the terminal height)
     
-    return tabulate(rows, headers=headers, tablefmt="grid")
+    Returns:
+        bool: False if the user stopped before the end
+    """
+    if not page_size:
+        page_size = PAGER_LINES or max(shutil.get_terminal_size().lines - 2, 5)
+    interactive = sys.stdin.isatty() and sys.stdout.isatty()
+    
+    lines = iter(lines)
+    shown = 0
+    for line in lines:
+        print(line)
+        shown += 1
+        if interactive and shown % page_size == 0:
+            # Look ahead so there is no prompt after the last line
+            following = next(lines, None)
+            if following is None:
+                break
+            answer = input("-- More: Enter for the next page, q to stop -- ")
+            if answer.strip().lower() == "q":
+                return False
+            lines = itertools.chain([following], lines)
+    return True
+
+def show_books(books):
+    """Show books as a table, one page at a time."""
+    lines = iter_book_table(books)
+    first = next(lines, None)
+    if first is None:
+        print("No books found.")
+        return
+    page_lines(itertools.chain([first], lines))
+
+# Validation of book details, shared by the add_book prompt and bulk imports
+
+# Prices are entered as dollars and cents, e.g. 12.99
+PRICE_PATTERN = re.compile(r'^\d+\.\d{2}$')
+
+class BookValidationError(ValueError):
+    """Raised when book details entered by a user or read from a file are invalid."""
+
+def validate_title(title):
+    """Return the title, or raise BookValidationError if it is empty."""
+    if not title:
+        raise BookValidationError("No book title was entered.")
+    return title
+
+def validate_author(author):
+    """Return the author, or raise BookValidationError if it is empty."""
+    if not author:
+        raise BookValidationError("No book author was entered.")
+    return author
+
+def validate_price(price):
+    """
+    Check a price in dollars and cents.
+    
+    Parameters:
+        price (str or number): e.g. "12.99"; numbers (from JSON) may have at most two decimals
+    
+    Returns:
+        str: The price as entered, e.g. "12.99"
+    """
+    if isinstance(price, (int, float)) and not isinstance(price, bool) and price >= 0 and round(price, 2) == price:
+        price = f"{price:.2f}"
+    if not isinstance(price, str) or not PRICE_PATTERN.match(price):
+        raise BookValidationError("Book price is not in valid format.")
+    return price
+
+def validate_in_stock(in_stock):
+    """
+    Check an in-stock answer.
+    
+    Parameters:
+        in_stock (str or bool): "y" or "n" in any case, or a boolean (from JSON)
+    
+    Returns:
+        bool: Whether the book is in stock
+    """
+    if isinstance(in_stock, bool):
+        return in_stock
+    if not isinstance(in_stock, str) or in_stock.lower() not in ('y', 'n'):
+        raise BookValidationError("In stock value must either be y or n.")
+    return in_stock.lower() == 'y'
+
+def validate_book(title, author, price, in_stock):
+    """
+    Validate book details and build the book to send to the API.
+    
+    Returns:
+        dict: The new book
+    
+    Raises:
+        BookValidationError: For the first invalid field
+    """
+    return {
+        'title': validate_title(title),
+        'author': validate_author(author),
+        'price': validate_price(price),
+        'in_stock': validate_in_stock(in_stock)
+    }
 
 # API client functions
 
+def decode_response(response):
+    """Decode a response body in whichever format the server chose."""
+    content_type = response.headers.get("Content-Type", "")
+    if msgpack and content_type.split(";")[0].strip() == MSGPACK_MIMETYPE:
+        return msgpack.unpackb(response.content)
+    return response.json()
+
+class BookstoreClient:
+    """
+    Client for the Bookstore API that reuses its connections.
+    
+    Requests go through one requests.Session, so connections are kept alive
+    and pooled instead of being opened for every call. Every request has a
+    connect and read timeout, and idempotent requests are retried with
+    exponential backoff and jitter on connection errors and 429/502/503/504
+    responses (honouring Retry-After).
+    
+    With a ResponseCache, GET results are cached and revalidated with their
+    ETag, and the client's own mutations invalidate what they affect.
+    
+    Concurrent GETs of the same URL and query from several threads share one
+    request (see SingleFlight). With a ClientProfile, the time of every
+    request is split into connect, time to first byte, download and decode.
+    
+    The methods raise requests.exceptions.RequestException on failure; the
+    module-level functions below wrap the default client and print errors
+    instead.
+    """
+    
+    def __init__(self, base_url=API_BASE_URL, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=RETRIES, backoff_factor=RETRY_BACKOFF, backoff_jitter=RETRY_JITTER,
+                 cache=None, coalesce=True, profile=None):
+        """
+        Create a client.
+        
+        Parameters:
+            base_url (str): URL of the API, e.g. http://localhost:5000/api
+            pool_size (int): Maximum connections kept open to the server
+            connect_timeout (float): Seconds to wait for a connection
+            read_timeout (float): Seconds to wait between bytes of a response
+            retries (int): Maximum retries of an idempotent request (0 disables retries)
+            backoff_factor (float): Wait before the first retry, doubled for each further one
+            backoff_jitter (float): Maximum random seconds added to each wait
+            cache (ResponseCache): Cache for GET responses, or None
+            coalesce (bool): Share one request among concurrent identical GETs
+            profile (ClientProfile): Collects request timings, or None
+        """
+        self.base_url = base_url.rstrip("/")
+        self.books_endpoint = f"{self.base_url}/books"
+        self.search_endpoint = f"{self.books_endpoint}/search"
+        self.export_endpoint = f"{self.books_endpoint}/export"
+        self.cache = cache
+        self.flights = SingleFlight() if coalesce else None
+        self.profile = profile
+        self.timeout = (connect_timeout, read_timeout)
+        from urllib3.util.retry import Retry
+        if profile is None:
+            from requests.adapters import HTTPAdapter as adapter_class
+        else:
+            from profiling import ProfiledHTTPAdapter as adapter_class
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_jitter,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False
+        )
+        adapter = adapter_class(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+    
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def request(self, method, url, **kwargs):
+        """
+        Send a request with the client's timeouts and Accept header.
+        
+        Returns:
+            requests.Response: The response, after raise_for_status()
+        """
+        kwargs["headers"] = {"Accept": ACCEPT_HEADER, **kwargs.get("headers", {})}
+        kwargs.setdefault("timeout", self.timeout)
+        if self.profile is None:
+            response = self.session.request(method, url, **kwargs)
+        else:
+            from profiling import CONNECT, DOWNLOAD, TTFB, take_connect_time
+            take_connect_time()
+            start = time.perf_counter()
+            response = self.session.request(method, url, **kwargs)
+            total = time.perf_counter() - start
+            # response.elapsed ends when the headers have been read
+            headers_received = response.elapsed.total_seconds()
+            connect = take_connect_time()
+            if connect:
+                self.profile.record(CONNECT, connect)
+            self.profile.record(TTFB, headers_received - connect)
+            if not kwargs.get("stream"):
+                self.profile.record(DOWNLOAD, total - headers_received)
+        response.raise_for_status()
+        return response
+    
+    def decode(self, response):
+        """Decode a response body, timing it if the client is profiled."""
+        if self.profile is None:
+            return decode_response(response)
+        from profiling import DECODE
+        start = time.perf_counter()
+        payload = decode_response(response)
+        self.profile.record(DECODE, time.perf_counter() - start)
+        return payload
+    
+    def get(self, url, params=None):
+        """
+        GET a URL and return the decoded body, through the cache if there is one.
+        
+        If another thread is already getting the same URL and query, waits for
+        its response instead of sending the same request again.
+        
+        Returns:
+            The decoded body; a copy the caller may modify
+        """
+        return self.get_page(url, params)[0]
+    
+    def get_page(self, url, params=None):
+        """
+        GET a page of a list like get(), along with the cursor of the next page.
+        
+        Returns:
+            tuple: (decoded body, X-Next-Cursor value or None)
+        """
+        if self.flights is None:
+            return self._get(url, params)
+        return self.flights.do(ResponseCache.key(url, params), lambda: self._get(url, params))
+    
+    def _get(self, url, params):
+        """Send a GET, or answer it from the cache; returns (body, next cursor)."""
+        if self.cache is None:
+            response = self.request("GET", url, params=params)
+            return self.decode(response), response.headers.get("X-Next-Cursor")
+        
+        key = self.cache.key(url, params)
+        cached = self.cache.get(key)
+        headers = {}
+        if cached:
+            payload, etag, fresh = cached
+            if fresh:
+                return copy.deepcopy(payload)
+            headers["If-None-Match"] = etag
+        
+        response = self.request("GET", url, params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            self.cache.refresh(key)
+            return copy.deepcopy(cached[0])
+        # The cursor is cached with the body so cached pages can still be followed
+        payload = self.decode(response), response.headers.get("X-Next-Cursor")
+        self.cache.put(key, payload, response.headers.get("ETag"))
+        return copy.deepcopy(payload)
+    
+    def mutate(self, method, url, book_id=None, **kwargs):
+        """
+        Send a request that changes the catalog and return the decoded body.
+        
+        Cached lists, searches and the book itself are invalidated, even if
+        the request fails, since it may have been applied anyway. GETs of
+        them already in flight are no longer shared with new callers.
+        """
+        try:
+            return self.decode(self.request(method, url, **kwargs))
+        finally:
+            urls = [self.books_endpoint, self.search_endpoint]
+            if book_id is not None:
+                urls.append(f"{self.books_endpoint}/{book_id}")
+            self.forget(*urls)
+    
+    def forget(self, *urls):
+        """Drop cached responses and shared in-flight GETs of the given URLs."""
+        if self.cache is not None:
+            self.cache.invalidate(*urls)
+        if self.flights is not None:
+            self.flights.forget(*urls)
+    
+    def get_all_books(self):
+        """Return every book in the catalog."""
+        return self.get(self.books_endpoint)
+    
+    def iter_all_books(self):
+        """Stream every book from the NDJSON export endpoint."""
+        with self.request("GET", self.export_endpoint, stream=True) as response:
+            for line in response.iter_lines(chunk_size=STREAM_CHUNK_SIZE):
+                if line:
+                    yield json.loads(line)
+    
+    def iter_books(self, page_size=BOOKS_PAGE_SIZE, **filters):
+        """
+        Yield every book, requesting the next page only once the previous one is used up.
+        
+        Parameters:
+            page_size (int): Books per request
+            filters: in_stock, min_price or max_price, as for GET /api/books
+        """
+        params = {"limit": page_size, **filters}
+        while True:
+            books, cursor = self.get_page(self.books_endpoint, params)
+            yield from books
+            if not cursor:
+                return
+            params = {**params, "cursor": cursor}
+    
+    def get_book(self, book_id):
+        """Return the book with the given ID."""
+        return self.get(f"{self.books_endpoint}/{book_id}")
+    
+    def add_book(self, book):
+        """Add a book and return it as stored, with its new ID."""
+        return self.mutate("POST", self.books_endpoint, json=book)
+    
+    def update_book(self, book_id, changes):
+        """Update the given fields of a book and return the updated book."""
+        return self.mutate("PUT", f"{self.books_endpoint}/{book_id}", book_id, json=changes)
+    
+    def delete_book(self, book_id):
+        """Delete a book and return the server's confirmation message."""
+        return self.mutate("DELETE", f"{self.books_endpoint}/{book_id}", book_id).get("message")
+    
+    def batch(self, operations):
+        """
+        Apply create/update/delete operations atomically (POST /api/books/batch).
+        
+        Returns:
+            list: The result of each operation
+        
+        Raises:
+            requests.exceptions.HTTPError: If the batch was rejected; the
+                response body has the per-operation results
+        """
+        try:
+            return self.mutate("POST", f"{self.books_endpoint}/batch", json={"operations": operations})["results"]
+        finally:
+            self.forget(*(f"{self.books_endpoint}/{op['id']}" for op in operations if "id" in op))
+    
+    def search_books(self, query, **params):
+        """Return the books matching a query (params: match, rank, limit)."""
+        return self.get(self.search_endpoint, params={"query": query, **params})
+    
+    def get_changes(self, since=None, epoch=None, wait=None):
+        """
+        Read the change feed (see Replica in replica.py).
+        
+        Without since, returns the feed's current position and no changes.
+        
+        Returns:
+            dict: {'epoch', 'next', 'resnapshot', 'changes'}
+        """
+        params = {key: value for key, value in (("since", since), ("epoch", epoch), ("wait", wait))
+                  if value is not None}
+        timeout = (self.timeout[0], self.timeout[1] + wait) if wait else self.timeout
+        return self.decode(self.request("GET", f"{self.books_endpoint}/changes",
+                                            params=params, timeout=timeout))
+
+_default_client = None
+# Settings of the default client, changed by --url and --profile
+_api_url = API_BASE_URL
+_profile = None
+
+def get_client():
+    """Return the client shared by the module-level functions."""
+    global _default_client
+    if _default_client is None:
+        cache = ResponseCache(CACHE_SIZE, CACHE_TTL) if CACHE_SIZE > 0 else None
+        _default_client = BookstoreClient(_api_url, cache=cache, profile=_profile)
+    return _default_client
+
+_replica = None
+
+def get_replica():
+    """
+    Return the local replica if replica mode is on (BOOKSTORE_REPLICA_FILE).
+    
+    The first call brings the replica up to date and starts following the
+    change feed in the background. Returns None if replica mode is off or
+    the replica can't be synced, in which case the API is used directly.
+    """
+    global _replica
+    if _replica is None and REPLICA_FILE:
+        from replica import Replica
+        replica = Replica(REPLICA_FILE, get_client())
+        try:
+            replica.sync()
+        except requests.exceptions.RequestException as e:
+            print_error(f"Failed to sync the local replica: {e}")
+            replica.close()
+            return None
+        replica.follow()
+        _replica = replica
+    return _replica
+
 def get_all_books():
     """Retrieve all books from the API."""
     try:
-        response = requests.get(BOOKS_ENDPOINT)
-        response.raise_for_status()
-        books = response.json()
-        return books
+        return get_client().get_all_books()
     except requests.exceptions.RequestException as e:
         print_error(f"Failed to retrieve books: {e}")
         return []
 
+def iter_all_books():
+    """
+    Stream all books from the API one at a time.
+    
+    Uses the NDJSON export endpoint, so the catalog is parsed line by line
+    instead of being downloaded and decoded as one large array.
+    
+    Yields:
+        dict: Each book in the catalog
+    """
+    try:
+        yield from get_client().iter_all_books()
+    except requests.exceptions.RequestException as e:
+        print_error(f"Failed to stream books: {e}")
+
+def iter_books():
+    """
+    Yield all books from the API, fetching a page at a time as they are consumed.
+    
+    Yields:
+        dict: Each book in the catalog
+    """
+    try:
+        yield from get_client().iter_books()
+    except requests.exceptions.RequestException as e:
+        print_error(f"Failed to retrieve books: {e}")
+
 def display_all_books():
-    """Display all books in a formatted table."""
+    """Display all books in a table, a page at a time."""
     print_info("Fetching all books...")
-    books = get_all_books()
-    print(format_book_table(books))
+    show_books(iter_books())
 
 # TODO: Implement the get_book_by_id function
 def get_book_by_id(book_id):
@@ -90,14 +666,14 @@ def get_book_by_id(book_id):
     # 2. Handle any errors that might occur
     # 3. Return the book data if successful
 
+    # Replica mode answers from the local copy without a round trip
+    replica = get_replica()
+    if replica is not None:
+        return replica.get(book_id)
+
     try:
-        # Sends get message to api endpoint of relevant book
-        response = requests.get(BOOKS_ENDPOINT + f"/{book_id}")
-        # Checks status code of http method, for errors
-        response.raise_for_status()
         # Gets and returns relevant book
-        book = response.json()
-        return book
+        return get_client().get_book(book_id)
     except requests.exceptions.RequestException as e:
         # Error handling
         print_error(f"Failed to retrieve books: {e}")
@@ -138,41 +714,24 @@ def add_book():
     # 3. Send a POST request to the appropriate endpoint
     # 4. Handle any errors and display appropriate messages
 
-    # User input of book details 
-    title = input("Enter the book's title: ")
-    if not title:
-        print_error("No book title was entered.")
-        return
-
-    author = input("Enter the book's author: ")
-    if not author:
-        print_error("No book author was entered.")
-        return
-
-    price = input("Enter the book's price ($): ")
-    if not bool(re.match(r'^\d+\.\d{2}$', price)):
-        print_error("Book price is not in valid format.")
-        return
-
-    in_stock = input("Enter whether or not the book is in stock (Y/n): ")
-    if not in_stock.lower() in ('y', 'n'):
-        print_error("Error: In stock value must either be y or n.")
-        return
-
-    new_book = {
-        'title': title,
-        'author': author,
-        'price': price,
-        'in_stock' : in_stock.lower() == 'y'
-    }
+    # User input of book details, each checked as soon as it is entered
+    prompts = [
+        ('title', "Enter the book's title: ", validate_title),
+        ('author', "Enter the book's author: ", validate_author),
+        ('price', "Enter the book's price ($): ", validate_price),
+        ('in_stock', "Enter whether or not the book is in stock (Y/n): ", validate_in_stock),
+    ]
+    new_book = {}
+    for field, prompt, validate in prompts:
+        try:
+            new_book[field] = validate(input(prompt))
+        except BookValidationError as e:
+            print_error(str(e))
+            return
 
     try:
-        # Specify what type of data is being sent in post message
-        headers = {'Content-Type': 'application/json'}
         # Send post message with new book data
-        response = requests.post(BOOKS_ENDPOINT, headers=headers, data=json.dumps(new_book))
-        # Raise status code errors
-        response.raise_for_status()
+        get_client().add_book(new_book)
         # If no error: print successful mesasge
         print_success("Book was successfully added.")
     except requests.exceptions.RequestException as e:
@@ -210,10 +769,10 @@ def update_book():
     
     # User input of book details 
     print("Leave field empty to keep current value.")
-    print(f"Current Title: {book.get("title")}")
+    print(f"Current Title: {book.get('title')}")
     title = input("New Title: ")
 
-    print(f"Current Author: {book.get("author")}")
+    print(f"Current Author: {book.get('author')}")
     author = input("New Author: ")
 
     print(f"Current Price: ${book.get('price')}")
@@ -227,7 +786,7 @@ def update_book():
     if author:
         book['author'] = author
     # Checks for correct format
-    if bool(re.match(r'^\d+\.\d{2}$', price)):
+    if PRICE_PATTERN.match(price):
         book['price'] = price
     else:
         print_error("Incorrect price format.")
@@ -235,12 +794,8 @@ def update_book():
         book['in_stock'] = (in_stock == 'y')
 
     try:
-        # Specify what type of data is being sent in post message
-        headers = {'Content-Type': 'application/json'}
-        # Send post message with new book data
-        response = requests.put(BOOKS_ENDPOINT + f"/{book_id}", headers=headers, data=json.dumps(book))
-        # Raise status code errors
-        response.raise_for_status()
+        # Send put message with the updated book data
+        get_client().update_book(book_id, book)
         # If no error: print successful mesasge
         print_success("Book was successfully updated.")
     except requests.exceptions.RequestException as e:
@@ -286,11 +841,9 @@ def delete_book():
 
     try:
         # Sends delete message to api endpoint of relevant book id
-        response = requests.delete(BOOKS_ENDPOINT + f"/{book_id}")
-        # Checks status code of http method, for errors
-        response.raise_for_status()
+        message = get_client().delete_book(book_id)
         # Print success message
-        print_success(response.json().get('message'))
+        print_success(message)
         # print_success(f"Book with ID {book_id} was successfully deleted.")
     except requests.exceptions.RequestException as e:
         # Error handling
@@ -318,11 +871,14 @@ def search_books():
 
     query_params = {'query': query_choice}
 
+    replica = get_replica()
+    if replica is not None:
+        show_books(replica.search(query_choice))
+        return
+
     try:
-        response = requests.get(BOOKS_ENDPOINT + '/search', params=query_params)
-        response.raise_for_status()
-        books = response.json()
-        print(format_book_table(books))
+        books = get_client().search_books(**query_params)
+        show_books(books)
     except requests.exceptions.RequestException as e:
         print_error(f"Failed to retrieve books: {e}")
 
@@ -340,8 +896,178 @@ def display_menu():
     print("7. Exit")
     print("=" * 50)
 
-def main():
-    """Main application function."""
+# Commands for scripts: each prints JSON (or a table) and returns an exit status
+
+OUTPUT_FORMATS = ("json", "jsonl", "table")
+
+def write_books(books, output_format):
+    """Write books to stdout as they arrive: a JSON array, one JSON object per line, or a table."""
+    if output_format == "table":
+        show_books(books)
+        return
+    if output_format == "jsonl":
+        for book in books:
+            sys.stdout.write(json.dumps(book) + "\n")
+        return
+    separator = "\n  "
+    sys.stdout.write("[")
+    for book in books:
+        sys.stdout.write(separator + json.dumps(book))
+        separator = ",\n  "
+    sys.stdout.write("]\n" if separator == "\n  " else "\n]\n")
+
+def write_book(book, output_format):
+    """Write one book to stdout."""
+    if output_format == "table":
+        print(format_book_table(book))
+    elif output_format == "json":
+        print(json.dumps(book, indent=2))
+    else:
+        print(json.dumps(book))
+
+def book_changes(args):
+    """
+    Return the validated fields given as --title/--author/--price/--in-stock.
+    
+    Raises:
+        BookValidationError: For the first invalid field
+    """
+    validators = (
+        ("title", validate_title),
+        ("author", validate_author),
+        ("price", validate_price),
+        ("in_stock", validate_in_stock),
+    )
+    return {field: validate(getattr(args, field)) for field, validate in validators
+            if getattr(args, field) is not None}
+
+def command_list(args):
+    """List the catalog, a page of books per request."""
+    filters = {"min_price": args.min_price, "max_price": args.max_price}
+    if args.in_stock is not None:
+        filters["in_stock"] = str(args.in_stock).lower()
+    write_books(get_client().iter_books(**{k: v for k, v in filters.items() if v is not None}), args.format)
+    return 0
+
+def command_get(args):
+    """Show one book."""
+    replica = get_replica()
+    if replica is not None:
+        book = replica.get(args.id)
+        if book is None:
+            print_error(f"There is no book with ID {args.id}.", stderr=True)
+            return 1
+    else:
+        book = get_client().get_book(args.id)
+    write_book(book, args.format)
+    return 0
+
+def command_add(args):
+    """Add a book and show it with its new ID."""
+    book = validate_book(args.title, args.author, args.price, args.in_stock)
+    write_book(get_client().add_book(book), args.format)
+    return 0
+
+def command_update(args):
+    """Change the given fields of a book and show the result."""
+    changes = book_changes(args)
+    if not changes:
+        raise BookValidationError("Nothing to update; give at least one of --title, --author, --price, --in-stock.")
+    write_book(get_client().update_book(args.id, changes), args.format)
+    return 0
+
+def command_delete(args):
+    """Delete a book."""
+    message = get_client().delete_book(args.id)
+    if args.format == "table":
+        print_success(message)
+    else:
+        print(json.dumps({"id": args.id, "message": message}))
+    return 0
+
+def command_search(args):
+    """Search titles and authors."""
+    replica = get_replica()
+    if replica is not None:
+        books = replica.search(args.query, match=args.match, limit=args.limit)
+    else:
+        params = {"match": args.match, "limit": args.limit}
+        books = get_client().search_books(args.query, **{k: v for k, v in params.items() if v is not None})
+    write_books(books, args.format)
+    return 0
+
+def error_message(error):
+    """Return the message of a failed request, preferring the API's own."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            body = decode_response(response)
+        except ValueError:
+            body = None
+        if isinstance(body, dict) and (body.get("message") or body.get("error")):
+            return f"{response.status_code}: {body.get('message') or body.get('error')}"
+    return str(error)
+
+def build_parser():
+    """Return the parser of the command line."""
+    parser = argparse.ArgumentParser(
+        description="Client for the Bookstore API. Without a command, starts the interactive menu."
+    )
+    parser.add_argument("--url", help="base URL of the API (default: BOOKSTORE_API_URL)")
+    parser.add_argument("--profile", action="store_true",
+                        help="print histograms of request timings (to stderr) on exit")
+    
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--format", choices=OUTPUT_FORMATS, default="json", help="output format (default: json)")
+    
+    def yes_no(value):
+        try:
+            return validate_in_stock(value)
+        except BookValidationError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    
+    command = commands.add_parser("list", parents=[output], help="list all books")
+    command.add_argument("--in-stock", dest="in_stock", action="store_true", default=None, help="only books in stock")
+    command.add_argument("--out-of-stock", dest="in_stock", action="store_false", help="only books out of stock")
+    command.add_argument("--min-price", type=float, help="lowest price")
+    command.add_argument("--max-price", type=float, help="highest price")
+    command.set_defaults(run=command_list)
+    
+    command = commands.add_parser("get", parents=[output], help="show a book")
+    command.add_argument("id")
+    command.set_defaults(run=command_get)
+    
+    command = commands.add_parser("add", parents=[output], help="add a book")
+    command.add_argument("--title", required=True)
+    command.add_argument("--author", required=True)
+    command.add_argument("--price", required=True, help="dollars and cents, e.g. 12.99")
+    command.add_argument("--in-stock", dest="in_stock", type=yes_no, default=True, metavar="Y/N",
+                         help="whether the book is in stock (default: y)")
+    command.set_defaults(run=command_add)
+    
+    command = commands.add_parser("update", parents=[output], help="change fields of a book")
+    command.add_argument("id")
+    command.add_argument("--title")
+    command.add_argument("--author")
+    command.add_argument("--price", help="dollars and cents, e.g. 12.99")
+    command.add_argument("--in-stock", dest="in_stock", type=yes_no, metavar="Y/N")
+    command.set_defaults(run=command_update)
+    
+    command = commands.add_parser("delete", parents=[output], help="delete a book")
+    command.add_argument("id")
+    command.set_defaults(run=command_delete)
+    
+    command = commands.add_parser("search", parents=[output], help="search titles and authors")
+    command.add_argument("query")
+    command.add_argument("--match", choices=("substring", "word"), help="match substrings (default) or whole words")
+    command.add_argument("--limit", type=int, help="most books to return")
+    command.set_defaults(run=command_search)
+    return parser
+
+def run_menu():
+    """Run the interactive menu until the user exits."""
     try:
         while True:
             display_menu()
@@ -375,5 +1101,40 @@ def main():
     
     return 0
 
+def main(argv=None):
+    """
+    Main application function.
+    
+    Returns:
+        int: Exit status: 0 on success, 1 if the request failed, 2 for invalid arguments
+    """
+    global _api_url, _profile
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.url:
+        _api_url = args.url
+    if args.profile:
+        from profiling import ClientProfile
+        _profile = ClientProfile()
+    
+    try:
+        if args.command is None:
+            return run_menu()
+        try:
+            return args.run(args)
+        except BookValidationError as e:
+            parser.error(str(e))
+        except requests.exceptions.RequestException as e:
+            print_error(error_message(e), stderr=True)
+            return 1
+        except BrokenPipeError:
+            # The reader (e.g. head) went away; stop quietly, without another
+            # error when Python flushes stdout at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 0
+    finally:
+        if _profile is not None:
+            print(_profile.report(), file=sys.stderr)
+
 if __name__ == "__main__":
     sys.exit(main()) 
\ No newline at end of file
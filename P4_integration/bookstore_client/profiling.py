@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Client Request Profiling
+
+Splits the time of each BookstoreClient request into phases and collects
+them in histograms, to show whether time goes to the network or to the
+client itself:
+
+    connect   DNS lookup and TCP (and TLS) connect, for requests that
+              opened a new connection rather than reusing a pooled one
+    ttfb      From sending the request to receiving the response headers
+              (server time plus a round trip), retries included
+    download  Reading the response body
+    decode    Parsing the body (JSON or MessagePack)
+
+Streamed responses (the NDJSON export) record connect and ttfb only, since
+their body is read and parsed as it is used.
+
+Example:
+
+    profile = ClientProfile()
+    bookstore = BookstoreClient(profile=profile)
+    ...
+    print(profile.report())
+"""
+import bisect
+import math
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+CONNECT = "connect"
+TTFB = "ttfb"
+DOWNLOAD = "download"
+DECODE = "decode"
+PHASES = (CONNECT, TTFB, DOWNLOAD, DECODE)
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BAR_WIDTH = 40
+
+# Connect time spent by the current thread since the last take_connect_time()
+_local = threading.local()
+
+
+def take_connect_time():
+    """Return the seconds this thread spent opening connections since the last call, and reset them."""
+    seconds = getattr(_local, "connect", 0.0)
+    _local.connect = 0.0
+    return seconds
+
+
+class _TimedConnectMixin:
+    """Adds the time of connect() to the calling thread's connect time."""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _local.connect = getattr(_local, "connect", 0.0) + time.perf_counter() - start
+
+
+class TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class ProfiledHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter whose connections record how long they take to open."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+class Histogram:
+    """Counts durations in logarithmic buckets (see BUCKET_BOUNDS_MS)."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)  # The last bucket is unbounded
+        self.count = 0
+        self.total = 0.0   # Seconds
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Record one duration."""
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, seconds * 1000)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """
+        Return the upper bound in milliseconds of the bucket holding the given percentile.
+
+        The unbounded last bucket reports the largest duration instead.
+        """
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKET_BOUNDS_MS[i] if i < len(BUCKET_BOUNDS_MS) else self.max * 1000
+        return self.max * 1000
+
+    def summary(self):
+        """Return the count, mean, p50, p95 and max (in milliseconds) as a dict."""
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else None,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": round(self.max * 1000, 3) if self.count else None,
+        }
+
+    def lines(self):
+        """Yield the non-empty range of buckets as text bars."""
+        used = [i for i, count in enumerate(self.counts) if count]
+        if not used:
+            return
+        peak = max(self.counts)
+        for i in range(used[0], used[-1] + 1):
+            label = f"<= {BUCKET_BOUNDS_MS[i]:g} ms" if i < len(BUCKET_BOUNDS_MS) else f"> {BUCKET_BOUNDS_MS[-1]:g} ms"
+            bar = "#" * round(self.counts[i] / peak * BAR_WIDTH)
+            yield f"  {label:>12} | {bar:<{BAR_WIDTH}} {self.counts[i]}"
+
+
+class ClientProfile:
+    """Histograms of the request phases of one or more clients (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        self.requests = 0
+
+    def record(self, phase, seconds):
+        """Add the duration of one phase of a request."""
+        with self._lock:
+            self.histograms[phase].add(max(seconds, 0.0))
+            if phase == TTFB:
+                self.requests += 1
+
+    def summary(self):
+        """Return the summary of every phase as a dict."""
+        with self._lock:
+            return {phase: histogram.summary() for phase, histogram in self.histograms.items()}
+
+    def report(self):
+        """Return the histograms as text."""
+        with self._lock:
+            lines = [f"Request timings ({self.requests} requests, "
+                     f"{self.histograms[CONNECT].count} new connections)"]
+            for phase, histogram in self.histograms.items():
+                summary = histogram.summary()
+                if not summary["count"]:
+                    lines.append(f"{phase}: no samples")
+                    continue
+                lines.append(f"{phase}: n={summary['count']} mean={summary['mean_ms']:.2f} ms "
+                             f"p50<={summary['p50_ms']:g} ms p95<={summary['p95_ms']:g} ms "
+                             f"max={summary['max_ms']:.2f} ms")
+                lines.extend(histogram.lines())
+            return "\n".join(lines)
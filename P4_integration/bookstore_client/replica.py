@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Bookstore Replica
+
+A local, on-disk copy of the catalog for clients that look books up or
+search often. The catalog is downloaded once into a SQLite database and
+then kept up to date from the API's change feed (GET /api/books/changes),
+so only the changes travel over the network. ID lookups use the primary
+key and searches use FTS5 tables (trigram for substring queries, unicode61
+for whole-word queries). Both answer in well under a millisecond, without
+a round trip.
+
+The replica remembers the feed position it has reached, so a restarted
+client only fetches what changed while it was away. If the server asks for
+a resnapshot (the client fell too far behind or the catalog was replaced),
+the catalog is downloaded again.
+
+Example:
+
+    replica = Replica("books.replica.db", BookstoreClient())
+    replica.sync()
+    replica.follow()  # Keep applying changes in the background
+    replica.search("orwell")
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+
+# Match modes (as in the API's search endpoint)
+SUBSTRING = "substring"
+WORD = "word"
+MATCH_MODES = (SUBSTRING, WORD)
+
+# Shortest query the trigram tokenizer can match
+MIN_TRIGRAM_QUERY = 3
+TOKEN_PATTERN = re.compile(r"\w+")
+# Seconds a follow() long-poll waits for a change (the server allows up to 30)
+FOLLOW_WAIT = 25
+# Seconds to wait before retrying after a failed sync in follow()
+FOLLOW_RETRY_DELAY = 5
+# Seconds close() waits for the follow() thread to finish; one still in a
+# long-poll after that finds the replica closed and drops what it fetched
+CLOSE_TIMEOUT = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    book TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+    title, author, content='books', content_rowid='seq', tokenize='trigram'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS books_words USING fts5(
+    title, author, content='books', content_rowid='seq'
+);
+"""
+
+# Keep the FTS tables in step with single-book changes. A snapshot load
+# drops the insert and delete triggers and rebuilds the FTS tables in one go,
+# which is several times faster than indexing row by row.
+TRIGGERS = {
+    "books_ai": """
+CREATE TRIGGER IF NOT EXISTS books_ai AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title, author) VALUES (new.seq, new.title, new.author);
+    INSERT INTO books_words (rowid, title, author) VALUES (new.seq, new.title, new.author);
+END""",
+    "books_ad": """
+CREATE TRIGGER IF NOT EXISTS books_ad AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.seq, old.title, old.author);
+    INSERT INTO books_words (books_words, rowid, title, author) VALUES ('delete', old.seq, old.title, old.author);
+END""",
+    "books_au": """
+CREATE TRIGGER IF NOT EXISTS books_au AFTER UPDATE OF title, author ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author) VALUES ('delete', old.seq, old.title, old.author);
+    INSERT INTO books_words (books_words, rowid, title, author) VALUES ('delete', old.seq, old.title, old.author);
+    INSERT INTO books_fts (rowid, title, author) VALUES (new.seq, new.title, new.author);
+    INSERT INTO books_words (rowid, title, author) VALUES (new.seq, new.title, new.author);
+END""",
+}
+
+SELECT_BOOK = "SELECT book FROM books WHERE id = ?"
+SELECT_ALL = "SELECT book FROM books ORDER BY seq"
+COUNT_BOOKS = "SELECT COUNT(*) FROM books"
+SELECT_META = "SELECT value FROM meta WHERE key = ?"
+UPSERT_META = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+# Updates keep the book's seq, so results stay in catalog order
+UPSERT_BOOK = (
+    "INSERT INTO books (id, title, author, book) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (id) DO UPDATE SET title = excluded.title, author = excluded.author, book = excluded.book"
+)
+DELETE_BOOK = "DELETE FROM books WHERE id = ?"
+SEARCH_SUBSTRING = (
+    "SELECT book FROM books WHERE seq IN "
+    "(SELECT rowid FROM books_fts WHERE books_fts MATCH ?) ORDER BY seq"
+)
+SEARCH_SHORT = (
+    "SELECT book FROM books "
+    "WHERE instr(py_lower(title), ?) OR instr(py_lower(author), ?) ORDER BY seq"
+)
+SEARCH_WORDS = (
+    "SELECT book FROM books WHERE seq IN "
+    "(SELECT rowid FROM books_words WHERE books_words MATCH ?) ORDER BY seq"
+)
+
+
+def _phrase(text):
+    """Quote text as a single FTS5 phrase."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _row(book):
+    """Return the (id, title, author, book) values stored for a book."""
+    return (
+        book["id"], str(book.get("title", "")), str(book.get("author", "")),
+        json.dumps(book, separators=(",", ":"))
+    )
+
+
+class Replica:
+    """A local copy of the catalog, kept in sync through the change feed."""
+
+    def __init__(self, path, client):
+        """
+        Open (or create) a replica.
+
+        Parameters:
+            path (str): SQLite file holding the replica (":memory:" for a throwaway one)
+            client (BookstoreClient): Client used to download the catalog and follow changes
+        """
+        self.path = path
+        self.client = client
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.create_function("py_lower", 1, str.lower, deterministic=True)
+        self._conn.executescript(SCHEMA)
+        for trigger in TRIGGERS.values():
+            self._conn.execute(trigger)
+        # One connection is shared by the reader and the follow() thread
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._follower = None
+        self._closed = False
+
+        self.snapshots = 0        # Full downloads of the catalog
+        self.changes_applied = 0
+        self.last_sync = None     # time.time() of the last successful sync
+
+    def close(self):
+        """Stop following and close the database."""
+        self.stop()
+        follower = self._follower
+        if follower is not None and follower is not threading.current_thread():
+            follower.join(CLOSE_TIMEOUT)
+        with self._lock:
+            self._closed = True
+            self._conn.close()
+
+    # Position in the change feed
+
+    def _meta(self, key):
+        row = self._conn.execute(SELECT_META, (key,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def position(self):
+        """(epoch, version) of the catalog the replica holds, or (None, None) before the first sync."""
+        with self._lock:
+            return self._meta("epoch"), self._meta("version")
+
+    # Syncing
+
+    def sync(self, wait=None):
+        """
+        Bring the replica up to date.
+
+        Downloads the whole catalog on the first sync or when the server asks
+        for a resnapshot, and otherwise applies the changes since the last sync.
+
+        Parameters:
+            wait (float): Seconds to long-poll for a change if there is none yet
+
+        Returns:
+            int: Number of changes applied (-1 after a full download)
+
+        Raises:
+            requests.exceptions.RequestException: If the API can't be reached
+        """
+        with self._sync_lock:
+            epoch, version = self.position
+            if epoch is None:
+                self._load_snapshot()
+                return -1
+
+            applied = 0
+            while True:
+                feed = self.client.get_changes(since=version, epoch=epoch, wait=wait if not applied else None)
+                if feed["resnapshot"]:
+                    self._load_snapshot()
+                    return -1
+                if not feed["changes"]:
+                    break
+                if not self._apply(feed["changes"], feed["epoch"], feed["next"]):
+                    return applied
+                applied += len(feed["changes"])
+                epoch, version = feed["epoch"], feed["next"]
+            self.last_sync = time.time()
+            return applied
+
+    def _load_snapshot(self):
+        """Replace the replica with a fresh download of the catalog."""
+        # Take the feed position first: changes made during the download are
+        # replayed by the next sync, and replaying a change is harmless
+        position = self.client.get_changes()
+        # Download before locking so lookups keep being served from the old copy
+        books = list(self.client.iter_all_books())
+        with self._lock:
+            if self._closed:
+                return
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for name in ("books_ai", "books_ad"):
+                    conn.execute(f"DROP TRIGGER {name}")
+                conn.execute("DELETE FROM books")
+                conn.executemany(UPSERT_BOOK, map(_row, books))
+                conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+                conn.execute("INSERT INTO books_words (books_words) VALUES ('rebuild')")
+                for name in ("books_ai", "books_ad"):
+                    conn.execute(TRIGGERS[name])
+                conn.execute(UPSERT_META, ("epoch", position["epoch"]))
+                conn.execute(UPSERT_META, ("version", position["next"]))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self.snapshots += 1
+        self.last_sync = time.time()
+
+    def _apply(self, changes, epoch, version):
+        """
+        Apply a page of changes and record the new feed position, in one transaction.
+
+        Returns:
+            bool: False if the replica was closed meanwhile and nothing was applied
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for change in changes:
+                    if change["op"] == "put":
+                        conn.execute(UPSERT_BOOK, _row(change["book"]))
+                    else:
+                        conn.execute(DELETE_BOOK, (change["id"],))
+                conn.execute(UPSERT_META, ("epoch", epoch))
+                conn.execute(UPSERT_META, ("version", version))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        self.changes_applied += len(changes)
+        return True
+
+    def follow(self, wait=FOLLOW_WAIT):
+        """Keep the replica in sync from a background thread until stop() is called."""
+        if self._follower is not None and self._follower.is_alive() and not self._stop.is_set():
+            return
+        # Each thread gets its own event, so a stopped thread still in a
+        # long-poll can't be revived alongside the new one
+        stop = self._stop = threading.Event()
+
+        def run():
+            while not stop.is_set():
+                try:
+                    self.sync(wait=wait)
+                except requests.exceptions.RequestException:
+                    stop.wait(FOLLOW_RETRY_DELAY)
+
+        self._follower = threading.Thread(target=run, name="replica-follow", daemon=True)
+        self._follower.start()
+
+    def stop(self):
+        """Stop following changes (the thread exits once an ongoing long-poll returns)."""
+        self._stop.set()
+
+    # Reads
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(COUNT_BOOKS).fetchone()[0]
+
+    def get(self, book_id):
+        """Return the book with the given ID, or None."""
+        with self._lock:
+            row = self._conn.execute(SELECT_BOOK, (book_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self):
+        """Return every book in catalog order."""
+        with self._lock:
+            rows = self._conn.execute(SELECT_ALL).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def search(self, query, match=SUBSTRING, limit=None):
+        """
+        Search titles and authors like GET /api/books/search (without ranking).
+
+        Parameters:
+            query (str): The search text (case-insensitive)
+            match (str): One of MATCH_MODES
+            limit (int): Maximum number of books to return
+
+        Returns:
+            list: Matching books in catalog order
+        """
+        if match not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode: {match}")
+
+        query = query.lower()
+        if match == SUBSTRING:
+            if len(query) < MIN_TRIGRAM_QUERY:
+                sql, params = SEARCH_SHORT, [query, query]
+            else:
+                sql, params = SEARCH_SUBSTRING, [_phrase(query)]
+        else:
+            words = sorted(set(TOKEN_PATTERN.findall(query)))
+            if not words:
+                return []
+            sql, params = SEARCH_WORDS, [" ".join(_phrase(word) for word in words)]
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Response Cache
+
+A bounded LRU cache with a TTL for decoded GET responses, used by
+BookstoreClient. While an entry is fresh it is returned without asking the
+server. Once its TTL has run out, an entry with an ETag is revalidated with
+If-None-Match, so an unchanged book or list costs a 304 instead of a full
+download. Entries without an ETag (servers that don't support conditional
+requests) are simply dropped when they expire.
+
+Entries are keyed by (url, query parameters). Mutations made through the
+client invalidate every entry of the URLs they affect.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class ResponseCache:
+    """LRU + TTL cache of decoded responses keyed by URL and query."""
+
+    def __init__(self, max_entries=256, ttl=30.0, clock=time.monotonic):
+        """
+        Create an empty cache.
+
+        Parameters:
+            max_entries (int): Maximum number of entries
+            ttl (float): Seconds an entry is used without revalidating it
+            clock (callable): Time source (injectable for tests)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (url, query) -> (etag, expires_at, payload)
+
+        self.hits = 0            # Served without a request
+        self.revalidations = 0   # Confirmed unchanged by a 304
+        self.misses = 0
+        self.evictions = 0       # Dropped to stay within max_entries
+        self.invalidations = 0   # Dropped because of a mutation
+
+    @staticmethod
+    def key(url, params=None):
+        """Return the cache key of a URL and its query parameters."""
+        return url, tuple(sorted((params or {}).items()))
+
+    def get(self, key):
+        """
+        Look up an entry.
+
+        Returns:
+            tuple: (payload, etag, fresh), or None if there is no usable entry.
+                   A stale entry is only returned if it has an ETag to revalidate.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            etag, expires_at, payload = entry
+            fresh = expires_at > self._clock()
+            if not fresh and not etag:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if fresh:
+                self.hits += 1
+            return payload, etag, fresh
+
+    def put(self, key, payload, etag=None):
+        """Store a decoded response and the ETag it came with."""
+        with self._lock:
+            self._entries[key] = (etag, self._clock() + self.ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def refresh(self, key):
+        """Restart the TTL of an entry the server confirmed is unchanged."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                etag, _, payload = entry
+                self._entries[key] = (etag, self._clock() + self.ttl, payload)
+                self.revalidations += 1
+
+    def invalidate(self, *urls):
+        """Drop every entry for the given URLs, whatever their query."""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] in urls]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
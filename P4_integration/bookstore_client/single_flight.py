@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Single-Flight Requests
+
+Coalesces concurrent calls for the same key: the first caller (the leader)
+makes the call, and callers that ask for the same key while it is in
+flight wait for it and share its result or exception instead of sending a
+duplicate request. Once the call returns, the next caller starts a new one;
+results are not cached.
+
+Keys are (url, query) pairs as produced by ResponseCache.key, so a
+mutation can forget() the flights of the URLs it affects. Callers that
+arrive after that start a fresh request instead of joining one that may
+have read the old data.
+"""
+import copy
+import threading
+
+
+class _Flight:
+    """One in-flight call and the callers waiting for it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Shares one in-flight call among concurrent callers with the same key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> _Flight
+
+        self.calls = 0    # Calls actually made
+        self.shared = 0   # Callers served by another caller's call
+
+    def do(self, key, fn):
+        """
+        Call fn(), or wait for the call already in flight for key.
+
+        Parameters:
+            key (hashable): Identifies calls that return the same thing
+            fn (callable): Makes the call
+
+        Returns:
+            The result of fn(); callers that joined a flight get a deep copy,
+            so each caller may modify what it gets
+
+        Raises:
+            Whatever fn() raised, in the leader and in every waiting caller
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.shared += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            # Waiters copy a snapshot taken now, so the leader's caller may modify the original
+            flight.result = copy.deepcopy(result) if self._land(key, flight) else None
+            return result
+        finally:
+            self._land(key, flight)
+            flight.done.set()
+
+    def _land(self, key, flight):
+        """End a flight so that new callers start a new call; return whether anyone joined it."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return flight.waiters > 0
+
+    def forget(self, *urls):
+        """Make later callers for these URLs start a new call instead of joining one in flight."""
+        with self._lock:
+            for key in [key for key in self._flights if key[0] in urls]:
+                del self._flights[key]
+
+    def __len__(self):
+        return len(self._flights)
@@ -5,22 +5,109 @@ Test script for the Bookstore Client
 This script tests the implementation of the Bookstore client
 by calling each function and validating its functionality.
 """
+import asyncio
+import time
 import unittest
 import requests
 from unittest.mock import patch, MagicMock
 import json
 import io
+import os
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Import client module
+import client
 from client import (
     get_all_books,
+    iter_all_books,
     get_book_by_id,
     add_book,
     update_book,
     delete_book,
-    search_books
+    search_books,
+    msgpack,
+    BookstoreClient,
+    format_book_table,
+    iter_book_table,
+    page_lines
 )
+from async_client import AsyncBookstoreClient
+from bulk import Checkpoint, RateLimiter, export_books, import_books, main as bulk_main
+from profiling import ClientProfile, Histogram
+from replica import Replica
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+
+
+class StubServer:
+    """
+    A local HTTP server that answers with canned responses.
+    
+    Each response is a (status, body) or (status, body, headers) tuple;
+    requests beyond the list get the last one. responses can also be a function of (method, path) that
+    returns the tuple. Received requests are recorded as (method, path,
+    headers), and every response is sent after `delay` seconds.
+    """
+    
+    def __init__(self, responses, delay=0):
+        self.responses = responses if callable(responses) else list(responses)
+        self.requests = []
+        self.connections = set()  # client (host, port) of every connection
+        self.in_flight = self.max_in_flight = 0
+        lock = threading.Lock()
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                with lock:
+                    stub.requests.append((self.command, self.path, dict(self.headers)))
+                    stub.connections.add(self.client_address)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    if callable(stub.responses):
+                        status, body, *headers = stub.responses(self.command, self.path)
+                    else:
+                        status, body, *headers = stub.responses[min(len(stub.requests), len(stub.responses)) - 1]
+                time.sleep(delay)
+                with lock:
+                    stub.in_flight -= 1
+                self.send_response(status)
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                if status == 304:
+                    self.end_headers()
+                    return
+                data = json.dumps(body).encode()
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            do_GET = do_POST = do_PUT = do_DELETE = respond
+            
+            def log_message(self, *args):
+                pass
+        
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 64
+            daemon_threads = True
+        
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
 
 class TestBookstoreClient(unittest.TestCase):
     """Test cases for Bookstore client implementation."""
@@ -47,7 +134,7 @@ class TestBookstoreClient(unittest.TestCase):
         
         self.single_book = self.sample_books[0]
     
-    @patch('client.requests.get')
+    @patch('client.requests.Session.request')
     def test_get_all_books(self, mock_get):
         """Test the get_all_books function."""
         # Mock the response
@@ -63,7 +150,7 @@ class TestBookstoreClient(unittest.TestCase):
         self.assertEqual(result, self.sample_books)
         mock_get.assert_called_once()
     
-    @patch('client.requests.get')
+    @patch('client.requests.Session.request')
     def test_get_book_by_id(self, mock_get):
         """Test the get_book_by_id function."""
         # This test will fail until the function is implemented
@@ -83,7 +170,7 @@ class TestBookstoreClient(unittest.TestCase):
         self.assertEqual(result, self.single_book)
         mock_get.assert_called_once()
     
-    @patch('client.requests.get')
+    @patch('client.requests.Session.request')
     def test_get_book_by_id_error(self, mock_get):
         """Test error handling in get_book_by_id function."""
         # This test will fail until the function is implemented
@@ -99,9 +186,819 @@ class TestBookstoreClient(unittest.TestCase):
         # Assert the result
         self.assertIsNone(result)
     
+    @patch('client.requests.Session.request')
+    def test_iter_all_books(self, mock_get):
+        """Test that iter_all_books parses the NDJSON stream line by line."""
+        mock_response = MagicMock()
+        mock_response.iter_lines.return_value = iter(
+            [json.dumps(book).encode() for book in self.sample_books] + [b'']
+        )
+        mock_response.raise_for_status.return_value = None
+        mock_get.return_value.__enter__.return_value = mock_response
+        
+        result = iter_all_books()
+        
+        # Nothing is requested until the generator is consumed
+        mock_get.assert_not_called()
+        self.assertEqual(list(result), self.sample_books)
+        self.assertTrue(mock_get.call_args.kwargs['stream'])
+    
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    @patch('client.requests.Session.request')
+    def test_get_all_books_msgpack(self, mock_get):
+        """Test that MessagePack responses are negotiated and decoded."""
+        mock_response = MagicMock()
+        mock_response.headers = {'Content-Type': 'application/msgpack'}
+        mock_response.content = msgpack.packb(self.sample_books)
+        mock_response.raise_for_status.return_value = None
+        mock_get.return_value = mock_response
+        
+        self.assertEqual(get_all_books(), self.sample_books)
+        self.assertIn('application/msgpack', mock_get.call_args.kwargs['headers']['Accept'])
+    
     # More tests would be implemented here for other functions
     # ...
 
+
+class TestBookstoreClientSession(unittest.TestCase):
+    """Test cases for the pooled, retrying BookstoreClient."""
+    
+    def make_client(self, responses, **options):
+        """Start a stub server and return a client for it."""
+        server = StubServer(responses)
+        self.addCleanup(server.close)
+        client = BookstoreClient(server.url, backoff_factor=0, backoff_jitter=0, **options)
+        self.addCleanup(client.close)
+        return server, client
+    
+    def test_retries_idempotent_requests(self):
+        """Test that GETs are retried on 503 and reuse one connection pool."""
+        book = {'id': '1', 'title': 'T'}
+        server, client = self.make_client([(503, {}), (503, {}), (200, book)])
+        
+        self.assertEqual(client.get_book('1'), book)
+        self.assertEqual([r[:2] for r in server.requests], [('GET', '/api/books/1')] * 3)
+        self.assertEqual(client.get_book('1'), book)
+        self.assertEqual(len(client.session.get_adapter(server.url).poolmanager.pools), 1)
+    
+    def test_does_not_retry_post(self):
+        """Test that a failed add is not sent twice."""
+        server, client = self.make_client([(503, {}), (201, {'id': '1'})])
+        
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.add_book({'title': 'T'})
+        self.assertEqual(len(server.requests), 1)
+    
+    def test_gives_up_after_retries(self):
+        """Test that the last error is raised once the retries are used up."""
+        server, client = self.make_client([(503, {})], retries=2)
+        
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.search_books('x')
+        self.assertEqual(len(server.requests), 3)
+    
+    @patch('client.requests.Session.request')
+    def test_timeouts_and_headers(self, mock_request):
+        """Test that every request has a timeout and the Accept header."""
+        client = BookstoreClient('http://example.com/api/', connect_timeout=1, read_timeout=2)
+        client.update_book('7', {'price': 1.0})
+        
+        args, kwargs = mock_request.call_args
+        self.assertEqual(args, ('PUT', 'http://example.com/api/books/7'))
+        self.assertEqual(kwargs['timeout'], (1, 2))
+        self.assertEqual(kwargs['json'], {'price': 1.0})
+        self.assertIn('Accept', kwargs['headers'])
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test cases for the client-side response cache."""
+    
+    def setUp(self):
+        """Set up a client with a cache on a fake clock."""
+        self.now = 0.0
+        self.cache = ResponseCache(max_entries=3, ttl=10, clock=lambda: self.now)
+    
+    def make_client(self, respond):
+        """Start a stub server and return a caching client for it."""
+        server = StubServer(respond)
+        self.addCleanup(server.close)
+        client = BookstoreClient(server.url, cache=self.cache, backoff_factor=0, backoff_jitter=0)
+        self.addCleanup(client.close)
+        return server, client
+    
+    def test_ttl_and_etag_revalidation(self):
+        """Test that fresh entries skip the server and stale ones are revalidated."""
+        def respond(method, path):
+            if server.requests[-1][2].get('If-None-Match') == '"v1"':
+                return 304, None, {'ETag': '"v1"'}
+            return 200, {'id': '1', 'title': 'T'}, {'ETag': '"v1"'}
+        server, client = self.make_client(respond)
+        
+        book = client.get_book('1')
+        book['title'] = 'Changed by the caller'
+        self.assertEqual(client.get_book('1')['title'], 'T')
+        self.assertEqual(len(server.requests), 1)
+        
+        self.now = 11
+        self.assertEqual(client.get_book('1')['title'], 'T')
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(server.requests[1][2]['If-None-Match'], '"v1"')
+        self.assertEqual(self.cache.revalidations, 1)
+        # The 304 restarted the TTL
+        self.now = 20
+        client.get_book('1')
+        self.assertEqual(len(server.requests), 2)
+    
+    def test_without_etags(self):
+        """Test that entries without an ETag expire instead of being revalidated."""
+        server, client = self.make_client(lambda method, path: (200, [{'id': '1'}]))
+        
+        client.search_books('a')
+        client.search_books('a')
+        client.search_books('b')
+        self.assertEqual(len(server.requests), 2)
+        self.now = 11
+        client.search_books('a')
+        self.assertEqual(len(server.requests), 3)
+        self.assertNotIn('If-None-Match', server.requests[2][2])
+    
+    def test_pages_are_cached(self):
+        """Test that a repeated paged listing is served from the cache, cursors included."""
+        def respond(method, path):
+            if 'cursor=c1' in path:
+                return 200, [{'id': '3'}]
+            return 200, [{'id': '1'}, {'id': '2'}], {'X-Next-Cursor': 'c1'}
+        server, client = self.make_client(respond)
+        
+        self.assertEqual([b['id'] for b in client.iter_books(page_size=2)], ['1', '2', '3'])
+        self.assertEqual([b['id'] for b in client.iter_books(page_size=2)], ['1', '2', '3'])
+        self.assertEqual(len(server.requests), 2)
+        
+        client.add_book({'title': 'T'})
+        self.assertEqual(len(list(client.iter_books(page_size=2))), 3)
+        self.assertEqual(len(server.requests), 5)
+    
+    def test_mutations_invalidate(self):
+        """Test that mutations drop the book, list and search entries."""
+        server, client = self.make_client(lambda method, path: (200, {'id': '1', 'message': 'ok'}))
+        
+        client.get_all_books()
+        client.search_books('x')
+        client.get_book('1')
+        client.get_book('2')
+        self.assertEqual(len(self.cache), 3)  # The oldest entry was evicted
+        client.update_book('1', {'price': 1.0})
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.key(f"{server.url}/books/2"), next(iter(self.cache._entries)))
+        
+        client.get_book('1')
+        client.add_book({'title': 'T'})
+        self.assertEqual(len(self.cache), 2)
+        client.delete_book('2')
+        self.assertEqual(len(self.cache), 1)
+
+
+class TestBookTables(unittest.TestCase):
+    """Test cases for the streaming table renderer and pager."""
+    
+    def books(self, count, consumed=None):
+        """Generate books, recording how many were read."""
+        for i in range(count):
+            if consumed is not None:
+                consumed.append(i)
+            yield {'id': str(i), 'title': f"Book {i}", 'author': 'A', 'price': i, 'in_stock': i % 2 == 0}
+    
+    def test_lines_are_rendered_lazily(self):
+        """Test that only the sample is read before the first line."""
+        consumed = []
+        lines = iter_book_table(self.books(1000, consumed), sample_size=10)
+        
+        header = [next(lines) for _ in range(3)]
+        self.assertEqual(len(consumed), 10)
+        self.assertEqual(header[1], '| ID | Title  | Author | Price | In Stock |')
+        self.assertTrue(header[2].startswith('+====+'))
+        rest = list(lines)
+        self.assertEqual(len(consumed), 1000)
+        self.assertEqual(len(rest), 2000)
+        # Rows past the sample are cut to the sampled widths
+        self.assertEqual(rest[-2], '| 9… | Book … | A      | $999… | No       |')
+        self.assertEqual(len({len(line) for line in header + rest}), 1)
+    
+    def test_format_book_table(self):
+        """Test the complete table of a list or a single book."""
+        table = format_book_table({'id': '1', 'title': 'A Very Long Title', 'price': 5})
+        self.assertIn('| 1  | A Very Long Title | N/A    | $5.00 | No       |', table)
+        self.assertEqual(format_book_table([]), 'No books found.')
+        self.assertEqual(list(iter_book_table([])), [])
+    
+    @patch('client.sys.stdin.isatty', return_value=True)
+    def test_pager(self, mock_isatty):
+        """Test that the pager asks between pages and stops fetching when told to."""
+        consumed = []
+        output = io.StringIO()
+        output.isatty = lambda: True
+        with patch('builtins.input', side_effect=['', 'q']) as mock_input, patch('sys.stdout', output):
+            finished = page_lines(iter_book_table(self.books(100, consumed), sample_size=5), page_size=10)
+        
+        self.assertFalse(finished)
+        self.assertEqual(mock_input.call_count, 2)
+        self.assertEqual(len(output.getvalue().splitlines()), 20)
+        self.assertLess(len(consumed), 15)
+        
+        # No prompt after the last page
+        with patch('builtins.input') as mock_input, patch('sys.stdout', output):
+            self.assertTrue(page_lines(['a'] * 10, page_size=5))
+        self.assertEqual(mock_input.call_count, 1)
+    
+    def test_iter_books_pages_on_demand(self):
+        """Test that BookstoreClient.iter_books follows cursors one page at a time."""
+        def respond(method, path):
+            if 'cursor=c1' in path:
+                return 200, [{'id': '3'}]
+            return 200, [{'id': '1'}, {'id': '2'}], {'X-Next-Cursor': 'c1'}
+        server = StubServer(respond)
+        self.addCleanup(server.close)
+        client = BookstoreClient(server.url)
+        self.addCleanup(client.close)
+        
+        books = client.iter_books(page_size=2)
+        self.assertEqual([next(books), next(books)], [{'id': '1'}, {'id': '2'}])
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(list(books), [{'id': '3'}])
+        self.assertEqual([r[1] for r in server.requests], ['/api/books?limit=2', '/api/books?limit=2&cursor=c1'])
+
+
+class FakeFeedClient:
+    """Stands in for BookstoreClient: a catalog plus its change feed."""
+    
+    def __init__(self, books):
+        self.books = {book['id']: dict(book) for book in books}
+        self.epoch = 'e1'
+        self.changes = []  # change feed entries, seq = version
+        self.floor = 0
+        self.downloads = 0
+    
+    @property
+    def version(self):
+        return self.floor + len(self.changes)
+    
+    def put(self, book):
+        self.books[book['id']] = dict(book)
+        self.changes.append({'seq': self.version + 1, 'op': 'put', 'id': book['id'], 'book': dict(book)})
+    
+    def delete(self, book_id):
+        del self.books[book_id]
+        self.changes.append({'seq': self.version + 1, 'op': 'delete', 'id': book_id})
+    
+    def iter_all_books(self):
+        self.downloads += 1
+        return iter(list(self.books.values()))
+    
+    def get_changes(self, since=None, epoch=None, wait=None):
+        if since is None:
+            return {'epoch': self.epoch, 'next': self.version, 'resnapshot': False, 'changes': []}
+        if epoch != self.epoch or since < self.floor:
+            return {'epoch': self.epoch, 'next': self.version, 'resnapshot': True, 'changes': []}
+        changes = self.changes[since - self.floor:][:2]  # Small pages
+        return {'epoch': self.epoch, 'next': changes[-1]['seq'] if changes else since,
+                'resnapshot': False, 'changes': changes}
+
+
+class TestReplica(unittest.TestCase):
+    """Test cases for the local replica."""
+    
+    def setUp(self):
+        """Set up a replica file and a fake API."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+        self.path = os.path.join(self.tmp_dir, 'replica.db')
+        self.api = FakeFeedClient([
+            {'id': '1', 'title': 'The Great Gatsby', 'author': 'F. Scott Fitzgerald', 'price': 10.0, 'in_stock': True},
+            {'id': '2', 'title': '1984', 'author': 'George Orwell', 'price': 8.5, 'in_stock': False},
+            {'id': '3', 'title': 'Animal Farm', 'author': 'George Orwell', 'price': 7.0, 'in_stock': True},
+        ])
+    
+    def open_replica(self):
+        replica = Replica(self.path, self.api)
+        self.addCleanup(replica.close)
+        return replica
+    
+    def test_snapshot_and_lookups(self):
+        """Test the first sync downloads the catalog and answers locally."""
+        replica = self.open_replica()
+        self.assertEqual(replica.sync(), -1)
+        
+        self.assertEqual(len(replica), 3)
+        self.assertEqual(replica.get('2'), self.api.books['2'])
+        self.assertIsNone(replica.get('9'))
+        self.assertEqual([b['id'] for b in replica.search('orwell')], ['2', '3'])
+        self.assertEqual([b['id'] for b in replica.search('OR')], ['2', '3'])
+        self.assertEqual([b['id'] for b in replica.search('great', limit=1)], ['1'])
+        self.assertEqual([b['id'] for b in replica.search('farm george', match='word')], ['3'])
+        self.assertEqual(replica.search('farm george'), [])
+    
+    def test_incremental_sync(self):
+        """Test that changes are applied in pages and survive a restart."""
+        replica = self.open_replica()
+        replica.sync()
+        self.api.put({'id': '4', 'title': 'Brave New World', 'author': 'Aldous Huxley', 'price': 9.0, 'in_stock': True})
+        self.api.put(dict(self.api.books['1'], title='Gatsby', isbn='978'))
+        self.api.delete('2')
+        
+        self.assertEqual(replica.sync(), 3)
+        self.assertEqual(replica.position, ('e1', 3))
+        self.assertEqual(replica.all(), list(self.api.books.values()))
+        self.assertEqual(replica.get('1')['isbn'], '978')
+        self.assertEqual([b['id'] for b in replica.search('great')], [])
+        self.assertEqual([b['id'] for b in replica.search('gatsby')], ['1'])
+        self.assertEqual(replica.sync(), 0)
+        replica.close()
+        
+        # Reopened, the replica continues from where it was
+        self.api.delete('3')
+        replica = self.open_replica()
+        self.assertEqual(replica.sync(), 1)
+        self.assertEqual(self.api.downloads, 1)
+        self.assertEqual([b['id'] for b in replica.all()], ['1', '4'])
+    
+    def test_resnapshot(self):
+        """Test that the catalog is downloaded again when the feed can't continue."""
+        replica = self.open_replica()
+        replica.sync()
+        self.api.epoch = 'e2'
+        self.api.books.pop('1')
+        
+        self.assertEqual(replica.sync(), -1)
+        self.assertEqual(self.api.downloads, 2)
+        self.assertEqual(replica.position, ('e2', 0))
+        self.assertIsNone(replica.get('1'))
+        self.assertEqual(replica.search('gatsby'), [])
+
+    def test_close_while_following(self):
+        """Test that a long-poll returning after close() leaves the closed replica alone."""
+        replica = self.open_replica()
+        replica.sync()
+        polling, release = threading.Event(), threading.Event()
+        get_changes = self.api.get_changes
+
+        def long_poll(since=None, epoch=None, wait=None):
+            if wait:
+                polling.set()
+                release.wait(5)
+            return get_changes(since, epoch, wait)
+        self.api.get_changes = long_poll
+        errors = []
+        patch('threading.excepthook', lambda args: errors.append(args.exc_value)).start()
+        self.addCleanup(patch.stopall)
+
+        replica.follow(wait=1)
+        self.assertTrue(polling.wait(5))
+        follower = replica._follower
+        with patch('replica.CLOSE_TIMEOUT', 0.1):
+            replica.close()
+        self.api.put({'id': '4', 'title': 'Brave New World', 'author': 'Aldous Huxley'})
+        release.set()
+        follower.join(5)
+
+        self.assertFalse(follower.is_alive())
+        self.assertEqual(errors, [])
+        self.assertEqual(replica.changes_applied, 0)
+
+
+class TestAsyncBookstoreClient(unittest.TestCase):
+    """Test cases for the asyncio client."""
+    
+    def start_server(self, responses, delay=0):
+        """Start a stub server that is shut down after the test."""
+        server = StubServer(responses, delay=delay)
+        self.addCleanup(server.close)
+        return server
+    
+    def run_client(self, server, work, **options):
+        """Run a coroutine function with a client for the stub server."""
+        async def main():
+            async with AsyncBookstoreClient(server.url, backoff_factor=0, backoff_jitter=0, **options) as bookstore:
+                return await work(bookstore), bookstore
+        return asyncio.run(main())
+    
+    def test_get_books_by_ids(self):
+        """Test the fan-out: order kept, missing books as None, bounded concurrency."""
+        def respond(method, path):
+            book_id = path.rsplit('/', 1)[1]
+            if book_id.startswith('missing'):
+                return 404, {'error': 'Not found'}
+            return 200, {'id': book_id}
+        server = self.start_server(respond, delay=0.05)
+        ids = [str(i) for i in range(40)] + ['missing']
+        
+        start = time.perf_counter()
+        books, bookstore = self.run_client(server, lambda c: c.get_books_by_ids(ids), concurrency=10)
+        elapsed = time.perf_counter() - start
+        
+        self.assertEqual(books, [{'id': i} for i in ids[:-1]] + [None])
+        self.assertLessEqual(server.max_in_flight, 10)
+        # About five rounds of 10, not 41 requests one after another
+        self.assertLess(elapsed, 41 * 0.05 / 2)
+        # Connections are kept alive and reused
+        self.assertLessEqual(bookstore.connections_opened, 10)
+        self.assertEqual(len(server.connections), bookstore.connections_opened)
+    
+    def test_mutations_and_search(self):
+        """Test that the mutation and search calls send the right requests."""
+        def respond(method, path):
+            if method == 'DELETE':
+                return 200, {'message': 'deleted'}
+            return (201 if method == 'POST' else 200), {'id': '1', 'title': 'T'}
+        server = self.start_server(respond)
+        
+        async def work(bookstore):
+            return [
+                await bookstore.add_book({'title': 'T'}),
+                await bookstore.update_book('1', {'price': 2.0}),
+                await bookstore.search_books('t t', limit=5),
+                await bookstore.delete_book('1'),
+            ]
+        results, bookstore = self.run_client(server, work)
+        
+        self.assertEqual(results[3], 'deleted')
+        self.assertEqual([r[:2] for r in server.requests], [
+            ('POST', '/api/books'),
+            ('PUT', '/api/books/1'),
+            ('GET', '/api/books/search?query=t+t&limit=5'),
+            ('DELETE', '/api/books/1'),
+        ])
+        self.assertEqual(bookstore.connections_opened, 1)
+    
+    def test_errors(self):
+        """Test retries of idempotent requests and the exceptions raised."""
+        server = self.start_server([(503, {}), (200, [])])
+        books, _ = self.run_client(server, lambda c: c.get_all_books())
+        self.assertEqual(books, [])
+        self.assertEqual(len(server.requests), 2)
+        
+        server = self.start_server([(503, {})])
+        with self.assertRaises(requests.exceptions.HTTPError) as caught:
+            self.run_client(server, lambda c: c.add_book({'title': 'T'}))
+        self.assertEqual(caught.exception.response.status_code, 503)
+        self.assertEqual(len(server.requests), 1)
+        
+        bookstore = AsyncBookstoreClient(server.url.replace(str(server.server.server_port), '1'), retries=0)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            asyncio.run(bookstore.get_book('1'))
+
+    def test_timeouts_and_bad_bodies(self):
+        """Test that timeouts and undecodable bodies raise requests exceptions without a retry."""
+        server = self.start_server([(201, {'id': '1'})], delay=0.5)
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            self.run_client(server, lambda c: c.add_book({'title': 'T'}), read_timeout=0.1)
+        self.assertEqual(len(server.requests), 1)
+
+        server = self.start_server([(200, {'id': '1'}, {'Content-Encoding': 'gzip'})])
+        with self.assertRaises(requests.exceptions.ContentDecodingError):
+            self.run_client(server, lambda c: c.get_book('1'))
+        self.assertEqual(len(server.requests), 1)
+
+    def test_book_ids_are_quoted(self):
+        """Test that book IDs are escaped in request paths."""
+        server = self.start_server([(200, {'id': 'a/b c'})])
+
+        async def work(bookstore):
+            await bookstore.get_book('a/b c')
+            await bookstore.update_book('a/b c', {'price': 2.0})
+            await bookstore.delete_book('a/b c')
+        self.run_client(server, work)
+
+        self.assertEqual([r[1] for r in server.requests], ['/api/books/a%2Fb%20c'] * 3)
+
+
+class FakeBatchClient:
+    """Records batches sent by bulk imports; can refuse books or fail."""
+    
+    def __init__(self, refuse_title=None, fail_after=None, max_batch=None):
+        self.books = []
+        self.max_batch = max_batch
+        self.batches = 0
+        self.refuse_title = refuse_title
+        self.fail_after = fail_after
+        self.lock = threading.Lock()
+    
+    def batch(self, operations):
+        with self.lock:
+            self.batches += 1
+            if self.fail_after is not None and self.batches > self.fail_after:
+                raise requests.exceptions.ConnectionError("down")
+            books = [op['book'] for op in operations]
+            if self.max_batch is not None and len(books) > self.max_batch:
+                raise requests.exceptions.HTTPError(response=self.response(400, {
+                    'error': 'Bad Request', 'message': f"A batch can contain at most {self.max_batch} operations"
+                }))
+            if any(book['title'] == self.refuse_title for book in books):
+                raise requests.exceptions.HTTPError(response=self.response(400, {'results': [
+                    {'status': 400, 'error': 'Refused'} if book['title'] == self.refuse_title
+                    else {'status': 424, 'error': 'Not applied'} for book in books
+                ]}))
+            self.books.extend(books)
+            return [{'status': 201, 'book': book} for book in books]
+    
+    def iter_all_books(self):
+        return iter(self.books)
+    
+    def close(self):
+        pass
+    
+    @staticmethod
+    def response(status, body):
+        response = requests.Response()
+        response.status_code = status
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(body).encode()
+        return response
+
+
+class TestBulk(unittest.TestCase):
+    """Tests for bulk import and export."""
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.stdout = patch('sys.stdout', new_callable=io.StringIO).start()
+        self.addCleanup(patch.stopall)
+    
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+    
+    def test_import_csv(self):
+        """Test validation, batching and books refused by the server."""
+        rows = [f'Book {i},Author {i},{i}.50,y' for i in range(10)]
+        rows[3] = 'Book 3,Author 3,cheap,y'
+        path = self.write('books.csv', 'title,author,price,in_stock\n' + '\n'.join(rows) + '\n')
+        bookstore = FakeBatchClient(refuse_title='Book 5')
+        
+        report = import_books(bookstore, path, batch_size=4, concurrency=2)
+        summary = report.summary()
+        
+        self.assertEqual((summary['rows'], summary['invalid'], summary['rejected'], summary['imported']), (10, 1, 1, 8))
+        self.assertEqual(summary['batches'], 3)
+        self.assertEqual(sorted(book['title'] for book in bookstore.books),
+                         [f'Book {i}' for i in range(10) if i not in (3, 5)])
+        self.assertEqual(bookstore.books[0]['price'], '0.50')
+        self.assertIn('Row 4', self.stdout.getvalue())
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+    
+    def test_resume(self):
+        """Test that an interrupted import resumes after the rows already sent."""
+        lines = [json.dumps({'title': f'Book {i}', 'author': 'A', 'price': 1.25, 'in_stock': False}) for i in range(10)]
+        path = self.write('books.jsonl', '\n'.join(lines) + '\n')
+        
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            import_books(FakeBatchClient(fail_after=2), path, batch_size=3, concurrency=1)
+        self.assertTrue(os.path.exists(path + '.checkpoint'))
+        
+        bookstore = FakeBatchClient()
+        report = import_books(bookstore, path, batch_size=3, concurrency=1, resume=True)
+        self.assertEqual(report.skipped, 6)
+        self.assertEqual([book['title'] for book in bookstore.books], [f'Book {i}' for i in range(6, 10)])
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+    
+    def test_command_line_resume_hint(self):
+        """Test that a network failure during an import exits nonzero with the --resume hint."""
+        lines = [json.dumps({'title': f'Book {i}', 'author': 'A', 'price': 1.25, 'in_stock': True}) for i in range(10)]
+        path = self.write('books.jsonl', '\n'.join(lines) + '\n')
+        
+        with patch('bulk.BookstoreClient', return_value=FakeBatchClient(fail_after=1)):
+            status = bulk_main(['import', path, '--batch-size', '3', '--concurrency', '1'])
+        self.assertEqual(status, 1)
+        self.assertIn('Request failed: down', self.stdout.getvalue())
+        self.assertIn('--resume', self.stdout.getvalue())
+        self.assertEqual(Checkpoint.load(path + '.checkpoint', path).done, 3)
+    
+    def test_batch_rejected_as_a_whole(self):
+        """Test that a 400 without per-book results stops the import without losing rows."""
+        lines = [json.dumps({'title': f'Book {i}', 'author': 'A', 'price': '1.00', 'in_stock': 'y'}) for i in range(12)]
+        path = self.write('books.jsonl', '\n'.join(lines) + '\n')
+        
+        with self.assertRaises(requests.exceptions.HTTPError):
+            import_books(FakeBatchClient(max_batch=5), path, batch_size=10, concurrency=1)
+        checkpoint = Checkpoint.load(path + '.checkpoint', path)
+        self.assertEqual((checkpoint.done, checkpoint.ranges), (0, []))
+        
+        with self.assertRaises(ValueError):
+            import_books(FakeBatchClient(), path, batch_size=10001)
+        with self.assertRaises(SystemExit), patch('sys.stderr', new_callable=io.StringIO):
+            bulk_main(['import', path, '--batch-size', '10001'])
+    
+    def test_checkpoint_out_of_order(self):
+        """Test that batches finishing out of order are merged into the watermark."""
+        checkpoint = Checkpoint(os.path.join(self.dir, 'progress'), 'books.csv')
+        checkpoint.mark(4, 8)
+        self.assertEqual((checkpoint.done, checkpoint.ranges), (0, [(4, 8)]))
+        self.assertTrue(checkpoint.is_done(5))
+        self.assertFalse(checkpoint.is_done(2))
+        checkpoint.mark(0, 4)
+        self.assertEqual((checkpoint.done, checkpoint.ranges), (8, []))
+        
+        loaded = Checkpoint.load(checkpoint.path, 'books.csv')
+        self.assertEqual(loaded.done, 8)
+        with self.assertRaises(ValueError):
+            Checkpoint.load(checkpoint.path, 'other.csv')
+    
+    def test_rate_limiter(self):
+        """Test that calls are spaced by the rate."""
+        now, sleeps = [0.0], []
+        limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleeps.append)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(sleeps, [0.25, 0.5])
+    
+    def test_export_round_trip(self):
+        """Test that an exported CSV file imports the same books."""
+        source = FakeBatchClient()
+        source.books = [
+            {'id': 'a1', 'title': 'Dune, Part 1', 'author': 'Herbert', 'price': 9.5, 'in_stock': True},
+            {'id': 'b2', 'title': 'Emma', 'author': 'Austen', 'price': 3, 'in_stock': False}
+        ]
+        for name in ('books.csv', 'books.jsonl'):
+            path = os.path.join(self.dir, name)
+            self.assertEqual(export_books(source, path), 2)
+            target = FakeBatchClient()
+            import_books(target, path)
+            self.assertEqual(target.books, [
+                {'title': 'Dune, Part 1', 'author': 'Herbert', 'price': '9.50', 'in_stock': True},
+                {'title': 'Emma', 'author': 'Austen', 'price': '3.00', 'in_stock': False}
+            ])
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Tests for request coalescing and request timings."""
+    
+    def start_server(self, responses, delay=0):
+        server = StubServer(responses, delay)
+        self.addCleanup(server.close)
+        bookstore = BookstoreClient(server.url, retries=0)
+        self.addCleanup(bookstore.close)
+        return server, bookstore
+    
+    def run_threads(self, target, count=8):
+        results, errors = [None] * count, [None] * count
+        
+        def run(i):
+            try:
+                results[i] = target()
+            except Exception as e:
+                errors[i] = e
+        
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+    
+    def test_concurrent_gets_share_one_request(self):
+        """Test that concurrent gets of one book send a single request."""
+        server, bookstore = self.start_server([(200, {'id': '1', 'title': 'T'})], delay=0.3)
+        results, errors = self.run_threads(lambda: bookstore.get_book('1'))
+        
+        self.assertEqual(errors, [None] * 8)
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(bookstore.flights.shared, 7)
+        # Every caller gets its own copy
+        results[0]['title'] = 'Changed'
+        self.assertTrue(all(result['title'] == 'T' for result in results[1:]))
+        
+        bookstore.get_book('1')
+        self.assertEqual(len(server.requests), 2)
+    
+    def test_errors_are_shared(self):
+        """Test that every waiting caller gets the leader's exception."""
+        server, bookstore = self.start_server([(404, {'error': 'Not Found'})], delay=0.3)
+        _, errors = self.run_threads(lambda: bookstore.get_book('1'))
+        self.assertEqual(len(server.requests), 1)
+        self.assertTrue(all(isinstance(e, requests.exceptions.HTTPError) for e in errors))
+    
+    def test_forget(self):
+        """Test that callers after a mutation don't join a flight that started before it."""
+        flights = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        
+        def slow_call():
+            started.set()
+            release.wait()
+            return 'old'
+        
+        thread = threading.Thread(target=flights.do, args=(('/books/1', ()), slow_call))
+        thread.start()
+        started.wait()
+        flights.forget('/books/1')
+        self.assertEqual(flights.do(('/books/1', ()), lambda: 'new'), 'new')
+        release.set()
+        thread.join()
+        self.assertEqual((flights.calls, flights.shared), (2, 0))
+    
+    def test_profile(self):
+        """Test that requests are split into timed phases."""
+        server = StubServer([(200, {'id': '1'})])
+        self.addCleanup(server.close)
+        profile = ClientProfile()
+        with BookstoreClient(server.url, retries=0, profile=profile) as bookstore:
+            for _ in range(3):
+                bookstore.get_book('1')
+        
+        summary = profile.summary()
+        self.assertEqual(profile.requests, 3)
+        self.assertEqual(summary['connect']['count'], 1)
+        for phase in ('ttfb', 'download', 'decode'):
+            self.assertEqual(summary[phase]['count'], 3)
+        self.assertIn('Request timings (3 requests, 1 new connections)', profile.report())
+    
+    def test_histogram(self):
+        """Test histogram buckets and percentiles."""
+        histogram = Histogram()
+        for seconds in (0.0002, 0.0008, 0.003, 0.004, 20):
+            histogram.add(seconds)
+        self.assertEqual(histogram.percentile(0.5), 5)
+        self.assertEqual(histogram.percentile(1.0), 20000)
+        self.assertEqual(len(list(histogram.lines())), len(histogram.counts) - 1)
+
+
+class TestCommandLine(unittest.TestCase):
+    """Tests for the scriptable commands."""
+    
+    def run_main(self, server, *argv):
+        """Run client.main and return (exit status, stdout, stderr)."""
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with patch.object(client, '_default_client', None), patch.object(client, '_api_url', client._api_url), \
+                patch('sys.stdout', stdout), patch('sys.stderr', stderr):
+            try:
+                status = client.main(['--url', server.url, *argv])
+            except SystemExit as e:
+                status = e.code
+            finally:
+                if client._default_client is not None:
+                    client._default_client.close()
+        return status, stdout.getvalue(), stderr.getvalue()
+    
+    def start_server(self, responses):
+        server = StubServer(responses)
+        self.addCleanup(server.close)
+        return server
+    
+    def test_list_streams_pages(self):
+        """Test that list writes every page as one JSON array."""
+        def respond(method, path):
+            if 'cursor=' in path:
+                return 200, [{'id': '2'}]
+            return 200, [{'id': '1'}], {'X-Next-Cursor': 'c1'}
+        server = self.start_server(respond)
+        
+        status, out, _ = self.run_main(server, 'list', '--out-of-stock', '--max-price', '20')
+        self.assertEqual(status, 0)
+        self.assertEqual(json.loads(out), [{'id': '1'}, {'id': '2'}])
+        self.assertIn('in_stock=false', server.requests[0][1])
+        self.assertIn('max_price=20.0', server.requests[0][1])
+        
+        status, out, _ = self.run_main(server, 'list', '--format', 'jsonl')
+        self.assertEqual(out.splitlines(), ['{"id": "1"}', '{"id": "2"}'])
+    
+    def test_get_and_errors(self):
+        """Test get, and the exit status of failed requests."""
+        server = self.start_server([(200, {'id': '1', 'title': 'T'}), (404, {'error': 'Not Found', 'message': 'Book not found'})])
+        status, out, _ = self.run_main(server, 'get', '1')
+        self.assertEqual((status, json.loads(out)), (0, {'id': '1', 'title': 'T'}))
+        
+        status, out, err = self.run_main(server, 'get', '2')
+        self.assertEqual((status, out), (1, ''))
+        self.assertIn('404: Book not found', err)
+    
+    def test_add_and_update(self):
+        """Test that add and update validate and send only the given fields."""
+        server = self.start_server([(201, {'id': '9'}), (200, {'id': '9'})])
+        status, out, _ = self.run_main(server, 'add', '--title', 'Dune', '--author', 'Herbert',
+                                       '--price', '9.99', '--in-stock', 'n')
+        self.assertEqual((status, json.loads(out)), (0, {'id': '9'}))
+        status, _, _ = self.run_main(server, 'update', '9', '--in-stock', 'Y')
+        self.assertEqual(status, 0)
+        self.assertEqual([request[:2] for request in server.requests], [('POST', '/api/books'), ('PUT', '/api/books/9')])
+        
+        status, _, err = self.run_main(server, 'add', '--title', 'Dune', '--author', 'Herbert', '--price', '9.9')
+        self.assertEqual(status, 2)
+        self.assertIn('price is not in valid format', err)
+        status, _, _ = self.run_main(server, 'update', '9')
+        self.assertEqual(status, 2)
+        self.assertEqual(len(server.requests), 2)
+    
+    def test_heavy_modules_load_lazily(self):
+        """Test that importing the client and --help load neither requests nor colorama."""
+        code = ("import sys, client; client.build_parser().format_help(); "
+                "print(' '.join(m for m in ('requests.sessions', 'urllib3', 'colorama.ansi', 'sqlite3') if m in sys.modules))")
+        result = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '')
+
+
 if __name__ == '__main__':
     print("Running tests for Bookstore Client implementation...")
     unittest.main() 
\ No newline at end of file